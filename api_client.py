@@ -0,0 +1,305 @@
+# outbound requests to the Telegram API (installed as apihelper.CUSTOM_REQUEST_SENDER):
+# messages to a chat are limited per chat and globally by token buckets, waiting requests are sent
+# by priority, 429 answers are retried after retry_after, connections are kept alive in one pool
+import contextlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+
+# Telegram allows about 30 messages per second in total and about 1 message per second to one chat
+# (with short bursts), a bucket lets through up to burst + rate messages in one second
+GLOBAL_RATE = 25
+GLOBAL_BURST = 5
+CHAT_RATE = 1
+CHAT_BURST = 2
+
+# threads sending the requests and connections kept alive
+WORKERS = 16
+POOL_SIZE = 32
+
+# buckets of idle chats are dropped when there are more of them
+MAX_BUCKETS = 10000
+
+# how many times a request is repeated after 429 before the error is returned to telebot
+MAX_RETRIES = 3
+
+# priorities, the smaller is sent first
+HIGH, NORMAL, LOW = 0, 1, 2
+
+logger = logging.getLogger('main.api_client')
+
+_local = threading.local()
+
+
+# priority of the requests made by the current thread inside the block, e.g. LOW for mass mailing
+@contextlib.contextmanager
+def priority(value):
+    previous = getattr(_local, 'priority', NORMAL)
+    _local.priority = value
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+        # no tokens until this time (set by retry_after)
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # seconds until a token is available
+    def wait_time(self, now):
+        self._refill(now)
+        return max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class Request:
+
+    def __init__(self, priority, number, chat_id, args):
+        self.priority = priority
+        self.number = number
+        self.chat_id = chat_id
+        self.args = args
+        self.retries = 0
+        self.queued_at = time.monotonic()
+
+        self.response = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ApiClient:
+
+    def __init__(self, workers=WORKERS, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, pool_size=POOL_SIZE):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._condition = threading.Condition()
+        self._numbers = itertools.count()
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic())
+
+        # chat id -> waiting requests of the chat (they are sent in order, one at a time)
+        self._queues = {}
+        self._buckets = {}
+        # chats with a request being sent
+        self._busy = set()
+        # (priority, number, chat id) of the first request of every chat that isn`t busy,
+        # chats without tokens wait in _delayed as (time of the next token, priority, number, chat id)
+        self._ready = []
+        self._delayed = []
+
+        self._threads = [threading.Thread(target=self._work, name=f'api-{i}', daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0, 'wait_time': 0.0}
+
+    # the signature of apihelper.CUSTOM_REQUEST_SENDER
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        args = (method, url, params, files, timeout, proxies)
+        chat_id = (params or {}).get('chat_id')
+
+        # answers to callbacks, getUpdates and so on aren`t limited
+        if chat_id is None:
+            return self._send_unlimited(args)
+
+        request = Request(getattr(_local, 'priority', NORMAL), next(self._numbers), chat_id, args)
+        self._enqueue(request)
+        request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.response
+
+    def metrics(self):
+        with self._condition:
+            metrics = dict(self.stats)
+            metrics['queued'] = sum(len(queue) for queue in self._queues.values())
+            metrics['chats'] = len(self._queues)
+
+        return metrics
+
+    def _send_unlimited(self, args):
+        for attempt in range(MAX_RETRIES + 1):
+            response = self._request(args)
+            retry_after = retry_after_of(response)
+
+            if retry_after is None or attempt == MAX_RETRIES:
+                return response
+
+            time.sleep(retry_after)
+
+    def _request(self, args):
+        method, url, params, files, timeout, proxies = args
+
+        # a retried upload is read from the start again
+        for value in (files or {}).values():
+            file = value[1] if isinstance(value, tuple) else value
+            if hasattr(file, 'seek'):
+                file.seek(0)
+
+        return self.session.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+
+    def _enqueue(self, request, first=False):
+        with self._condition:
+            queue = self._queues.setdefault(request.chat_id, [])
+
+            # a retried request goes before the other requests of the chat
+            if first:
+                queue.insert(0, request)
+            else:
+                queue.append(request)
+
+            if request.chat_id not in self._busy and len(queue) == 1:
+                heapq.heappush(self._ready, (request.priority, request.number, request.chat_id))
+
+            self._condition.notify()
+
+    # picks the most important request which can be sent now, waits if there is none
+    def _take(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+
+                # chats that have got a token
+                while self._delayed and self._delayed[0][0] <= now:
+                    heapq.heappush(self._ready, heapq.heappop(self._delayed)[1:])
+
+                wait = self._global.wait_time(now) if self._ready else None
+
+                while self._ready and not wait:
+                    entry = heapq.heappop(self._ready)
+                    bucket = self._bucket(entry[2], now)
+                    chat_wait = bucket.wait_time(now)
+
+                    if chat_wait:
+                        heapq.heappush(self._delayed, (now + chat_wait, *entry))
+                        continue
+
+                    request = self._queues[entry[2]].pop(0)
+                    self._global.take(now)
+                    bucket.take(now)
+                    self._busy.add(request.chat_id)
+                    return request
+
+                if self._delayed:
+                    delay = self._delayed[0][0] - now
+                    wait = min(wait, delay) if wait else delay
+
+                self._condition.wait(wait)
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    # the request of the chat is finished, the next one can be sent
+    def _release(self, chat_id):
+        with self._condition:
+            self._busy.discard(chat_id)
+            queue = self._queues.get(chat_id)
+
+            if queue:
+                heapq.heappush(self._ready, (queue[0].priority, queue[0].number, chat_id))
+            else:
+                self._queues.pop(chat_id, None)
+
+                if len(self._buckets) > MAX_BUCKETS:
+                    self._forget_buckets()
+
+            self._condition.notify()
+
+    # full buckets of idle chats are the same as no buckets
+    def _forget_buckets(self):
+        now = time.monotonic()
+
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in self._queues and bucket.wait_time(now) == 0 and bucket.tokens >= bucket.burst:
+                del self._buckets[chat_id]
+
+    def _work(self):
+        while True:
+            request = self._take()
+            started = time.monotonic()
+
+            try:
+                response = self._request(request.args)
+            except Exception as e:
+                response = None
+                request.error = e
+
+            retry_after = retry_after_of(response) if response is not None else None
+
+            if retry_after is not None and request.retries < MAX_RETRIES:
+                request.retries += 1
+                with self._condition:
+                    self.stats['retried'] += 1
+                    self._bucket(request.chat_id, time.monotonic()).block(time.monotonic() + retry_after)
+
+                logger.info('Chat %s is limited for %s s.', request.chat_id, retry_after)
+                self._enqueue(request, first=True)
+                self._release(request.chat_id)
+                continue
+
+            request.response = response
+            with self._condition:
+                self.stats['failed' if request.error or response.status_code != 200 else 'sent'] += 1
+                self.stats['wait_time'] += started - request.queued_at
+
+            request.done.set()
+            self._release(request.chat_id)
+
+
+# seconds from a 429 answer, None for other answers
+def retry_after_of(response):
+    if response.status_code != 429:
+        return None
+
+    try:
+        return response.json()['parameters']['retry_after']
+    except (ValueError, KeyError, TypeError):
+        return 1
+
+
+# makes telebot send all requests through the client, returns it
+def install(**settings):
+    client = ApiClient(**settings)
+    apihelper.CUSTOM_REQUEST_SENDER = client
+    return client
+
+
+# the client of one of the processes that send requests at the same time (e.g. lane processes of
+# workers.ShardedExecutor and their parent), each of them gets its share of the global limit, updates
+# of a chat are handled by one lane, so the chat limits stay as they are
+def install_shared(processes):
+    return install(global_rate=GLOBAL_RATE / processes, global_burst=max(1, GLOBAL_BURST / processes))
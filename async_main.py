@@ -0,0 +1,275 @@
+# asyncio entry point: updates are received and API requests are sent by one event loop,
+# the handlers from main.py run in a dedicated thread pool (they use sqlite3, which is blocking)
+# usage: python async_main.py
+import asyncio
+import json
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from telebot import apihelper
+from telebot import types
+
+import api_client
+import database
+import main
+import metrics
+import overdue
+import reminders
+import write_behind
+
+from workers import get_user_id
+
+# how many handlers can run at the same time, every one of them holds a thread (and a DB connection)
+WORKERS = 32
+
+# seconds, long polling timeout of getUpdates
+POLL_TIMEOUT = 30
+
+# connections to the API kept alive by the session
+CONNECTIONS_LIMIT = 100
+
+# updates received but not handled yet, polling waits for a free slot when there are that many
+MAX_PENDING = 1000
+
+# seconds to wait after a failed getUpdates (unless the API says how long), doubled after every failure
+# in a row up to MAX_RETRY_DELAY
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+# requests that are sent without waiting for the answer, handlers don`t use their results
+# (edits aren`t here, edits.Tracker remembers an edit only if it succeeded)
+FIRE_AND_FORGET = {'answerCallbackQuery', 'sendChatAction'}
+
+logger = logging.getLogger('main.async_main')
+
+
+# looks like requests.Response for telebot.apihelper
+class Response:
+
+    def __init__(self, status_code, text, reason=''):
+        self.status_code = status_code
+        self.text = text
+        self.reason = reason
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# replaces the blocking requests session of telebot (apihelper.CUSTOM_REQUEST_SENDER),
+# requests made from handler threads are executed by the event loop with the limits of api_client.py
+# (per chat and global token buckets, 429 answers are retried after retry_after)
+class AsyncSender:
+
+    def __init__(self, loop, session):
+        self.loop = loop
+        self.session = session
+
+        self._global = api_client.TokenBucket(api_client.GLOBAL_RATE, api_client.GLOBAL_BURST, time.monotonic())
+        # chat id -> bucket, only the event loop uses them
+        self._buckets = {}
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        future = asyncio.run_coroutine_threadsafe(self.request(method, url, params, files), self.loop)
+
+        if url.rsplit('/', 1)[-1] in FIRE_AND_FORGET:
+            future.add_done_callback(self._log_error)
+            return Response(200, '{"ok": true, "result": true}')
+
+        return future.result()
+
+    async def request(self, method, url, params=None, files=None):
+        chat_id = (params or {}).get('chat_id')
+
+        for attempt in range(api_client.MAX_RETRIES + 1):
+            # answers to callbacks, getUpdates and so on aren`t limited
+            bucket = await self._take(chat_id) if chat_id is not None else None
+
+            response = await self._send(method, url, params, files)
+            retry_after = api_client.retry_after_of(response)
+
+            if retry_after is None or attempt == api_client.MAX_RETRIES:
+                return response
+
+            logger.info('Chat %s is limited for %s s.', chat_id, retry_after)
+            if bucket is not None:
+                bucket.block(time.monotonic() + retry_after)
+            else:
+                await asyncio.sleep(retry_after)
+
+    # waits until the chat and the bot have a token, returns the bucket of the chat
+    async def _take(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > api_client.MAX_BUCKETS:
+                self._forget_buckets()
+            bucket = self._buckets[chat_id] = api_client.TokenBucket(api_client.CHAT_RATE, api_client.CHAT_BURST,
+                                                                     time.monotonic())
+
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now), self._global.wait_time(now))
+
+            if not wait:
+                bucket.take(now)
+                self._global.take(now)
+                return bucket
+
+            await asyncio.sleep(wait)
+
+    # full buckets are the same as no buckets
+    def _forget_buckets(self):
+        now = time.monotonic()
+
+        for chat_id, bucket in list(self._buckets.items()):
+            if bucket.wait_time(now) == 0 and bucket.tokens >= bucket.burst:
+                del self._buckets[chat_id]
+
+    async def _send(self, method, url, params, files):
+        if files:
+            data = aiohttp.FormData()
+            for key, value in (params or {}).items():
+                data.add_field(key, str(value))
+            for key, value in files.items():
+                filename, file = value if isinstance(value, tuple) else (key, value)
+                # a retried upload is read from the start again
+                if hasattr(file, 'seek'):
+                    file.seek(0)
+                data.add_field(key, file, filename=filename)
+        else:
+            data = {key: str(value) for key, value in (params or {}).items()}
+
+        async with self.session.request(method, url, data=data) as response:
+            return Response(response.status, await response.text(), response.reason)
+
+    @staticmethod
+    def _log_error(future):
+        try:
+            result = future.result()
+            if result.status_code != 200:
+                logger.warning('API request failed: %s %s', result.status_code, result.text)
+        except Exception as e:
+            logger.warning('API request failed: %r', e)
+
+
+# seconds to wait before the next getUpdates, retry_after of the answer if the API has sent it
+def retry_delay(result, failures):
+    try:
+        return result['parameters']['retry_after']
+    except (KeyError, TypeError):
+        return min(RETRY_DELAY * 2 ** (failures - 1), MAX_RETRY_DELAY)
+
+
+class AsyncRunner:
+
+    def __init__(self, bot, workers=WORKERS, max_pending=MAX_PENDING):
+        self.bot = bot
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='handler')
+
+        # a slot is taken for every received update until it`s handled, so the offset is moved past
+        # at most max_pending updates that aren`t handled yet
+        self.slots = asyncio.Semaphore(max_pending)
+
+        # user id -> the last task of the user, updates of one user are handled one by one
+        self.user_tasks = {}
+        self.offset = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        # handlers are executed by our executor, not by telebot`s thread pool
+        self.bot.threaded = False
+
+        sweeper = overdue.Sweeper()
+        sweeper.start()
+        reminders.start(main.send_reminder)
+
+        if write_behind.ENABLED:
+            write_behind.start()
+            metrics.add_gauges('write_behind', write_behind.writer.metrics)
+
+        connector = aiohttp.TCPConnector(limit=CONNECTIONS_LIMIT)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            apihelper.CUSTOM_REQUEST_SENDER = AsyncSender(loop, session)
+            metrics.start()
+            try:
+                await self.poll(session)
+            finally:
+                apihelper.CUSTOM_REQUEST_SENDER = None
+                await asyncio.gather(*self.user_tasks.values(), return_exceptions=True)
+                await loop.run_in_executor(self.executor, main.tracker.flush)
+
+                reminders.stop()
+                sweeper.stop()
+                self.executor.shutdown()
+                write_behind.stop()
+                metrics.stop()
+                database.close_all()
+
+    async def poll(self, session):
+        url = (apihelper.API_URL or 'https://api.telegram.org/bot{0}/{1}').format(self.bot.token, 'getUpdates')
+        timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+
+        failures = 0
+
+        while True:
+            try:
+                async with session.get(url, params={'offset': self.offset, 'timeout': POLL_TIMEOUT},
+                                       timeout=timeout) as response:
+                    status = response.status
+                    result = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.warning('getUpdates failed: %r', e)
+                status, result = None, None
+
+            # wrong token (401), another instance polling (409), errors of the API
+            if status != 200 or not isinstance(result, dict) or not result.get('ok'):
+                failures += 1
+                if status is not None:
+                    logger.warning('getUpdates failed: %s %s', status, result)
+                await asyncio.sleep(retry_delay(result, failures))
+                continue
+
+            failures = 0
+            for update in result['result']:
+                await self.slots.acquire()
+                self.offset = max(self.offset, update['update_id'] + 1)
+                self.submit(types.Update.de_json(update))
+
+    def submit(self, update):
+        user_id = get_user_id(update)
+
+        previous = self.user_tasks.get(user_id)
+        task = asyncio.create_task(self.handle(update, previous))
+        self.user_tasks[user_id] = task
+
+        task.add_done_callback(lambda done: self._forget(user_id, done))
+        return task
+
+    # the slot of the update (see poll()) is released when it`s handled
+    async def handle(self, update, previous=None):
+        try:
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, main.handle_update, update)
+        except Exception:
+            # logged by main.handle_update
+            pass
+        finally:
+            self.slots.release()
+
+    def _forget(self, user_id, task):
+        if self.user_tasks.get(user_id) is task:
+            del self.user_tasks[user_id]
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(AsyncRunner(main.bot).run())
+    except KeyboardInterrupt:
+        pass
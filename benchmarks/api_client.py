@@ -0,0 +1,162 @@
+# sends a burst of messages to a local stub of the Telegram API which answers 429 like Telegram does,
+# with and without api_client: counts 429 errors, connections and the latency of interactive messages
+# usage: python -m benchmarks.api_client
+import collections
+import json
+import statistics
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from telebot import TeleBot
+from telebot import apihelper
+
+import api_client
+
+# bulk messages (like reminders) to CHATS chats, then one interactive message to each of INTERACTIVE chats
+CHATS = 100
+MESSAGES_PER_CHAT = 3
+INTERACTIVE = 20
+
+# limits of the stub, messages in any second
+STUB_CHAT_LIMIT = 3
+STUB_GLOBAL_LIMIT = 30
+
+
+class StubApi(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    lock = threading.Lock()
+    accepted = []
+    chat_times = collections.defaultdict(collections.deque)
+    all_times = collections.deque()
+    stats = collections.Counter()
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            self.stats['connections'] += 1
+
+    def do_POST(self):
+        self.do_GET()
+
+    def do_GET(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+
+        query = dict(pair.split('=', 1) for pair in self.path.split('?', 1)[1].split('&')) if '?' in self.path else {}
+        chat_id = int(query.get('chat_id', 0))
+        now = time.monotonic()
+
+        with self.lock:
+            chat = self.chat_times[chat_id]
+            for times in (chat, self.all_times):
+                while times and times[0] < now - 1:
+                    times.popleft()
+
+            if len(chat) >= STUB_CHAT_LIMIT or len(self.all_times) >= STUB_GLOBAL_LIMIT:
+                self.stats['429'] += 1
+                return self._answer(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                                          'parameters': {'retry_after': 1}})
+
+            chat.append(now)
+            self.all_times.append(now)
+            self.accepted.append((chat_id, query.get('text')))
+
+        self._answer(200, {'ok': True, 'result': {'message_id': 1, 'date': 0, 'text': '',
+                                                  'chat': {'id': chat_id, 'type': 'private'}}})
+
+    def _answer(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(bot):
+    errors = collections.Counter()
+    latencies = {'bulk': [], 'interactive': []}
+
+    def send(chat_id, texts, kind, priority):
+        with api_client.priority(priority):
+            for text in texts:
+                start = time.perf_counter()
+                try:
+                    bot.send_message(chat_id, text)
+                    latencies[kind].append(time.perf_counter() - start)
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+
+    threads = [threading.Thread(target=send, args=(chat, [f'{chat}-{i}' for i in range(MESSAGES_PER_CHAT)],
+                                                   'bulk', api_client.LOW))
+               for chat in range(1, CHATS + 1)]
+    threads += [threading.Thread(target=send, args=(chat, [f'{chat}-0'], 'interactive', api_client.NORMAL))
+                for chat in range(CHATS + 1, CHATS + INTERACTIVE + 1)]
+
+    start = time.perf_counter()
+    for thread in threads[:CHATS]:
+        thread.start()
+
+    # users click while the bulk is being sent
+    time.sleep(0.5)
+    for thread in threads[CHATS:]:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return time.perf_counter() - start, errors, latencies
+
+
+def reset_stub():
+    StubApi.accepted.clear()
+    StubApi.chat_times.clear()
+    StubApi.all_times.clear()
+    StubApi.stats.clear()
+
+
+# messages of every chat were accepted in the order they were sent
+def in_order():
+    sent = collections.defaultdict(list)
+    for chat_id, text in StubApi.accepted:
+        sent[chat_id].append(int(text.split('-')[1]))
+
+    return all(numbers == sorted(numbers) for numbers in sent.values())
+
+
+def median_ms(values):
+    return statistics.median(values) * 1000 if values else float('nan')
+
+
+if __name__ == '__main__':
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    apihelper.API_URL = f'http://127.0.0.1:{server.server_address[1]}/bot{{0}}/{{1}}'
+    test_bot = TeleBot('1:stub', threaded=False)
+
+    print(f'{CHATS} chats x {MESSAGES_PER_CHAT} bulk messages, {INTERACTIVE} interactive messages')
+    print(f'{"":>12} {"seconds":>8} {"errors":>7} {"429 at API":>11} {"connections":>12} '
+          f'{"bulk, ms":>9} {"interactive, ms":>16} {"in order":>9}')
+
+    for name in ('plain', 'api_client'):
+        reset_stub()
+        apihelper.CUSTOM_REQUEST_SENDER = None
+        if name == 'api_client':
+            api_client.install()
+
+        seconds, failures, waits = run(test_bot)
+        print(f'{name:>12} {seconds:>8.1f} {sum(failures.values()):>7} {StubApi.stats["429"]:>11} '
+              f'{StubApi.stats["connections"]:>12} {median_ms(waits["bulk"]):>9.0f} '
+              f'{median_ms(waits["interactive"]):>16.0f} {str(in_order()):>9}')
+
+    apihelper.CUSTOM_REQUEST_SENDER = None
+    server.shutdown()
@@ -0,0 +1,345 @@
+# drives the real handlers of main.py with synthetic updates against an in-process fake Telegram API and
+# a temporary database: p50/p99 latency of every handler and updates per second, results are saved as JSON,
+# --compare prints the change against an older result
+# usage: python -m benchmarks.handlers [--users 50] [--lists 2] [--tasks 5] [--lanes 0] [--api-latency 0]
+#                                      [--output handlers.json] [--compare old.json]
+import argparse
+import collections
+import functools
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from datetime import date
+from datetime import timedelta
+
+from telebot import apihelper
+from telebot import types
+from telebot import version
+
+USERS = 50
+LISTS_PER_USER = 2
+TASKS_PER_LIST = 5
+
+# main.py reads its settings from the environment at import
+_directory = tempfile.TemporaryDirectory()
+os.environ.update({'TELEGRAM_TOKEN': '1:benchmark',
+                   'BOT_DB_NAME': os.path.join(_directory.name, 'benchmark.sqlite'),
+                   'BOT_LOG_FILE': os.path.join(_directory.name, 'benchmark.jsonl')})
+
+import database
+import main
+import router
+import workers
+
+_lock = threading.Lock()
+_current = threading.local()
+
+# handler name -> latencies of the updates it handled, seconds
+latencies = collections.defaultdict(list)
+failures = collections.Counter()
+api_calls = collections.Counter()
+
+_ids = itertools.count(1)
+
+
+class FakeResponse:
+
+    def __init__(self, result):
+        self.status_code = 200
+        self.reason = 'OK'
+        self.text = json.dumps({'ok': True, 'result': result})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# answers every request like Telegram does, after latency seconds
+class FakeApi:
+
+    def __init__(self, latency=0):
+        self.latency = latency
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        name = url.rsplit('/', 1)[-1]
+        params = params or {}
+
+        with _lock:
+            api_calls[name] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if name in ('sendMessage', 'editMessageText'):
+            return FakeResponse({'message_id': next(_ids), 'date': int(time.time()), 'text': params.get('text', ''),
+                                 'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'}})
+        return FakeResponse(True)
+
+
+def message(user, text):
+    update_id = next(_ids)
+    data = {'message_id': update_id, 'date': int(time.time()), 'text': text,
+            'chat': {'id': user, 'type': 'private'},
+            'from': {'id': user, 'is_bot': False, 'first_name': 'user'}}
+
+    if text.startswith('/'):
+        data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+
+    return types.Update.de_json({'update_id': update_id, 'message': data})
+
+
+# the button is pressed under the message with message_id (the same message for the same list,
+# so repeated renders of it can be skipped)
+def callback(user, data, message_id=1):
+    update_id = next(_ids)
+    return types.Update.de_json({
+        'update_id': update_id,
+        'callback_query': {'id': str(update_id), 'chat_instance': str(user), 'data': data,
+                           'from': {'id': user, 'is_bot': False, 'first_name': 'user'},
+                           'message': {'message_id': message_id, 'date': int(time.time()), 'text': '',
+                                       'chat': {'id': user, 'type': 'private'},
+                                       'from': {'id': 1, 'is_bot': True, 'first_name': 'bot'}}}})
+
+
+# updates of different users are interleaved like in real traffic, updates of one user keep their order
+def interleave(sequences):
+    return [update for step in itertools.zip_longest(*sequences) for update in step if update is not None]
+
+
+# the handler that has handled the update is remembered for handle()
+def labelled(function):
+    @functools.wraps(function)
+    def wrapper(update, *args, **kwargs):
+        name = function.__name__
+        if isinstance(update, types.CallbackQuery):
+            name = f'{name}:{router.decode(update.data)[0]}'
+
+        _current.name = name
+        return function(update, *args, **kwargs)
+
+    return wrapper
+
+
+def label_handlers():
+    for handler in main.bot.message_handlers + main.bot.callback_query_handlers:
+        handler['function'] = labelled(handler['function'])
+
+
+def handle(update):
+    _current.name = 'unhandled'
+    start = time.perf_counter()
+
+    try:
+        main.handle_update(update)
+    except Exception:
+        with _lock:
+            failures[_current.name] += 1
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            latencies[_current.name].append(elapsed)
+
+
+def register(users):
+    return interleave([[message(user, '/start'), callback(user, router.encode('sl', 'EN'))] for user in users])
+
+
+def create_lists(users, lists):
+    return interleave([[update for number in range(lists)
+                        for update in (message(user, 'CREATE NEW TODO LIST'), message(user, f'list {number}'))]
+                       for user in users])
+
+
+# tele id -> ids of the lists of the user
+def user_sheets():
+    sheets = collections.defaultdict(list)
+
+    with database.session() as cursor:
+        cursor.execute('SELECT Users.tele_id, Sheets.id FROM Sheets JOIN Users ON Users.id = Sheets.user_id '
+                       'ORDER BY Sheets.id')
+        for tele_id, sheet_id in cursor.fetchall():
+            sheets[tele_id].append(sheet_id)
+
+    return sheets
+
+
+# every task goes through the whole dialog: add task button, name, deadline, priority
+def add_tasks(sheets, tasks):
+    priorities = ('⬜', '🟩', '🟨', '🟥')
+
+    def deadline(number):
+        return (date.today() + timedelta(days=1 + number % 60)).strftime('%d.%m.%Y')
+
+    return interleave([[update for sheet_id in sheet_ids for number in range(tasks)
+                        for update in (callback(user, router.encode('at', sheet_id), sheet_id),
+                                       message(user, f'task {number}'),
+                                       message(user, deadline(number)),
+                                       message(user, priorities[number % len(priorities)]))]
+                       for user, sheet_ids in sheets.items()])
+
+
+# opens every list twice (the second render is cached and the edit is unchanged), marks its first task
+# as done and opens it again, then asks for the lists
+def browse(sheets):
+    with database.session() as cursor:
+        cursor.execute('SELECT sheet_id, MIN(id) FROM Tasks GROUP BY sheet_id')
+        first_tasks = dict(cursor.fetchall())
+
+    sequences = []
+    for user, sheet_ids in sheets.items():
+        updates = []
+
+        for sheet_id in sheet_ids:
+            updates += [callback(user, router.encode('gl', sheet_id), sheet_id),
+                        callback(user, router.encode('gl', sheet_id), sheet_id),
+                        callback(user, router.encode('md', sheet_id), sheet_id)]
+
+            if sheet_id in first_tasks:
+                updates.append(callback(user, router.encode('dn', first_tasks[sheet_id], sheet_id), sheet_id))
+            updates.append(callback(user, router.encode('gl', sheet_id), sheet_id))
+
+        updates.append(message(user, 'MY LISTS'))
+        sequences.append(updates)
+
+    return interleave(sequences)
+
+
+class Runner:
+
+    # lanes - 0 handles updates in the calling thread, otherwise by workers.ShardedExecutor
+    def __init__(self, lanes):
+        self.lanes = lanes
+        self.executor = None
+
+        if lanes:
+            self.executor = workers.ShardedExecutor(handle, lanes, queue_size=10 ** 9)
+            self.executor.start()
+
+    # returns seconds spent on the updates
+    def run(self, updates):
+        start = time.perf_counter()
+
+        if self.executor is None:
+            for update in updates:
+                try:
+                    handle(update)
+                except Exception:
+                    pass
+        else:
+            self.executor.submit(updates, block=True)
+            while self.executor.metrics()['queue_depth']:
+                time.sleep(0.001)
+
+        return time.perf_counter() - start
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.stop()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summary(values):
+    return {'count': len(values), 'p50_ms': percentile(values, 0.5) * 1000, 'p99_ms': percentile(values, 0.99) * 1000,
+            'mean_ms': statistics.fmean(values) * 1000}
+
+
+def benchmark(users, lists, tasks, lanes, api_latency):
+    apihelper.CUSTOM_REQUEST_SENDER = FakeApi(api_latency)
+    label_handlers()
+
+    # edits are sent right away, so the latency includes them
+    main.tracker.window = 0
+
+    user_ids = range(1, users + 1)
+    runner = Runner(lanes)
+    phases = {}
+
+    try:
+        for name, make in (('register', lambda: register(user_ids)),
+                           ('create lists', lambda: create_lists(user_ids, lists)),
+                           ('add tasks', lambda: add_tasks(user_sheets(), tasks)),
+                           ('browse', lambda: browse(user_sheets()))):
+            updates = make()
+            seconds = runner.run(updates)
+            phases[name] = {'updates': len(updates), 'seconds': seconds, 'updates_per_second': len(updates) / seconds}
+    finally:
+        runner.stop()
+        apihelper.CUSTOM_REQUEST_SENDER = None
+        database.close_all()
+
+    total_updates = sum(phase['updates'] for phase in phases.values())
+    total_seconds = sum(phase['seconds'] for phase in phases.values())
+
+    return {
+        'config': {'users': users, 'lists_per_user': lists, 'tasks_per_list': tasks, 'lanes': lanes,
+                   'api_latency': api_latency},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'telebot': version.__version__, 'platform': platform.platform()},
+        'total': {'updates': total_updates, 'seconds': total_seconds,
+                  'updates_per_second': total_updates / total_seconds},
+        'phases': phases,
+        'handlers': {name: dict(summary(values), failed=failures[name]) for name, values in sorted(latencies.items())},
+        'api_calls': dict(sorted(api_calls.items())),
+    }
+
+
+def change(new, old):
+    return f'{(new - old) / old * 100:+.0f}%' if old else ''
+
+
+def report(result, previous=None):
+    old_handlers = previous['handlers'] if previous else {}
+    old_phases = previous['phases'] if previous else {}
+
+    print(f'{"handler":>40} {"count":>7} {"failed":>7} {"p50, ms":>9} {"p99, ms":>9} {"p99 change":>11}')
+    for name, stats in result['handlers'].items():
+        old = old_handlers.get(name)
+        print(f'{name:>40} {stats["count"]:>7} {stats["failed"]:>7} {stats["p50_ms"]:>9.2f} {stats["p99_ms"]:>9.2f} '
+              f'{change(stats["p99_ms"], old["p99_ms"]) if old else "":>11}')
+
+    print()
+    print(f'{"phase":>40} {"updates":>7} {"seconds":>8} {"updates/s":>10} {"change":>7}')
+    for name, stats in itertools.chain(result['phases'].items(), [('total', result['total'])]):
+        old = previous['total'] if previous and name == 'total' else old_phases.get(name)
+        print(f'{name:>40} {stats["updates"]:>7} {stats["seconds"]:>8.2f} {stats["updates_per_second"]:>10.0f} '
+              f'{change(stats["updates_per_second"], old["updates_per_second"]) if old else "":>7}')
+
+    print()
+    print('API calls:', ', '.join(f'{name} {count}' for name, count in result['api_calls'].items()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the bot handlers against a fake Telegram API.')
+    parser.add_argument('--users', type=int, default=USERS)
+    parser.add_argument('--lists', type=int, default=LISTS_PER_USER, help='lists per user')
+    parser.add_argument('--tasks', type=int, default=TASKS_PER_LIST, help='tasks per list')
+    parser.add_argument('--lanes', type=int, default=0, help='lanes of workers.ShardedExecutor, 0 - no threads')
+    parser.add_argument('--api-latency', type=float, default=0, help='seconds the fake API takes to answer')
+    parser.add_argument('--output', default='handlers.json', help='file the JSON result is written to')
+    parser.add_argument('--compare', help='JSON result of an older run')
+    arguments = parser.parse_args()
+
+    older = None
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            older = json.load(file)
+
+    results = benchmark(arguments.users, arguments.lists, arguments.tasks, arguments.lanes, arguments.api_latency)
+    _directory.cleanup()
+
+    with open(arguments.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    report(results, older)
+    print(f'\nsaved to {arguments.output}')
@@ -0,0 +1,85 @@
+# load test of workers.ShardedExecutor: checks that updates of every user are handled in order
+# and measures how throughput grows with lanes
+# usage: python -m benchmarks.lanes [--processes]
+import sys
+import time
+
+from telebot import types
+
+import workers
+
+LANES = (1, 2, 4, 8, 16, 32)
+USERS = 200
+UPDATES_PER_USER = 10
+
+# seconds a handler waits for the API/database
+LATENCY = 0.002
+
+# user id -> the last handled sequence number, every user is handled by one lane,
+# so for processes it is enough to keep it in the process of the lane
+_last = {}
+
+
+def make_updates(users=USERS, per_user=UPDATES_PER_USER, first_user=1):
+    updates = []
+    update_id = 0
+
+    # users are interleaved like in real traffic
+    for number in range(per_user):
+        for user in range(first_user, first_user + users):
+            update_id += 1
+            updates.append(types.Update.de_json({
+                'update_id': update_id,
+                'message': {'message_id': update_id, 'date': 0, 'text': str(number),
+                            'chat': {'id': user, 'type': 'private'},
+                            'from': {'id': user, 'is_bot': False, 'first_name': 'user'}}}))
+
+    return updates
+
+
+# fails (and is counted in 'failed') if the update came before the previous update of the user
+def handle(update):
+    user_id = update.message.from_user.id
+    number = int(update.message.text)
+
+    time.sleep(LATENCY)
+
+    if _last.get(user_id, -1) != number - 1:
+        raise AssertionError(f'user {user_id}: update {number} after {_last.get(user_id)}')
+    _last[user_id] = number
+
+
+def measure(lanes, updates, processes=False):
+    _last.clear()
+
+    executor = workers.ShardedExecutor(handle, lanes, len(updates), processes)
+    executor.start()
+
+    # one update for every lane, so the time of starting processes isn`t measured
+    executor.submit(make_updates(lanes, 1, -lanes))
+    while executor.metrics()['queue_depth']:
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    executor.submit(updates)
+    executor.stop()
+    elapsed = time.perf_counter() - start
+
+    metrics = executor.metrics()
+    assert metrics['processed'] + metrics['failed'] == len(updates) + lanes
+    return len(updates) / elapsed, int(metrics['failed'])
+
+
+if __name__ == '__main__':
+    use_processes = '--processes' in sys.argv
+    all_updates = make_updates()
+
+    print(f'{len(all_updates)} updates of {USERS} users, {LATENCY * 1000:.0f} ms per update, '
+          f'{"processes" if use_processes else "threads"}')
+    print(f'{"lanes":>6} {"updates/s":>10} {"speedup":>8} {"out of order":>13}')
+
+    base = None
+    for count in LANES:
+        rate, out_of_order = measure(count, all_updates, use_processes)
+        base = base or rate
+        print(f'{count:>6} {rate:>10.0f} {rate / base:>7.2f}x {out_of_order:>13}')
@@ -0,0 +1,145 @@
+# simulates a month of reminders.Scheduler with a fake clock and a stub bot: checks that every task is reminded
+# once and not too early, that the rate is respected and that changed tasks are rescheduled
+# usage: python -m benchmarks.reminders [tasks]
+import collections
+import os
+import random
+import sys
+import tempfile
+import time
+
+from datetime import datetime
+
+import database
+import migrations
+import reminders
+
+USERS = 1000
+TASKS = 200000
+DAYS = 30
+
+# midnight the simulation starts at
+START = datetime(2030, 1, 1).timestamp()
+
+
+class FakeClock:
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def fill(tasks, seed=0):
+    rnd = random.Random(seed)
+
+    with database.session() as cursor:
+        cursor.executemany('INSERT INTO Users(tele_id, language) VALUES(?, ?)',
+                           [(user, 'EN') for user in range(1, USERS + 1)])
+        cursor.executemany('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)',
+                           [(START, user, 'list') for user in range(1, USERS + 1)])
+        cursor.executemany('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, 0, 0, ?)',
+                           [(f'task {i}', START + rnd.randint(1, DAYS) * 86400, rnd.randint(1, USERS))
+                            for i in range(tasks)])
+
+
+# changes some tasks after the first day, returns {task id: deadline} of the tasks that have to be reminded
+def change_tasks(scheduler, seed=1):
+    rnd = random.Random(seed)
+
+    with database.session() as cursor:
+        cursor.execute('SELECT id, deadline FROM Tasks WHERE status = 0 AND reminded = 0')
+        pending = dict(cursor.fetchall())
+        ids = rnd.sample(sorted(pending), 1500)
+
+        # done by the user
+        for task_id in ids[:500]:
+            cursor.execute('UPDATE Tasks SET status = 1 WHERE id = ?', (task_id,))
+            scheduler.task_closed(task_id)
+            del pending[task_id]
+
+        # new deadline, earlier or later
+        for task_id in ids[500:1000]:
+            pending[task_id] = START + rnd.randint(3, DAYS) * 86400
+            cursor.execute('UPDATE Tasks SET deadline = ?, reminded = 0 WHERE id = ?', (pending[task_id], task_id))
+            scheduler.task_changed(task_id, pending[task_id])
+
+        # new deadline set by another process, the scheduler isn`t told about it
+        for task_id in ids[1000:]:
+            pending[task_id] = pending[task_id] + 86400
+            cursor.execute('UPDATE Tasks SET deadline = ?, reminded = 0 WHERE id = ?', (pending[task_id], task_id))
+
+    return pending
+
+
+def simulate():
+    clock = FakeClock(START)
+    sent = []
+
+    def send(tele_id, text):
+        sent.append((clock.now, text))
+
+    scheduler = reminders.Scheduler(send, clock)
+    expected = None
+    max_heap = 0
+    ticks = 0
+
+    start = time.perf_counter()
+    while clock.now < START + (DAYS + 1) * 86400:
+        if expected is None and clock.now >= START + 86400:
+            expected = change_tasks(scheduler)
+
+        scheduler.tick()
+        ticks += 1
+        max_heap = max(max_heap, len(scheduler._heap))
+
+        # the thread would sleep that long
+        clock.now += max(scheduler.next_wait(), 0.001)
+    elapsed = time.perf_counter() - start
+
+    return scheduler, sent, expected, elapsed, ticks, max_heap
+
+
+def check(sent, expected):
+    with database.session() as cursor:
+        cursor.execute('SELECT id FROM Tasks WHERE reminded = 1')
+        reminded = {row[0] for row in cursor.fetchall()}
+        cursor.execute('SELECT task, deadline FROM Tasks')
+        deadlines = dict(cursor.fetchall())
+
+    missing = set(expected) - reminded
+    assert not missing, f'{len(missing)} tasks were not reminded'
+
+    # names of the tasks are unique, so are the texts
+    texts = collections.Counter(text for _, text in sent)
+    assert max(texts.values()) == 1, 'duplicate reminders'
+    assert len(sent) == len(reminded), f'{len(sent)} reminders for {len(reminded)} tasks'
+
+    # the text is '... *task name* ...'
+    early = [text for moment, text in sent if moment < deadlines[text.split('*')[1]] - reminders.REMIND_BEFORE]
+    assert not early, f'{len(early)} reminders were sent too early'
+
+    per_second = collections.Counter(int(moment) for moment, _ in sent)
+    assert max(per_second.values()) <= 2 * reminders.RATE, 'the rate is exceeded'
+
+    return max(per_second.values())
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else TASKS
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.configure(os.path.join(directory, 'reminders.sqlite'))
+        with database.session() as db_cursor:
+            migrations.migrate(db_cursor)
+
+        fill(count)
+        result, messages, expected_tasks, seconds, tick_count, heap_size = simulate()
+        busiest = check(messages, expected_tasks)
+        database.close_all()
+
+    print(f'{count} tasks, {DAYS} days simulated in {seconds:.1f} s ({tick_count} ticks)')
+    print(f'reminders sent: {len(messages)}, busiest second: {busiest} (rate {reminders.RATE}/s)')
+    print(f'largest heap: {heap_size}, refills: {result.stats["refills"]}, loaded: {result.stats["loaded"]}, '
+          f'outdated: {result.stats["outdated"]}')
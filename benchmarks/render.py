@@ -0,0 +1,95 @@
+# compares the old rendering of one task at a time with functions.render_task_lines (whole list at once)
+# usage: python -m benchmarks.render
+import functions
+import random
+import timeit
+
+from datetime import date
+from datetime import datetime
+
+SIZES = (10, 100, 1000)
+
+
+def make_tasks(count, seed=0):
+    rnd = random.Random(seed)
+
+    # deadlines are midnights (see functions.get_timestamp), roughly a half of tasks is overdue
+    midnight = datetime.combine(date.today(), datetime.min.time()).timestamp()
+    return [(f'Task number {i}', midnight + rnd.randint(-30, 30) * 86400, rnd.randint(0, 1), rnd.randint(0, 3))
+            for i in range(count)]
+
+
+# the renderer the bot called for every task before (functions.task_parser), kept as the reference
+def render_task(task):
+    result = ''
+
+    status = task[2]
+    deadline = task[1]
+
+    # in case if deadline is failed
+    if status != 1 and float(deadline) - datetime.timestamp(datetime.now()) < 0:
+        status = 2
+
+    # dealing with status
+    if status == 0:
+        result += '🔄'
+    elif status == 1:
+        result += '✅'
+    elif status == 2:
+        result += '❌'
+
+    # dealing with priority
+    if task[3] == 0:
+        result += '⬜'
+    elif task[3] == 1:
+        result += '🟩'
+    elif task[3] == 2:
+        result += '🟨'
+    elif task[3] == 3:
+        result += '🟥'
+
+    result += '*' + task[0] + '*'
+
+    deadline_data = datetime.fromtimestamp(deadline)
+    deadline_day = deadline_data.day
+    deadline_day -= 1
+    delta = deadline_data - datetime.now()
+
+    if delta.days == 1:
+        phrase = 'day'
+    else:
+        phrase = 'days'
+
+    result += '⏱' + f'{deadline_day}.{deadline_data.strftime("%m.%Y")}⏱({delta.days + 1} {phrase})'
+    return result
+
+
+def per_task(tasks):
+    result = ''
+    for task in tasks:
+        result += render_task(task) + '\n\n'
+    return result
+
+
+def batch(tasks):
+    return '\n\n'.join(functions.render_task_lines(tasks)) + '\n\n'
+
+
+def measure(func, tasks):
+    timer = timeit.Timer(lambda: func(tasks))
+    number, _ = timer.autorange()
+
+    # best of 5 runs, microseconds per call
+    return min(timer.repeat(5, number)) / number * 1e6
+
+
+if __name__ == '__main__':
+    print(f'{"tasks":>6} {"per task, us":>14} {"batch, us":>12} {"speedup":>8}')
+
+    for size in SIZES:
+        tasks = make_tasks(size)
+        assert per_task(tasks) == batch(tasks)
+
+        old = measure(per_task, tasks)
+        new = measure(batch, tasks)
+        print(f'{size:>6} {old:>14.1f} {new:>12.1f} {old / new:>7.2f}x')
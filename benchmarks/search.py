@@ -0,0 +1,166 @@
+# fills a temporary database with tasks of many users (the full-text index is filled by the triggers of
+# migration 8) and measures search.search: p50/p99 latency of queries that aren`t cached and of repeated ones
+# usage: python -m benchmarks.search [--tasks 1000000] [--users 10000] [--queries 2000] [--output search.json]
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import string
+import tempfile
+import time
+
+import database
+import migrations
+import search
+
+TASKS = 1000000
+USERS = 10000
+QUERIES = 2000
+
+LISTS_PER_USER = 3
+VOCABULARY = 20000
+WORDS_PER_TASK = (2, 6)
+
+# tasks inserted by one statement
+BATCH = 10000
+
+
+# words are used with Zipf-like frequencies, so some of them are in a lot of tasks, like in real lists
+def make_vocabulary(size, rng):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 10))))
+
+    words = sorted(words)
+    rng.shuffle(words)
+    return words, list(itertools.accumulate(1 / rank for rank in range(1, size + 1)))
+
+
+# returns seconds spent on filling
+def fill(tasks, users, rng):
+    words, cum_weights = make_vocabulary(VOCABULARY, rng)
+    sheets = users * LISTS_PER_USER
+    start = time.perf_counter()
+
+    with database.session() as cursor:
+        cursor.executemany('INSERT INTO Sheets(id, time, user_id, name) VALUES(?, ?, ?, ?)',
+                           [(sheet_id, 0, (sheet_id - 1) // LISTS_PER_USER + 1, f'list {sheet_id}')
+                            for sheet_id in range(1, sheets + 1)])
+
+    for first in range(0, tasks, BATCH):
+        rows = []
+        for number in range(first, min(first + BATCH, tasks)):
+            name = ' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(*WORDS_PER_TASK)))
+            rows.append((f'{name} {number}', time.time() + 86400, 0, 0, rng.randint(1, sheets)))
+
+        with database.session() as cursor:
+            cursor.executemany('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, ?, ?, ?)',
+                               rows)
+
+    return time.perf_counter() - start
+
+
+# queries look like what users type: one or two words of one of their tasks, the last word may be unfinished
+def make_queries(count, rng):
+    queries = []
+
+    with database.session() as cursor:
+        cursor.execute('SELECT MAX(id) FROM Tasks')
+        last_id = cursor.fetchone()[0]
+
+        while len(queries) < count:
+            cursor.execute('SELECT Tasks.task, Sheets.user_id FROM Tasks JOIN Sheets ON Sheets.id = Tasks.sheet_id '
+                           'WHERE Tasks.id = ?', (rng.randint(1, last_id),))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+
+            task, user_id = row
+            words = rng.sample(task.split()[:-1], min(rng.randint(1, 2), len(task.split()) - 1))
+            if rng.random() < 0.5:
+                words[-1] = words[-1][:rng.randint(2, len(words[-1]))]
+
+            queries.append((user_id, search.normalize(' '.join(words))))
+
+    return queries
+
+
+def summary(values):
+    ordered = sorted(values)
+    return {'count': len(values), 'p50_ms': ordered[len(ordered) // 2] * 1000,
+            'p99_ms': ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000,
+            'mean_ms': statistics.fmean(values) * 1000}
+
+
+def run(queries):
+    latencies = []
+    found = 0
+
+    with database.session() as cursor:
+        for user_id, query in queries:
+            start = time.perf_counter()
+            found += len(search.search(cursor, user_id, query))
+            latencies.append(time.perf_counter() - start)
+
+    return latencies, found
+
+
+def benchmark(tasks, users, count, seed=1):
+    rng = random.Random(seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'search.sqlite')
+        database.configure(filename)
+
+        try:
+            with database.session() as cursor:
+                migrations.migrate(cursor)
+
+            fill_seconds = fill(tasks, users, rng)
+            queries = make_queries(count, rng)
+
+            search.clear()
+            cold, found = run(queries)
+
+            # the same queries again, answered by the cache
+            warm, _ = run(queries)
+
+            size = os.path.getsize(filename)
+        finally:
+            database.close_all()
+
+    return {
+        'config': {'tasks': tasks, 'users': users, 'queries': count, 'max_results': search.MAX_RESULTS},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform()},
+        'fill': {'seconds': fill_seconds, 'tasks_per_second': tasks / fill_seconds, 'database_mb': size / 2 ** 20},
+        'results_per_query': found / count,
+        'search': summary(cold),
+        'cached': summary(warm),
+        'cache': dict(search.stats),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the full-text task search.')
+    parser.add_argument('--tasks', type=int, default=TASKS)
+    parser.add_argument('--users', type=int, default=USERS)
+    parser.add_argument('--queries', type=int, default=QUERIES)
+    parser.add_argument('--output', default='search.json', help='file the JSON result is written to')
+    arguments = parser.parse_args()
+
+    results = benchmark(arguments.tasks, arguments.users, arguments.queries)
+
+    with open(arguments.output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(f'filled {arguments.tasks} tasks in {results["fill"]["seconds"]:.1f} s '
+          f'({results["fill"]["database_mb"]:.0f} MB), {results["results_per_query"]:.1f} results per query')
+    for name in ('search', 'cached'):
+        stats = results[name]
+        print(f'{name:>8}: p50 {stats["p50_ms"]:.3f} ms, p99 {stats["p99_ms"]:.3f} ms, mean {stats["mean_ms"]:.3f} ms')
+    print(f'\nsaved to {arguments.output}')
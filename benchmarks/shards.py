@@ -0,0 +1,121 @@
+# write throughput with users spread over shards (see database.SHARDS): threads act like handlers, every update
+# adds a task to a list of its user (the full-text index is updated by the triggers) in its own transaction
+# usage: python -m benchmarks.shards [--shards 1 2 4 8] [--threads 8] [--updates 500] [--output shards.json]
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import database
+import migrations
+
+SHARDS = (1, 2, 4, 8)
+THREADS = 8
+UPDATES = 500
+
+USERS = 1000
+
+
+# registers the users in their shards, returns tele_id -> id of their list
+def fill(users):
+    sheets = {}
+
+    for tele_id in range(1, users + 1):
+        with database.session(database.shard_of(tele_id)) as cursor:
+            cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (tele_id, 'EN'))
+            cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)', (0, cursor.lastrowid, 'list'))
+            sheets[tele_id] = cursor.lastrowid
+
+    return sheets
+
+
+def work(number, threads, updates, sheets, seed):
+    rng = random.Random(seed)
+    # users are spread over the threads like over the lanes (see workers.py)
+    users = [tele_id for tele_id in sheets if tele_id % threads == number]
+
+    for update in range(updates):
+        tele_id = rng.choice(users)
+
+        with database.use_shard(database.shard_of(tele_id)), database.session() as cursor:
+            cursor.execute('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, ?, ?, ?)',
+                           (f'task {number} {update} of {tele_id}', time.time() + 86400, 0, 0, sheets[tele_id]))
+
+    database.close()
+
+
+def measure(directory, shards, threads, updates, seed):
+    database.configure(os.path.join(directory, f'shards-{shards}.sqlite'), shards)
+
+    try:
+        for shard in range(shards):
+            with database.session(shard) as cursor:
+                migrations.migrate(cursor)
+                migrations.reserve_ids(cursor, shard)
+
+        sheets = fill(USERS)
+        workers = [threading.Thread(target=work, args=(number, threads, updates, sheets, seed + number))
+                   for number in range(threads)]
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        tasks = 0
+        for shard in range(shards):
+            with database.session(shard) as cursor:
+                cursor.execute('SELECT COUNT(*) FROM Tasks')
+                tasks += cursor.fetchone()[0]
+
+        return {'updates_per_second': threads * updates / elapsed, 'seconds': elapsed,
+                'same': tasks == threads * updates}
+    finally:
+        database.close_all()
+
+
+def benchmark(shard_counts, threads, updates, synchronous, seed=1):
+    database.SYNCHRONOUS = synchronous
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for shards in shard_counts:
+            results[shards] = measure(directory, shards, threads, updates, seed)
+
+    return {
+        'config': {'threads': threads, 'updates_per_thread': updates, 'users': USERS, 'synchronous': synchronous},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'shards': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of writes to sharded databases.')
+    parser.add_argument('--shards', type=int, nargs='+', default=SHARDS)
+    parser.add_argument('--threads', type=int, default=THREADS)
+    parser.add_argument('--updates', type=int, default=UPDATES, help='updates of every thread')
+    parser.add_argument('--synchronous', default=database.SYNCHRONOUS, choices=('OFF', 'NORMAL', 'FULL'))
+    parser.add_argument('--output', default='shards.json', help='file the JSON result is written to')
+    arguments = parser.parse_args()
+
+    result = benchmark(arguments.shards, arguments.threads, arguments.updates, arguments.synchronous)
+
+    with open(arguments.output, 'w') as file:
+        json.dump(result, file, indent=2)
+
+    print(f'{arguments.threads} threads, {arguments.updates} updates each, synchronous = {arguments.synchronous}')
+    print(f'{"shards":>6} {"updates/s":>10} {"speedup":>8} {"same":>5}')
+    base = None
+    for shards, stats in result['shards'].items():
+        base = base or stats['updates_per_second']
+        print(f'{shards:>6} {stats["updates_per_second"]:>10.0f} {stats["updates_per_second"] / base:>7.2f}x '
+              f'{"yes" if stats["same"] else "NO":>5}')
+    print(f'\nsaved to {arguments.output}')
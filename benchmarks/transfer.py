@@ -0,0 +1,161 @@
+# round trip of transfer.py on one synthetic user: every format is exported to a file and imported by another
+# user, the tasks of both users have to be the same, time and peak memory (tracemalloc, separate runs) are measured
+# usage: python -m benchmarks.transfer [--tasks 100000] [--lists 20] [--output transfer.json]
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+from datetime import timedelta
+
+import database
+import migrations
+import transfer
+
+TASKS = 100000
+LISTS = 20
+
+
+def create_user(cursor, tele_id):
+    cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (tele_id, 'EN'))
+    return cursor.lastrowid
+
+
+# names have the characters that have to be escaped by the formats
+def fill(user_id, tasks, lists, rng):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    with database.session() as cursor:
+        sheet_ids = []
+        for number in range(lists):
+            cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)',
+                           (time.time(), user_id, f'list {number}, "quoted"; ünïcode'))
+            sheet_ids.append(cursor.lastrowid)
+
+        # the last list stays empty
+        cursor.executemany('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, ?, ?, ?)',
+                           [(f'task {number}; with, "commas"\\and a long tail ' + 'x' * rng.randint(0, 100),
+                             (today + timedelta(days=rng.randint(-30, 365))).timestamp(),
+                             rng.randint(0, 2), rng.randint(0, 3), sheet_ids[number % (lists - 1)])
+                            for number in range(tasks)])
+
+
+def snapshot(cursor, user_id):
+    cursor.execute('SELECT Sheets.name, Tasks.task, Tasks.deadline, Tasks.status, Tasks.importance '
+                   'FROM Sheets JOIN Tasks ON Tasks.sheet_id = Sheets.id WHERE Sheets.user_id = ?', (user_id,))
+    tasks = set(cursor.fetchall())
+
+    cursor.execute('SELECT name FROM Sheets WHERE user_id = ?', (user_id,))
+    return tasks, {row[0] for row in cursor.fetchall()}
+
+
+# calls function() and returns (result, seconds)
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+# calls function() again under tracemalloc (which makes it a lot slower), returns the peak of allocated memory in MB
+def traced(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def round_trip(directory, file_format, user_id, tele_id):
+    filename = os.path.join(directory, f'export.{file_format}')
+
+    def export():
+        with open(filename, 'wb') as file, database.session() as cursor:
+            return transfer.export(cursor, user_id, file_format, file)
+
+    count, export_seconds = timed(export)
+    export_peak = traced(export)
+
+    # the second import (with tracemalloc) goes to another user
+    with database.session() as cursor:
+        target = create_user(cursor, tele_id)
+        traced_target = create_user(cursor, -tele_id)
+
+    def load(target_id):
+        with open(filename, 'rb') as file, database.session() as cursor:
+            return transfer.load(cursor, target_id, transfer.parse(file_format, file))
+
+    (changed, lists, added, skipped), import_seconds = timed(lambda: load(target))
+    import_peak = traced(lambda: load(traced_target))
+
+    with database.session() as cursor:
+        source_tasks, source_lists = snapshot(cursor, user_id)
+        target_tasks, target_lists = snapshot(cursor, target)
+
+    # calendars have only tasks, lists without tasks aren`t there, and no overdue status (the sweeper marks
+    # these tasks again)
+    if file_format == 'ics':
+        source_lists = {name for name, *_ in source_tasks}
+        source_tasks = {(*task[:3], 0 if task[3] == 2 else task[3], task[4]) for task in source_tasks}
+
+    return {'exported': count, 'file_mb': os.path.getsize(filename) / 2 ** 20,
+            'export_seconds': export_seconds, 'export_peak_mb': export_peak,
+            'imported': added, 'skipped': skipped, 'import_seconds': import_seconds, 'import_peak_mb': import_peak,
+            'same': source_tasks == target_tasks and source_lists == target_lists}
+
+
+def benchmark(tasks, lists, seed=1):
+    rng = random.Random(seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        database.configure(os.path.join(directory, 'transfer.sqlite'))
+
+        try:
+            with database.session() as cursor:
+                migrations.migrate(cursor)
+                user_id = create_user(cursor, 1)
+
+            fill(user_id, tasks, lists, rng)
+
+            for number, file_format in enumerate(transfer.FORMATS, start=2):
+                results[file_format] = round_trip(directory, file_format, user_id, number)
+        finally:
+            database.close_all()
+
+    return {
+        'config': {'tasks': tasks, 'lists': lists, 'batch': transfer.BATCH},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform()},
+        'formats': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Round trip of the export and import of lists.')
+    parser.add_argument('--tasks', type=int, default=TASKS)
+    parser.add_argument('--lists', type=int, default=LISTS)
+    parser.add_argument('--output', default='transfer.json', help='file the JSON result is written to')
+    arguments = parser.parse_args()
+
+    result = benchmark(arguments.tasks, max(arguments.lists, 2))
+
+    with open(arguments.output, 'w') as file:
+        json.dump(result, file, indent=2)
+
+    print(f'{"format":>6} {"tasks":>8} {"file, MB":>9} {"export, s":>10} {"peak, MB":>9} '
+          f'{"import, s":>10} {"peak, MB":>9} {"same":>5}')
+    for name, stats in result['formats'].items():
+        print(f'{name:>6} {stats["exported"]:>8} {stats["file_mb"]:>9.1f} {stats["export_seconds"]:>10.2f} '
+              f'{stats["export_peak_mb"]:>9.2f} {stats["import_seconds"]:>10.2f} {stats["import_peak_mb"]:>9.2f} '
+              f'{"yes" if stats["same"] else "NO":>5}')
+    print(f'\nsaved to {arguments.output}')
+
+    sys.exit(0 if all(stats['same'] for stats in result['formats'].values()) else 1)
@@ -0,0 +1,176 @@
+# throughput of small writes with and without write_behind.py: threads act like handlers of callbacks, every
+# callback flips the status of a task of its user and moves the dialog of the user to the next step, with
+# the writer they are queued and committed in batches, the final rows are checked against the last writes
+# usage: python -m benchmarks.write_behind [--threads 8] [--callbacks 500] [--synchronous NORMAL] [--output ...]
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import conversations
+import database
+import migrations
+import write_behind
+
+THREADS = 8
+CALLBACKS = 500
+
+# users of every thread (updates of one user are handled by one thread, see workers.py) and their tasks
+USERS_PER_THREAD = 20
+TASKS_PER_USER = 5
+
+# durability of all writes -> name of the mode, None - without the writer
+MODES = {'sync': None, 'group': write_behind.GROUP, 'lazy': write_behind.LAZY}
+
+
+def fill(threads):
+    with database.session() as cursor:
+        for tele_id in range(1, threads * USERS_PER_THREAD + 1):
+            cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (tele_id, 'EN'))
+            cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)', (0, cursor.lastrowid, 'list'))
+            sheet_id = cursor.lastrowid
+
+            cursor.executemany('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, ?, ?, ?)',
+                               [(f'task {number}', 0, 0, 0, sheet_id) for number in range(TASKS_PER_USER)])
+
+
+# runs the callbacks of the users of one thread, returns (latencies, {task id: status}, {tele_id: step})
+def work(number, callbacks, seed):
+    rng = random.Random(seed)
+    users = range(number * USERS_PER_THREAD + 1, (number + 1) * USERS_PER_THREAD + 1)
+    latencies = []
+    statuses = {}
+    steps = {}
+
+    for callback in range(callbacks):
+        tele_id = rng.choice(users)
+        # tasks of the user are inserted one after another (see fill())
+        task_id = (tele_id - 1) * TASKS_PER_USER + rng.randint(1, TASKS_PER_USER)
+        status = callback % 2
+        step = f'step {callback}'
+
+        start = time.perf_counter()
+        with database.session() as cursor:
+            write_behind.execute(cursor, 'status', ('Tasks.status', task_id),
+                                 'UPDATE Tasks SET status = ? WHERE id = ?', (status, task_id))
+            conversations.store.put(cursor, tele_id, step, {}, time.time() + conversations.TTL)
+        latencies.append(time.perf_counter() - start)
+
+        statuses[task_id] = status
+        steps[tele_id] = step
+
+    database.close()
+    return latencies, statuses, steps
+
+
+def check(statuses, steps):
+    with database.session() as cursor:
+        cursor.execute('SELECT id, status FROM Tasks')
+        saved_statuses = dict(cursor.fetchall())
+        cursor.execute('SELECT user_id, step FROM Conversations')
+        saved_steps = dict(cursor.fetchall())
+
+    return all(saved_statuses[task_id] == status for task_id, status in statuses.items()) and saved_steps == steps
+
+
+def summary(values):
+    ordered = sorted(values)
+    return {'p50_ms': ordered[len(ordered) // 2] * 1000,
+            'p99_ms': ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))] * 1000}
+
+
+def measure(directory, mode, threads, callbacks, seed):
+    database.configure(os.path.join(directory, f'{mode}.sqlite'))
+
+    try:
+        with database.session() as cursor:
+            migrations.migrate(cursor)
+        fill(threads)
+
+        durability = MODES[mode]
+        if durability is not None:
+            write_behind.CLASSES.update({'status': durability, 'conversation': durability})
+            write_behind.start()
+            writer = write_behind.writer
+
+        results = [None] * threads
+
+        def run(number):
+            results[number] = work(number, callbacks, seed + number)
+
+        workers = [threading.Thread(target=run, args=(number,)) for number in range(threads)]
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        handled = time.perf_counter() - start
+
+        # lazy writes are committed here
+        write_behind.stop()
+        committed = time.perf_counter() - start
+
+        latencies, statuses, steps = [], {}, {}
+        for thread_latencies, thread_statuses, thread_steps in results:
+            latencies += thread_latencies
+            statuses.update(thread_statuses)
+            steps.update(thread_steps)
+
+        result = {'callbacks_per_second': threads * callbacks / handled, 'committed_seconds': committed,
+                  **summary(latencies), 'same': check(statuses, steps)}
+
+        if durability is not None:
+            result['writer'] = writer.metrics()
+
+        return result
+    finally:
+        database.close_all()
+
+
+def benchmark(threads, callbacks, synchronous, seed=1):
+    database.SYNCHRONOUS = synchronous
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in MODES:
+            results[mode] = measure(directory, mode, threads, callbacks, seed)
+
+    return {
+        'config': {'threads': threads, 'callbacks_per_thread': callbacks, 'synchronous': synchronous,
+                   'flush_interval': write_behind.FLUSH_INTERVAL, 'max_batch': write_behind.MAX_BATCH},
+        'environment': {'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+                        'platform': platform.platform()},
+        'modes': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the write-behind group commit.')
+    parser.add_argument('--threads', type=int, default=THREADS)
+    parser.add_argument('--callbacks', type=int, default=CALLBACKS, help='callbacks of every thread')
+    parser.add_argument('--synchronous', default=database.SYNCHRONOUS, choices=('OFF', 'NORMAL', 'FULL'))
+    parser.add_argument('--output', default='write_behind.json', help='file the JSON result is written to')
+    arguments = parser.parse_args()
+
+    result = benchmark(arguments.threads, arguments.callbacks, arguments.synchronous)
+
+    with open(arguments.output, 'w') as file:
+        json.dump(result, file, indent=2)
+
+    print(f'{arguments.threads} threads, {arguments.callbacks} callbacks each, synchronous = {arguments.synchronous}')
+    print(f'{"mode":>6} {"callbacks/s":>12} {"p50, ms":>8} {"p99, ms":>8} {"batches":>8} {"coalesced":>10} {"same":>5}')
+    for name, stats in result['modes'].items():
+        writer_stats = stats.get('writer', {})
+        print(f'{name:>6} {stats["callbacks_per_second"]:>12.0f} {stats["p50_ms"]:>8.2f} {stats["p99_ms"]:>8.2f} '
+              f'{writer_stats.get("batches", "-"):>8} {writer_stats.get("coalesced", "-"):>10} '
+              f'{"yes" if stats["same"] else "NO":>5}')
+    print(f'\nsaved to {arguments.output}')
+
+    sys.exit(0 if all(stats['same'] for stats in result['modes'].values()) else 1)
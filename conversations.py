@@ -0,0 +1,51 @@
+import json
+import write_behind
+
+# seconds, an unfinished dialog is forgotten after this
+TTL = 3600
+
+# step name -> handler(message, context, data), see step()
+steps = {}
+
+
+# keeps the dialog of every user in the Conversations table, so dialogs survive restarts
+class SQLiteStore:
+
+    # returns (step, data, expires) or None
+    def get(self, cursor, tele_id, now):
+        cursor.execute('SELECT step, data, expires FROM Conversations WHERE user_id = ? AND expires > ?', (tele_id, now))
+        row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], json.loads(row[1]), row[2]
+
+    # every step of a dialog is written, so these writes can be queued (see write_behind.py)
+    def put(self, cursor, tele_id, step, data, expires):
+        write_behind.execute(cursor, 'conversation', ('Conversations', tele_id),
+                             'REPLACE INTO Conversations(user_id, step, data, expires) VALUES(?, ?, ?, ?)',
+                             (tele_id, step, json.dumps(data), expires))
+
+    def delete(self, cursor, tele_id):
+        write_behind.execute(cursor, 'conversation', ('Conversations', tele_id),
+                             'DELETE FROM Conversations WHERE user_id = ?', (tele_id,))
+
+    # deletes expired dialogs, returns how many of them were deleted
+    def purge(self, cursor, now):
+        cursor.execute('DELETE FROM Conversations WHERE expires <= ?', (now,))
+        return cursor.rowcount
+
+
+# can be replaced by any object with the same methods (cursor is the cursor of the current session)
+store = SQLiteStore()
+
+
+# registers a handler of the step of a dialog, the dialog is started and continued by
+# UserContext.set_conversation() and finished by UserContext.end_conversation()
+def step(name):
+    def decorator(handler):
+        steps[name] = handler
+        return handler
+
+    return decorator
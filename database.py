@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from contextlib import contextmanager
+
+DB_NAME = 'planner_bot_DB.sqlite'
+
+# users are spread over that many files by tele_id (see shard_of()), everything is in DB_NAME if it`s 1,
+# otherwise shard 0 is planner_bot_DB.0.sqlite, shard 1 - planner_bot_DB.1.sqlite etc.
+SHARDS = 1
+
+# seconds to wait for a lock held by another thread before raising 'database is locked'
+BUSY_TIMEOUT = 10
+
+# how many compiled statements every connection keeps
+CACHED_STATEMENTS = 256
+
+# NORMAL is safe in WAL mode, only the last transactions can be lost on power failure
+SYNCHRONOUS = 'NORMAL'
+
+# connections of the thread (shard -> connection) and the shard its sessions use by default
+_local = threading.local()
+
+# all opened connections, so they can be closed on shutdown
+_connections = []
+_connections_lock = threading.Lock()
+
+# bumped by close_all(), so threads know their connection was closed
+_generation = 0
+
+# functions called after every commit/rollback of a session
+_commit_hooks = []
+_rollback_hooks = []
+
+# functions called with (sql, seconds) after every statement of a session
+_query_hooks = []
+
+# (name, number of arguments, function) available in SQL of every connection
+_functions = []
+
+
+def configure(db_name, shards=1):
+    global DB_NAME, SHARDS
+
+    DB_NAME = db_name
+    SHARDS = shards
+    close_all()
+
+
+def shard_name(shard):
+    if SHARDS == 1:
+        return DB_NAME
+
+    root, extension = os.path.splitext(DB_NAME)
+    return f'{root}.{shard}{extension}'
+
+
+# the shard of the user, crc32 doesn`t change between runs unlike hash() of a string
+def shard_of(tele_id, shards=None):
+    shards = shards or SHARDS
+    if tele_id is None or shards == 1:
+        return 0
+
+    return zlib.crc32(str(tele_id).encode()) % shards
+
+
+def current_shard():
+    return getattr(_local, 'shard', 0)
+
+
+# sessions opened in the block without a shard use this one, e.g. everything a handler does goes
+# to the shard of its user
+@contextmanager
+def use_shard(shard):
+    previous = current_shard()
+    _local.shard = shard
+
+    try:
+        yield
+    finally:
+        _local.shard = previous
+
+
+def add_commit_hook(func):
+    _commit_hooks.append(func)
+
+
+def add_rollback_hook(func):
+    _rollback_hooks.append(func)
+
+
+# the function can be used by SQL of the bot (e.g. by triggers), so it has to be added
+# before the database is opened
+def add_function(name, num_params, func):
+    _functions.append((name, num_params, func))
+
+
+def create_functions(connection):
+    for name, num_params, func in _functions:
+        connection.create_function(name, num_params, func, deterministic=True)
+
+
+# sessions trace their statements only when there are query hooks
+def add_query_hook(func):
+    _query_hooks.append(func)
+
+
+class TracingCursor(sqlite3.Cursor):
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._trace(sql, start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._trace(sql, start)
+
+    @staticmethod
+    def _trace(sql, start):
+        seconds = time.perf_counter() - start
+        for hook in _query_hooks:
+            hook(sql, seconds)
+
+
+def _connect(shard):
+    connection = sqlite3.connect(shard_name(shard), timeout=BUSY_TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                                 check_same_thread=False)
+
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute(f'PRAGMA synchronous = {SYNCHRONOUS}')
+    connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}')
+
+    create_functions(connection)
+    return connection
+
+
+# returns a long-lived connection of the current thread to the shard (the current one by default)
+def get_connection(shard=None):
+    shard = current_shard() if shard is None else shard
+
+    if getattr(_local, 'generation', None) != _generation:
+        _local.connections = {}
+        _local.generation = _generation
+
+    connection = _local.connections.get(shard)
+
+    if connection is None:
+        connection = _connect(shard)
+        _local.connections[shard] = connection
+
+        with _connections_lock:
+            _connections.append(connection)
+
+    return connection
+
+
+# whether a connection of the current thread has an uncommitted write (sqlite3 begins a transaction
+# before the first INSERT/UPDATE/DELETE, reads alone don`t hold one)
+def in_transaction():
+    connections = getattr(_local, 'connections', None) or {}
+    return any(connection.in_transaction for connection in connections.values())
+
+
+# wraps a handler: commits when the block succeeds, rolls back on any exception and closes the cursor
+@contextmanager
+def session(shard=None):
+    connection = get_connection(shard)
+    cursor = connection.cursor(TracingCursor) if _query_hooks else connection.cursor()
+
+    try:
+        yield cursor
+
+        connection.commit()
+        for hook in _commit_hooks:
+            hook()
+    except BaseException:
+        connection.rollback()
+        for hook in _rollback_hooks:
+            hook()
+        raise
+    finally:
+        cursor.close()
+
+
+# closes the connections of the current thread (e.g. when a worker thread stops)
+def close():
+    connections = getattr(_local, 'connections', None) or {}
+    _local.connections = {}
+
+    for connection in connections.values():
+        with _connections_lock:
+            if connection in _connections:
+                _connections.remove(connection)
+
+        connection.close()
+
+
+def close_all():
+    global _generation
+
+    with _connections_lock:
+        _generation += 1
+        connections = list(_connections)
+        _connections.clear()
+
+    for connection in connections:
+        try:
+            connection.close()
+        except sqlite3.ProgrammingError:
+            pass
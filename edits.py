@@ -0,0 +1,142 @@
+# edits of the messages sent by the bot: an edit that doesn`t change the message isn`t sent at all,
+# edits of one message made within WINDOW after the previous one are collapsed into the latest of them
+import hashlib
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from telebot.apihelper import ApiTelegramException
+
+# seconds after an edit during which the next edits of the message wait and only the latest one is sent
+WINDOW = 0.5
+
+# how many messages are remembered
+MAX_MESSAGES = 10000
+
+logger = logging.getLogger('main.edits')
+
+
+def content_hash(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+
+
+# no keyboard is a state of the message too (an edit without reply_markup removes the keyboard)
+def markup_hash(markup):
+    return content_hash(markup.to_json() if markup is not None else None)
+
+
+class Tracker:
+
+    def __init__(self, bot, window=WINDOW, size=MAX_MESSAGES):
+        self.bot = bot
+        self.window = window
+        self.size = size
+
+        self._lock = threading.Lock()
+        # (chat id, message id) -> [(hash of the text, hash of the keyboard) or None if unknown,
+        # time the last edit was sent or None while it`s being sent]
+        self._messages = OrderedDict()
+        # (chat id, message id) -> (state, send, kwargs) of the latest edit waiting for the window to end
+        self._waiting = {}
+
+        self.stats = {'sent': 0, 'unchanged': 0, 'collapsed': 0, 'failed': 0}
+
+    def edit_text(self, text, chat_id, message_id, parse_mode=None, reply_markup=None):
+        self._edit((chat_id, message_id), content_hash(text, parse_mode), markup_hash(reply_markup),
+                   self.bot.edit_message_text, {'text': text, 'chat_id': chat_id, 'message_id': message_id,
+                                                'parse_mode': parse_mode, 'reply_markup': reply_markup})
+
+    # the text stays the same
+    def edit_markup(self, chat_id, message_id, reply_markup=None):
+        self._edit((chat_id, message_id), None, markup_hash(reply_markup),
+                   self.bot.edit_message_reply_markup, {'chat_id': chat_id, 'message_id': message_id,
+                                                        'reply_markup': reply_markup})
+
+    # sends the edits that are waiting (e.g. before the bot is stopped)
+    def flush(self):
+        for key in list(self._waiting):
+            self._flush(key)
+
+    def _edit(self, key, text, markup, send, kwargs):
+        with self._lock:
+            message = self._messages.get(key)
+            shown = message[0] if message else None
+
+            # the text isn`t known if the message wasn`t edited by the tracker
+            state = (text if text is not None else shown[0] if shown else None, markup)
+            waiting = key in self._waiting
+
+            if waiting:
+                self.stats['collapsed'] += 1
+            elif state == shown:
+                self.stats['unchanged'] += 1
+                return
+
+            sent_at = message[1] if message else 0
+            now = time.monotonic()
+
+            # another edit of the message is being sent or was sent just now
+            if waiting or sent_at is None or now - sent_at < self.window:
+                self._waiting[key] = (state, send, kwargs)
+
+                # an edit being sent schedules the waiting one when it`s finished
+                if not waiting and sent_at is not None:
+                    self._schedule(key, sent_at + self.window - now)
+                return
+
+            self._remember(key, shown, None)
+
+        self._send(key, state, send, kwargs)
+
+    def _send(self, key, state, send, kwargs):
+        error = None
+
+        try:
+            send(**kwargs)
+        except ApiTelegramException as e:
+            # the message already looks like this (e.g. it was edited before the bot was restarted)
+            if 'message is not modified' not in e.description:
+                error = e
+
+        with self._lock:
+            self.stats['failed' if error else 'sent'] += 1
+            self._remember(key, None if error else state, time.monotonic())
+
+            if key in self._waiting:
+                self._schedule(key, self.window)
+
+        if error is not None:
+            raise error
+
+    def _flush(self, key):
+        with self._lock:
+            edit = self._waiting.pop(key, None)
+            if edit is None:
+                return
+
+            state, send, kwargs = edit
+            message = self._messages.get(key)
+
+            if message and message[0] == state:
+                self.stats['unchanged'] += 1
+                return
+
+            self._remember(key, message[0] if message else None, None)
+
+        try:
+            self._send(key, state, send, kwargs)
+        except Exception as e:
+            logger.info('Edit of message %s in chat %s failed: %r', key[1], key[0], e)
+
+    def _schedule(self, key, delay):
+        timer = threading.Timer(max(delay, 0), self._flush, (key,))
+        timer.daemon = True
+        timer.start()
+
+    def _remember(self, key, state, sent_at):
+        self._messages[key] = [state, sent_at]
+        self._messages.move_to_end(key)
+
+        while len(self._messages) > self.size:
+            self._messages.popitem(last=False)
@@ -1,5 +1,6 @@
-import codecs
-import json
+import localization
+import re
+import router
 
 from datetime import datetime
 from datetime import timedelta
@@ -7,56 +8,24 @@ from telebot import types
 
 
 def get_dialog_profile(language):
-    if language == 'UA':
-        filename = 'dialog_ua.json'
-    elif language == 'RU':
-        filename = 'dialog_ru.json'
-    elif language == 'EN':
-        filename = 'dialog_en.json'
-    else:
-        return None
-
-    raw_json = codecs.open(filename, encoding='utf-8').read()
-    raw_json = codecs.decode(raw_json.encode(), 'utf-8-sig')
-    return json.loads(raw_json)
+    # profiles are parsed once and kept in memory, see localization.py
+    return localization.get_profile(language)
 
 
-def get_lang_profile_chat(cursor, tele_id, preferred_lang):
-    cursor.execute('SELECT language FROM Users WHERE tele_id = ?', (tele_id,))
-    lang = cursor.fetchone()
-    try:
-        lang = lang[0]
-    except TypeError:
-        print('typeerror')
+def get_lang_profile_chat(context, preferred_lang):
+    lang = context.language
+    if lang is None:
         lang = preferred_lang
 
     return get_dialog_profile(lang)
 
 
-def get_language(cursor, tele_id):
-    cursor.execute('SELECT language FROM Users WHERE tele_id = ?', (tele_id,))
-    return cursor.fetchone()[0]
-
-
-def get_lists_db(cursor, tele_id):
-    cursor.execute('SELECT id FROM Users WHERE tele_id = ?', (tele_id, ))
-    try:
-        user_id = cursor.fetchone()[0]
-    except TypeError:
-        return None
-
-    cursor.execute('SELECT id, time, name FROM Sheets WHERE user_id = ?', (user_id, ))
-    return cursor.fetchall()
-
-
-def user_id_db(cursor, tele_id):
-    cursor.execute('SELECT id FROM Users WHERE tele_id = ?', (tele_id,))
-    return cursor.fetchone()[0]
+def get_language(context):
+    return context.language
 
 
-def last_callback(cursor, tele_id):
-    cursor.execute('SELECT last_callback FROM Users WHERE tele_id = ?', (tele_id,))
-    return cursor.fetchone()[0]
+def user_id_db(context):
+    return context.id
 
 
 def get_timestamp(text):
@@ -72,91 +41,263 @@ def get_timestamp(text):
         return None
 
 
-def get_sheet_id(cursor, tele_id, sheet_name):
-    user_id = user_id_db(cursor, tele_id)
+def get_sheet_id(context, sheet_name):
+    context.cursor.execute('SELECT id FROM Sheets WHERE name = ? AND user_id = ?', (sheet_name, context.id))
+    return context.cursor.fetchone()[0]
+
+
+STATUS_EMOJI = {0: '🔄', 1: '✅', 2: '❌'}
+PRIORITY_EMOJI = {0: '⬜', 1: '🟩', 2: '🟨', 3: '🟥'}
+
+
+# page sizes for the list messages and for the keyboards
+TASKS_PAGE_SIZE = 25
+BUTTONS_PAGE_SIZE = 10
+
+# Telegram doesn`t send longer messages (the length is counted in UTF-16 code units)
+MESSAGE_LIMIT = 4096
+
+
+def message_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+# Markdown characters of a text that is put between * (bold), Telegram doesn`t allow escaping inside
+# an entity, so the bold text is closed before every such character and opened again after it
+MARKDOWN_SPECIAL = re.compile(r'([_*`\[])')
+
+
+def escape_bold(text):
+    # most names have nothing to escape, sub() with a template is much slower than search()
+    if MARKDOWN_SPECIAL.search(text) is None:
+        return text
+
+    return MARKDOWN_SPECIAL.sub(r'*\\\1*', text)
+
+
+# the same for a text between _ (italic)
+def escape_italic(text):
+    if MARKDOWN_SPECIAL.search(text) is None:
+        return text
+
+    return MARKDOWN_SPECIAL.sub(r'_\\\1_', text)
+
+
+# returns how many lines (joined with empty lines) fit into length, counting from the end if reverse is True
+def fit_lines(lines, length, reverse=False):
+    count = 0
+    total = 0
+
+    for line in (reversed(lines) if reverse else lines):
+        total += message_length(line) + (2 if count else 0)
+        if total > length:
+            break
+        count += 1
+
+    return count
+
+
+# tasks - [(task, deadline, status, importance, ...), ...], returns a line for every task
+def render_task_lines(tasks, now=None):
+    if now is None:
+        now = datetime.now()
+
+    now_stamp = datetime.timestamp(now)
+    fromtimestamp = datetime.fromtimestamp
+
+    # deadlines are stored as midnights, so many tasks share them - every deadline is formatted once
+    formatted = {}
+
+    lines = []
+    for name, deadline, status, importance, *_ in tasks:
+        # in case if deadline is failed
+        if status != 1 and deadline < now_stamp:
+            status = 2
+
+        deadline_text = formatted.get(deadline)
+        if deadline_text is None:
+            deadline_data = fromtimestamp(deadline)
+            days = (deadline_data - now).days
+
+            deadline_text = f'⏱{deadline_data.day - 1}.{deadline_data.month:02}.{deadline_data.year}' \
+                            f'⏱({days + 1} {"day" if days == 1 else "days"})'
+            formatted[deadline] = deadline_text
 
-    cursor.execute('SELECT id FROM Sheets WHERE name = ? AND user_id = ?', (sheet_name, user_id))
-    return cursor.fetchone()[0]
+        lines.append(f'{STATUS_EMOJI.get(status, "")}{PRIORITY_EMOJI.get(importance, "")}*{escape_bold(name)}*'
+                     f'{deadline_text}')
 
+    return lines
 
-def task_parser(task):
-    result = ''
 
-    status = task[2]
-    deadline = task[1]
+# runs a page query with LIMIT size + 1, returns the page and whether there is something after it
+def _fetch_page(cursor, query, params, size, backward):
+    cursor.execute(query, (*params, size + 1))
+    rows = cursor.fetchall()
 
-    # in case if deadline is failed
-    if status != 1 and float(deadline) - datetime.timestamp(datetime.now()) < 0:
-        status = 2
+    more = len(rows) > size
+    rows = rows[:size]
 
-    # dealing with status
-    if status == 0:
-        result += '🔄'
-    elif status == 1:
-        result += '✅'
-    elif status == 2:
-        result += '❌'
+    # backward queries are sorted in reverse order
+    if backward:
+        rows.reverse()
 
-    # dealing with priority
-    if task[3] == 0:
-        result += '⬜'
-    elif task[3] == 1:
-        result += '🟩'
-    elif task[3] == 2:
-        result += '🟨'
-    elif task[3] == 3:
-        result += '🟥'
+    return rows, more
 
-    result += '*' + task[0] + '*'
 
-    deadline_data = datetime.fromtimestamp(deadline)
-    deadline_day = deadline_data.day
-    deadline_day -= 1
-    delta = deadline_data - datetime.now()
+# pages are addressed by a key of the neighbouring row: direction 'n' - the page after the key,
+# 'p' - the page before the key, None - the first page
+# returns (rows, has_previous, has_next)
+def _page(cursor, queries, params, direction, key, size):
+    first_query, after_query, before_query = queries
 
-    if delta.days == 1:
-        phrase = 'day'
-    else:
-        phrase = 'days'
+    if direction == 'p':
+        rows, more = _fetch_page(cursor, before_query, (*params, *key), size, True)
+        return rows, more, True
+    elif direction == 'n':
+        rows, more = _fetch_page(cursor, after_query, (*params, *key), size, False)
+        return rows, True, more
 
-    result += '⏱' + f'{deadline_day}.{deadline_data.strftime("%m.%Y")}⏱({delta.days + 1} {phrase})'
-    return result
+    rows, more = _fetch_page(cursor, first_query, params, size, False)
+    return rows, False, more
 
 
-def tasks_buttons(cursor, sheet_name, tele_id, mode):
+TASKS_PAGE_QUERIES = (
+    'SELECT task, deadline, status, importance, id FROM Tasks WHERE sheet_id = ? ORDER BY status, id LIMIT ?',
+    'SELECT task, deadline, status, importance, id FROM Tasks WHERE sheet_id = ? AND (status, id) > (?, ?) '
+    'ORDER BY status, id LIMIT ?',
+    'SELECT task, deadline, status, importance, id FROM Tasks WHERE sheet_id = ? AND (status, id) < (?, ?) '
+    'ORDER BY status DESC, id DESC LIMIT ?',
+)
 
-    sheet_id = get_sheet_id(cursor, tele_id, sheet_name.replace("_", " "))
-    language = get_language(cursor, tele_id)
+SHEETS_PAGE_QUERIES = (
+    'SELECT id, time, name FROM Sheets WHERE user_id = ? ORDER BY id LIMIT ?',
+    'SELECT id, time, name FROM Sheets WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?',
+    'SELECT id, time, name FROM Sheets WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+)
 
-    cursor.execute('SELECT task, id  FROM Tasks WHERE sheet_id = ?', (sheet_id,))
-    tasks = cursor.fetchall()
+
+# tasks are ordered by (status, id), key - (status, id) of the neighbouring task
+def get_tasks_page(context, sheet_id, direction=None, key=None, size=TASKS_PAGE_SIZE):
+    return _page(context.cursor, TASKS_PAGE_QUERIES, (sheet_id,), direction, key, size)
+
+
+# lists are ordered by id, key - (id,) of the neighbouring list
+def get_lists_page(context, direction=None, key=None, size=BUTTONS_PAGE_SIZE):
+    return _page(context.cursor, SHEETS_PAGE_QUERIES, (context.id,), direction, key, size)
+
+
+# returns a row of '<' / '>' buttons or None if there is only one page
+def page_buttons(has_previous, has_next, previous_data, next_data):
+    buttons = []
+
+    if has_previous:
+        buttons.append(types.InlineKeyboardButton(text='◀️', callback_data=previous_data))
+    if has_next:
+        buttons.append(types.InlineKeyboardButton(text='▶️', callback_data=next_data))
+
+    return buttons or None
+
+
+# keyboard with one page of tasks, mode - route of the task buttons
+def tasks_buttons(context, sheet_id, mode, direction=None, key=None):
+    language = get_language(context)
+
+    tasks, has_previous, has_next = get_tasks_page(context, sheet_id, direction, key, BUTTONS_PAGE_SIZE)
 
     markup = types.InlineKeyboardMarkup()
 
     for task in tasks:
-        markup.add(types.InlineKeyboardButton(text=task[0], callback_data=f'{mode} {task[1]} {sheet_id}'))
+        markup.add(types.InlineKeyboardButton(text=task[0], callback_data=router.encode(mode, task[4], sheet_id)))
 
-    lists = get_lists_db(cursor, tele_id)
+    if tasks:
+        navigation = page_buttons(has_previous, has_next,
+                                  router.encode('tp', sheet_id, mode, 'p', tasks[0][2], tasks[0][4]),
+                                  router.encode('tp', sheet_id, mode, 'n', tasks[-1][2], tasks[-1][4]))
+        if navigation:
+            markup.row(*navigation)
 
-    i = 0
-    while i < len(lists):
-        if lists[i][2] == sheet_name.replace("_", " "):
-            break
-        i += 1
+    markup.add(types.InlineKeyboardButton(text=get_dialog_profile(language)['markdone'][1], callback_data=router.encode('gl', sheet_id)))
+    return markup
+
+
+# keyboard with one page of user`s lists, mode - route of the buttons, returns None if user has no lists
+def lists_buttons(context, mode, direction=None, key=None):
+    lists, has_previous, has_next = get_lists_page(context, direction, key)
+
+    if not lists:
+        return None
+
+    markup = types.InlineKeyboardMarkup()
+    markup.row_width = 4
+
+    for sheet in lists:
+        markup.add(types.InlineKeyboardButton(sheet[2], callback_data=router.encode(mode, sheet[0])))
+
+    navigation = page_buttons(has_previous, has_next,
+                              router.encode('lp', mode, 'p', lists[0][0]),
+                              router.encode('lp', mode, 'n', lists[-1][0]))
+    if navigation:
+        markup.row(*navigation)
 
-    markup.add(types.InlineKeyboardButton(text=get_dialog_profile(language)['markdone'][1], callback_data=f'getlist {sheet_name} {i}'))
     return markup
 
 
-def list_existence(sheet_name, cursor, user_id):
+# returns a name of the sheet if it belongs to the user, otherwise None
+def get_sheet_name(context, sheet_id):
+    context.cursor.execute('SELECT name FROM Sheets WHERE id = ? AND user_id = ?', (sheet_id, context.id))
+    sheet = context.cursor.fetchone()
 
-    exists = True
-    try:
-        get_sheet_id(cursor, user_id, sheet_name)
-    except TypeError:
-        exists = False
+    if sheet:
+        return sheet[0]
+
+    return None
+
+
+# checks if the list already has a task with this name
+def task_exists(context, sheet_id, name):
+    context.cursor.execute('SELECT 1 FROM Tasks WHERE task = ? AND sheet_id = ?', (name, sheet_id))
+    return context.cursor.fetchone() is not None
+
+
+# longer task names aren`t accepted
+MAX_TASK_LENGTH = 1000
+
+# fields of a line of the bulk message - "task | 22.10.2020 | 🟥", the priority can be omitted (⬜)
+BULK_SEPARATOR = '|'
 
-    return exists
+IMPORTANCE = {emoji: importance for importance, emoji in PRIORITY_EMOJI.items()}
+
+
+# parses the lines of the bulk message one by one, yields (line number, (name, deadline, importance), error),
+# error - None, 'format', 'name', 'date' or 'priority', empty lines are skipped
+def parse_tasks(text):
+    # many tasks have the same deadline, every date is checked once
+    deadlines = {}
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+
+        fields = [field.strip() for field in line.split(BULK_SEPARATOR)]
+
+        if len(fields) not in (2, 3):
+            yield number, None, 'format'
+            continue
+
+        name, date = fields[:2]
+        priority = fields[2] if len(fields) == 3 else PRIORITY_EMOJI[0]
+
+        if date not in deadlines:
+            deadlines[date] = get_timestamp(date)
+
+        if not name or len(name) > MAX_TASK_LENGTH:
+            yield number, None, 'name'
+        elif not deadlines[date]:
+            yield number, None, 'date'
+        elif priority not in IMPORTANCE:
+            yield number, None, 'priority'
+        else:
+            yield number, (name, deadlines[date], IMPORTANCE[priority]), None
 
 
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+import codecs
+import json
+import os
+import threading
+import time
+
+from types import MappingProxyType
+
+# language code -> dialog file
+PROFILE_FILES = {
+    'UA': 'dialog_ua.json',
+    'RU': 'dialog_ru.json',
+    'EN': 'dialog_en.json',
+}
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# how often (in seconds) we are allowed to stat the dialog files looking for changes
+RELOAD_CHECK_INTERVAL = 5
+
+# language -> [mtime, last check time, profile]
+_profiles = {}
+_lock = threading.Lock()
+
+# hits - profile was served from memory, misses - profile had to be read and parsed from disk
+stats = {'hits': 0, 'misses': 0, 'reloads': 0}
+
+
+# makes a read-only copy of parsed json, so handlers can`t corrupt the shared profile
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    elif isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+
+    return value
+
+
+def _read_profile(filename):
+    raw_json = codecs.open(filename, encoding='utf-8').read()
+    raw_json = codecs.decode(raw_json.encode(), 'utf-8-sig')
+    return _freeze(json.loads(raw_json))
+
+
+def _path(language):
+    return os.path.join(BASE_DIR, PROFILE_FILES[language])
+
+
+def _load(language):
+    path = _path(language)
+    mtime = os.stat(path).st_mtime
+
+    profile = _read_profile(path)
+    stats['misses'] += 1
+
+    _profiles[language] = [mtime, time.monotonic(), profile]
+    return profile
+
+
+# parses every profile once, should be called at startup
+def load_all():
+    with _lock:
+        for language in PROFILE_FILES:
+            _load(language)
+
+
+def get_profile(language):
+    if language not in PROFILE_FILES:
+        return None
+
+    entry = _profiles.get(language)
+
+    if entry is None:
+        with _lock:
+            entry = _profiles.get(language)
+            if entry is None:
+                return _load(language)
+
+    now = time.monotonic()
+
+    # checking if the file was changed, but not more often than RELOAD_CHECK_INTERVAL
+    if now - entry[1] >= RELOAD_CHECK_INTERVAL:
+        with _lock:
+            entry[1] = now
+            try:
+                changed = os.stat(_path(language)).st_mtime != entry[0]
+            except OSError:
+                # file was removed or is being replaced, keep serving the old profile
+                changed = False
+
+            if changed:
+                stats['reloads'] += 1
+                try:
+                    return _load(language)
+                except (OSError, ValueError):
+                    # file is half-written, trying again on the next check
+                    pass
+
+    stats['hits'] += 1
+    return entry[2]
@@ -0,0 +1,185 @@
+# logging of the bot: handlers only put records to a queue, a listener thread writes them to a rotating file
+# as JSON lines with the context of the update (user id, update id, route), so logging never waits for the disk
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from contextlib import contextmanager
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from logging.handlers import RotatingFileHandler
+
+# the file is rotated when it grows bigger than LOG_MAX_BYTES, LOG_BACKUPS old files are kept
+MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+BACKUPS = int(os.environ.get('LOG_BACKUPS', 5))
+
+# levels of the loggers, e.g. 'main=INFO,main.api_client=WARNING' (modules log to 'main.<module>')
+LEVELS = os.environ.get('LOG_LEVELS', 'main=INFO')
+
+# records waiting for the listener, new records are dropped when the queue is full
+QUEUE_SIZE = 10000
+
+# seconds the listener sleeps when the queue is empty, records are written in batches
+# instead of waking the listener (and taking the GIL from handlers) for every record
+INTERVAL = 0.1
+
+# fields of the context added to every record
+CONTEXT_FIELDS = ('update_id', 'user_id', 'route')
+
+_context = threading.local()
+
+_listener = None
+_file_handler = None
+_queue_handler = None
+
+stats = {'dropped': 0}
+
+
+# adds fields to the context of the current thread (e.g. the route of the callback)
+def bind(**fields):
+    if not hasattr(_context, 'fields'):
+        _context.fields = {}
+    _context.fields.update(fields)
+
+
+# records made inside the block have the fields (e.g. the update being handled)
+@contextmanager
+def context(**fields):
+    previous = getattr(_context, 'fields', {})
+    _context.fields = dict(previous, **fields)
+    try:
+        yield
+    finally:
+        _context.fields = previous
+
+
+class JsonFormatter(logging.Formatter):
+
+    def __init__(self):
+        super().__init__()
+        # the time is formatted once a second
+        self._second = None
+        self._time = None
+
+    def format(self, record):
+        second = int(record.created)
+        if second != self._second:
+            self._second = second
+            self._time = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(second))
+
+        data = {'time': f'{self._time}.{int(record.msecs):03d}',
+                'level': record.levelname, 'logger': record.name, 'function': record.funcName,
+                'message': record.getMessage()}
+
+        for field in CONTEXT_FIELDS + ('duration_ms',):
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ContextQueueHandler(QueueHandler):
+
+    # the message is formatted by the listener, only the context of the thread is taken here
+    def prepare(self, record):
+        for field, value in getattr(_context, 'fields', {}).items():
+            if getattr(record, field, None) is None:
+                setattr(record, field, value)
+
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() < QUEUE_SIZE:
+            self.queue.put_nowait(record)
+        else:
+            stats['dropped'] += 1
+
+
+class BufferedFileHandler(RotatingFileHandler):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._size = self.stream.tell()
+
+    # the size of the file is counted here, RotatingFileHandler asks the file system for every record
+    def emit(self, record):
+        try:
+            line = (self.format(record) + self.terminator).encode(self.encoding or 'utf-8')
+
+            if 0 < self.maxBytes < self._size + len(line):
+                self.doRollover()
+                self._size = 0
+
+            self.stream.buffer.write(line)
+            self._size += len(line)
+        except Exception:
+            self.handleError(record)
+
+    # the file is flushed by the listener when the queue is empty, not after every record
+    def flush(self):
+        pass
+
+    def sync(self):
+        super().flush()
+
+
+class BatchListener(QueueListener):
+
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.sync()
+            time.sleep(INTERVAL)
+
+        return self.queue.get(block)
+
+
+# 'main=INFO,main.api_client=WARNING' -> {'main': 'INFO', 'main.api_client': 'WARNING'}
+def parse_levels(levels):
+    result = {}
+
+    for item in levels.split(','):
+        if item.strip():
+            name, level = item.split('=', 1)
+            result[name.strip()] = level.strip().upper()
+
+    return result
+
+
+# sends the records of the 'main' loggers to the file, should be called once at start
+def setup(filename, levels=LEVELS, max_bytes=MAX_BYTES, backups=BACKUPS):
+    global _listener, _file_handler, _queue_handler
+
+    for name, level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(level)
+
+    _file_handler = BufferedFileHandler(filename, maxBytes=max_bytes, backupCount=backups, encoding='utf-8')
+    _file_handler.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    _queue_handler = ContextQueueHandler(records)
+    logging.getLogger('main').addHandler(_queue_handler)
+
+    _listener = BatchListener(records, _file_handler)
+    _listener.start()
+
+    atexit.register(stop)
+
+
+# writes the records that are in the queue and stops the listener
+def stop():
+    global _listener, _file_handler, _queue_handler
+
+    if _listener is not None:
+        logging.getLogger('main').removeHandler(_queue_handler)
+        _listener.stop()
+        _file_handler.close()
+        _listener = _file_handler = _queue_handler = None
@@ -1,75 +1,94 @@
+import api_client
+import io
+import json
 import logging
+import os
 import sqlite3
+import conversations
+import database
+import edits
+import functools
 import functions
+import localization
+import logs
+import metrics
+import migrations
+import outbox
+import overdue
+import reminders
+import render_cache
+import router
+import search
+import tempfile
+import transfer
+import user_context
 import time
+import workers
+import write_behind
 
 
 from telebot import TeleBot
+from telebot import apihelper
 from telebot import types
 
 # constants
 PREFERRED_LANGUAGE = 'UA'
-DB_NAME = 'planner_bot_DB.sqlite'
 
-bot = TeleBot('')
+# can be overridden by the environment, e.g. to run the bot against a fake API (see benchmarks/handlers.py)
+TOKEN = os.environ.get('TELEGRAM_TOKEN', '')
+DB_NAME = os.environ.get('BOT_DB_NAME', 'planner_bot_DB.sqlite')
+# JSON lines (see logs.py), planner_log.log has the free-text records of the older versions
+LOG_FILE = os.environ.get('BOT_LOG_FILE', 'planner_log.jsonl')
 
-# setting up a logger
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+# users are spread over that many database files (see database.shard_of(), rebalance.py moves them)
+DB_SHARDS = int(os.environ.get('BOT_DB_SHARDS', '1'))
 
-formatter = logging.Formatter('%(asctime)s:%(name)s:%(funcName)s:%(message)s')
+# updates of one user are handled one by one, users are spread over LANES threads
+# (or processes if LANE_PROCESSES, they share the database and the global API limit)
+LANES = 8
+LANE_PROCESSES = False
 
-file_handler = logging.FileHandler('planner_log.log')
-file_handler.setFormatter(formatter)
+# seconds Telegram may keep the results of an inline query
+INLINE_CACHE_TIME = 5
 
-logger.addHandler(file_handler)
+bot = TeleBot(TOKEN)
+
+# edits of the messages go through the tracker, so unchanged and rapid successive edits aren`t sent
+tracker = edits.Tracker(bot)
+
+# requests limited per chat are sent after the commit of the handler (see outbox.py), the tracker`s edits
+# wait as a whole, so it remembers only the edits that were sent
+outbox.install(bot, ('send_message', 'send_document', 'edit_message_text', 'edit_message_reply_markup',
+                     'delete_message'))
+outbox.install(tracker, ('edit_text', 'edit_markup'))
+
+# the API can be replaced by a local stub, e.g. http://127.0.0.1:8081/bot{0}/{1}
+if os.environ.get('TELEGRAM_API_URL'):
+    apihelper.API_URL = os.environ['TELEGRAM_API_URL']
+
+# setting up a logger (other modules log to 'main.<module>', see logs.py),
+# the name doesn`t depend on __name__, so it`s the same when main.py is run
+logs.setup(LOG_FILE)
+logger = logging.getLogger('main')
 
 logger.info('Starting')
 
+# parsing all dialog profiles once
+localization.load_all()
+
 # getting a text for messages with PREFERRED_LANGUAGE
 common_phrases = functions.get_dialog_profile(PREFERRED_LANGUAGE)
 
-# making a connection and creating tables
-connection = sqlite3.connect(DB_NAME)
-cursor = connection.cursor()
-
-# status - 0 - in process, 1 - completed, 2 - incompleted before deadline
-# importance - 0 - grey, 1 - green, 2 - yellow, 3 - red
-cursor.executescript(
-    '''
-CREATE TABLE IF NOT EXISTS Users(
-id INTEGER NOT NULL PRIMARY KEY  AUTOINCREMENT UNIQUE,
-tele_id INTEGER NOT NULL UNIQUE,
-language TEXT,
-last_callback TEXT,
-buffer TEXT
-);
-
-CREATE TABLE IF NOT EXISTS Sheets(
-id INTEGER NOT NULL PRIMARY KEY  AUTOINCREMENT UNIQUE,
-time FLOAT,
-user_id INTEGER NOT NULL,
-name TEXT,
-UNIQUE (user_id, name)
-);
-
-CREATE TABLE IF NOT EXISTS Tasks(
-id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,
-task TEXT,
-deadline FLOAT,
-status INTEGER,
-importance INTEGER,
-user_id INTEGER,
-sheet_id INTEGER NOT NULL,
-UNIQUE(task, sheet_id)
-)
-'''
-)
-
-connection.commit()
-
-cursor.close()
-connection.close()
+# setting up a connection manager and creating/updating tables
+database.configure(DB_NAME, DB_SHARDS)
+
+for shard in range(DB_SHARDS):
+    with database.session(shard) as cursor:
+        migrations.migrate(cursor)
+        migrations.reserve_ids(cursor, shard)
+
+        # dialogs that weren`t finished in time
+        conversations.store.purge(cursor, time.time())
 
 
 # returns a main menu keyboard markup
@@ -84,10 +103,35 @@ def main_menu_markup(language):
     return markup
 
 
+# checks if the user is in the middle of a dialog (see conversations.py)
+def in_conversation(message):
+    if message.chat.type != 'private':
+        return False
+
+    with database.session() as db_cursor:
+        return user_context.load(db_cursor, message.from_user.id).conversation is not None
+
+
+# passes the message to the current step of the dialog, goes before all other message handlers
+@bot.message_handler(func=in_conversation)
+def continue_conversation(message):
+    with database.session() as db_cursor:
+        context = user_context.load(db_cursor, message.from_user.id)
+
+        # the dialog could expire after in_conversation()
+        if context.conversation is not None:
+            step, data = context.conversation
+            logger.debug('User with id - %s is at step %s.', message.from_user.id, step)
+
+            logs.bind(route=step)
+            metrics.set_route(step)
+            conversations.steps[step](message, context, data)
+
+
 @bot.message_handler(func=lambda x: x.text == 'SWITCH THE LANGUAGE' or x.text == 'СМЕНИТЬ ЯЗЫК' or x.text == 'ЗМІНИТИ МОВУ')
 def change_language(message):
     if message.chat.type == 'private':
-        logger.info(f'User with id - {message.from_user.id} is trying to switch the language.')
+        logger.debug('User with id - %s is trying to switch the language.', message.from_user.id)
 
         # making a keyboard with language options
         btn1 = types.KeyboardButton('🇺🇦')
@@ -97,26 +141,24 @@ def change_language(message):
         markup = types.ReplyKeyboardMarkup()
         markup.add(btn1, btn2, btn3)
 
-        db_connection = sqlite3.connect(DB_NAME)
-        db_cursor = db_connection.cursor()
-
-        # sending a keyboard
-        msg = bot.send_message(message.from_user.id,
-                               functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                   'lang switch'][1], reply_markup=markup)
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
 
-        db_cursor.close()
-        db_connection.close()
+            # sending a keyboard
+            bot.send_message(message.from_user.id,
+                             functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                                 'lang switch'][1], reply_markup=markup)
 
-        # changing the language when user makes an input
-        bot.register_next_step_handler(msg, set_language)
+            # changing the language when user makes an input
+            context.set_conversation('set_language')
 
 
-def set_language(message):
-    logger.info('Trying to switch the language.')
+@conversations.step('set_language')
+def set_language(message, context, data):
+    logger.debug('Trying to switch the language.')
 
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
+    # the language is asked only once
+    context.end_conversation()
 
     # determine the new language
     if message.text == '🇺🇦':
@@ -128,23 +170,19 @@ def set_language(message):
 
     try:
         # updating a language
-        db_cursor.execute('UPDATE Users SET language = ? WHERE tele_id = ?', (new_language, message.from_user.id))
-        db_connection.commit()
+        context.set_language(new_language)
         bot.send_message(message.from_user.id,
-                         functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                              'lang switch'][2],
                          reply_markup=main_menu_markup(new_language))
-        logger.info(f'Switched successfully to {new_language}')
+        logger.debug('Switched successfully to %s', new_language)
     except UnboundLocalError:
         # user sent invalid input
         bot.send_message(message.from_user.id,
-                         functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                              'lang switch'][3],
-                         reply_markup=main_menu_markup(functions.get_language(db_cursor, message.from_user.id)))
-        logger.info('UnboundLocalError.')
-
-    db_cursor.close()
-    db_connection.close()
+                         reply_markup=main_menu_markup(functions.get_language(context)))
+        logger.debug('UnboundLocalError.')
 
 
 @bot.message_handler(commands=['start'])
@@ -156,93 +194,87 @@ def starter(message):
     # private chat
     elif message.chat.type == 'private':
 
-        logger.info(f'User with id - {message.from_user.id} is trying to register.')
+        logger.debug('User with id - %s is trying to register.', message.from_user.id)
 
-        db_connection = sqlite3.connect(DB_NAME)
-        db_cursor = db_connection.cursor()
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
 
-        # checking if user is already registered
-        logger.info('Checking if user is already registered')
+            # checking if user is already registered
+            logger.debug('Checking if user is already registered')
 
-        db_cursor.execute('SELECT id FROM Users WHERE tele_id = ?', (message.from_user.id,))
-        registered = db_cursor.fetchone()
+            # registration in the database
+            if not context.registered:
 
-        # registration in the database
-        if not registered:
+                logger.debug('User is not registered. Performing a registration...')
+                context.register(PREFERRED_LANGUAGE)
 
-            logger.info('User is not registered. Performing a registration...')
-            db_cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)',
-                              (message.from_user.id, PREFERRED_LANGUAGE))
-
-            # creating a language markup
-            markup = types.InlineKeyboardMarkup()
+                # creating a language markup
+                markup = types.InlineKeyboardMarkup()
 
-            btn_ua = types.InlineKeyboardButton(text='🇺🇦', callback_data='setlang UA')
-            btn_ru = types.InlineKeyboardButton(text='🇷🇺', callback_data='setlang RU')
-            btn_en = types.InlineKeyboardButton(text='🇬🇧', callback_data='setlang EN')
+                btn_ua = types.InlineKeyboardButton(text='🇺🇦', callback_data=router.encode('sl', 'UA'))
+                btn_ru = types.InlineKeyboardButton(text='🇷🇺', callback_data=router.encode('sl', 'RU'))
+                btn_en = types.InlineKeyboardButton(text='🇬🇧', callback_data=router.encode('sl', 'EN'))
 
-            markup.add(btn_ua, btn_ru, btn_en)
-            bot.send_message(message.from_user.id,
-                             functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                 'language hint'], reply_markup=markup)
+                markup.add(btn_ua, btn_ru, btn_en)
+                bot.send_message(message.from_user.id,
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                                     'language hint'], reply_markup=markup)
 
-            db_connection.commit()
-            logger.info('Success')
-        else:
+                logger.debug('Success')
+            else:
 
-            logger.info('User has already been registered.')
-            bot.send_message(message.from_user.id,
-                             functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                 'already started'],
-                             reply_markup=main_menu_markup(PREFERRED_LANGUAGE))
+                logger.debug('User has already been registered.')
+                bot.send_message(message.from_user.id,
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                                     'already started'],
+                                 reply_markup=main_menu_markup(PREFERRED_LANGUAGE))
 
 
 @bot.message_handler(func=lambda
         x: x.text == 'CREATE NEW TODO LIST' or x.text == 'СОЗДАТЬ НОВЫЙ TODO СПИСОК' or x.text == 'СТВОРИТИ TODO СПИСОК')
 def create_list(message):  # creates a new list
     if message.chat.type == 'private':
-        logger.info(f'User with id - {message.from_user.id} is trying to create new list.')
+        logger.debug('User with id - %s is trying to create new list.', message.from_user.id)
 
-        db_connection = sqlite3.connect(DB_NAME)
-        db_cursor = db_connection.cursor()
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
 
-        msg = bot.send_message(message.from_user.id,
-                               functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                   'todo creation'][2])
+            bot.send_message(message.from_user.id,
+                             functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                                 'todo creation'][2])
 
-        logger.info('Calling next step handler.')
-        bot.register_next_step_handler(msg, create_list_next_step)
+            logger.debug('Waiting for the name of the list.')
+            context.set_conversation('create_list')
 
 
-def create_list_next_step(message):
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
+@conversations.step('create_list')
+def create_list_next_step(message, context, data):
+    db_cursor = context.cursor
 
     # checking if name is not to long
     if len(message.text) > 1000 or message.text.find('_') != -1:
-        msg = bot.send_message(message.from_user.id,
-                         functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+        bot.send_message(message.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                              'todo creation'][1])
-        bot.register_next_step_handler(msg, create_list_next_step)
-        logger.info('The name is too long.')
+        logger.debug('The name is too long.')
     else:
+        context.end_conversation()
 
         # getting a current time
         cur_time = time.time()
 
         # getting a user_id in DB
-        db_cursor.execute('SELECT id FROM Users WHERE tele_id = ?', (message.from_user.id,))
-
         fetched = True
-        try:
-            db_user_id = db_cursor.fetchone()[0]
-            logger.info('User is registered. Proceeding...')
-        except TypeError:
+        db_user_id = functions.user_id_db(context)
+
+        if db_user_id is not None:
+            logger.debug('User is registered. Proceeding...')
+        else:
             bot.send_message(message.from_user.id,
-                             functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+                             functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                                  'lang switch'][3])
             fetched = False
-            logger.info('User is not registered. Operation is unsuccessful.')
+            logger.debug('User is not registered. Operation is unsuccessful.')
 
         # if user is registered
         if fetched:
@@ -252,466 +284,492 @@ def create_list_next_step(message):
                 db_cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(? , ?, ?)',
                                   (cur_time, db_user_id, message.text))
 
-                markup = types.InlineKeyboardMarkup()
-
-                lists = functions.get_lists_db(db_cursor, message.from_user.id)
-
                 # making a keyboard to show the list
-                i = 0
-                while i < len(lists):
-                    if lists[i][2] == message.text:
-                        break
-                    i += 1
-
-                markup.add(types.InlineKeyboardButton(text=functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['todo creation'][-1],
-                                                      callback_data=f'getlist {message.text.replace(" ", "_")} {i}'
+                markup = types.InlineKeyboardMarkup()
+                markup.add(types.InlineKeyboardButton(text=functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['todo creation'][-1],
+                                                      callback_data=router.encode('gl', db_cursor.lastrowid)
                                                       ))
                 bot.send_message(message.from_user.id,
-                                 functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                                      'todo creation'][0], reply_markup=markup)
-                logger.info('Created.')
+                logger.debug('Created.')
 
             # if name is not unique
             except sqlite3.IntegrityError:
                 bot.send_message(message.from_user.id,
-                                 functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                                      'todo creation'][3])
 
-                logger.info('Name of the list is not unique. Operation is unsuccessful.')
-
-    db_connection.commit()
-
-    db_cursor.close()
-    db_connection.close()
+                logger.debug('Name of the list is not unique. Operation is unsuccessful.')
 
 
 @bot.message_handler(func=lambda x: x.text == 'МОЇ СПИСКИ' or x.text == 'MY LISTS' or x.text == 'МОИ СПИСКИ')
 def get_lists(message):
     if message.chat.type == 'private':
-        db_connection = sqlite3.connect(DB_NAME)
-        db_cursor = db_connection.cursor()
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
 
-        logger.info(f'User with id - {message.from_user.id} is trying to get list of lists. Fetching data from DB...')
+            logger.debug('User with id - %s is trying to get list of lists. Fetching data from DB...', message.from_user.id)
 
-        # getting a data from a db (format - [(id1, time1, name1),...,(idn, timen, namen), ])
-        lists = functions.get_lists_db(db_cursor, message.from_user.id)
+            # setting a keyboard with the first page of lists
+            markup = functions.lists_buttons(context, 'gl')
 
-        # user has no lists
-        if not len(lists):
-            bot.send_message(message.from_user.id,
-                             functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                 'get lists'][0])
-            logger.info('User has no lists.')
-        else:
-            i = 0
-            phrases = functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['get lists'][
-                1]
+            # user has no lists
+            if markup is None:
+                bot.send_message(message.from_user.id,
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                                     'get lists'][0])
+                logger.debug('User has no lists.')
+            else:
+                phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['get lists'][
+                    1]
 
-            # setting a keyboard
-            markup = types.InlineKeyboardMarkup()
-            markup.row_width = 4
+                bot.send_message(message.from_user.id, phrases, reply_markup=markup)
 
-            while i < len(lists):
-                markup.add(types.InlineKeyboardButton(lists[i][2], callback_data=f'getlist {lists[i][2].replace(" ", "_")} {i}'))
-                i += 1
+                logger.debug('Success.')
 
-            bot.send_message(message.from_user.id, phrases, reply_markup=markup)
 
-            logger.info('Success.')
+# logs every callback route, the records made by the route have its name
+def log_route(route, call, proceed):
+    logs.bind(route=route.action)
+    logger.debug('User with id - %s called route %s.', call.from_user.id, route.action)
 
-        db_cursor.close()
-        db_connection.close()
+    return proceed()
+
+
+callback_router = router.CallbackRouter()
+callback_router.add_middleware(log_route)
+callback_router.add_middleware(metrics.route_middleware)
 
 
 @bot.callback_query_handler(func=lambda call: True)
 def universal_callback_handler(call):
-    call_list = call.data.split()
+    with database.session() as db_cursor:
+        context = user_context.load(db_cursor, call.from_user.id)
+
+        if not callback_router.dispatch(call, context):
+            logger.info('Unknown callback data - %s', call.data)
+            bot.answer_callback_query(call.id)
 
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
 
-    # saving a callback to access it in the future
-    db_cursor.execute('UPDATE Users SET last_callback = ? WHERE tele_id = ?', (call.data, call.from_user.id))
-    db_connection.commit()
-    # handling a call from 'choose list' keyboard
-    if call_list[0] == 'getlist':
-        call_list[1] = call_list[1].replace("_", " ")
-        logger.info(
-            f'User with id - {call.from_user.id} is trying to get a list {call_list[1]}. Fetching data from DB...')
+# returns a text and a keyboard of one page of the list (renders are cached until the list is changed)
+# direction and key - see functions.get_tasks_page
+def render_list(context, sheet_id, sheet_name, direction=None, key=None):
+    language = functions.get_language(context) or PREFERRED_LANGUAGE
+    page = (direction, *key) if direction else None
 
-        # getting the lists
-        lists = functions.get_lists_db(db_cursor, call.from_user.id)
+    cached = render_cache.get(sheet_id, language, page)
+    if cached is not None:
+        return cached
 
-        # checking if data is correct
-        found = False
-        try:
-            if call_list[1] == lists[int(call_list[2])][2]:
-                found = True
-        except IndexError:
-            pass
-
-        if found:
-            logger.info('Data is correct.')
-
-            # getting tasks from the list
-            db_cursor.execute('SELECT task, deadline, status, importance FROM Tasks WHERE sheet_id = ? ORDER BY status',
-                              (int(lists[int(call_list[2])][0]),))
-            tasks = db_cursor.fetchall()
-
-            # there`s no tasks in the list
-            if not len(tasks):
-                answer = '*' + call_list[1] + '*' + ':\n\n' + '🔹' * 15 + '\n\n_' + \
-                         functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['get lists'][
-                             2] + '_\n\n' + '🔹' * 15
-
-                # making a button that allows to add a task
-                markup = types.InlineKeyboardMarkup()
-                markup.add(types.InlineKeyboardButton(
-                    text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['add task'][
-                        0],
-                    callback_data=f'addtask  {call_list[1].replace(" ", "_")}'))
+    # getting one page of tasks from the list
+    tasks, has_previous, has_next = functions.get_tasks_page(context, sheet_id, direction, key)
+
+    # the page became empty (tasks were deleted), showing the first one
+    if not tasks and direction:
+        tasks, has_previous, has_next = functions.get_tasks_page(context, sheet_id)
 
-                bot.edit_message_text(answer, message_id=call.message.message_id, chat_id=call.from_user.id,
-                                      parse_mode='Markdown', reply_markup=markup)
-                bot.answer_callback_query(call.id)
+    phrases = functions.get_dialog_profile(language)
 
-            # displaying list
+    # there`s no tasks in the list
+    if not len(tasks):
+        answer = '*' + sheet_name + '*' + ':\n\n' + '🔹' * 15 + '\n\n_' + phrases['get lists'][2] + '_\n\n' + '🔹' * 15
+
+        # making a button that allows to add a task
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton(text=phrases['add task'][0], callback_data=router.encode('at', sheet_id)))
+        markup.add(types.InlineKeyboardButton(text=phrases['bulk'][0], callback_data=router.encode('ab', sheet_id)))
+
+    # displaying list
+    else:
+        header = ''.join(['*', sheet_name, '*:\n\n', '🔹' * 15, '\n\n'])
+        footer = '\n\n' + '🔹' * 15
+        lines = functions.render_task_lines(tasks)
+
+        # cutting the page if it doesn`t fit into one message
+        count = functions.fit_lines(lines, functions.MESSAGE_LIMIT - functions.message_length(header + footer),
+                                    reverse=direction == 'p')
+        if count < len(lines):
+            if direction == 'p':
+                tasks, lines, has_previous = tasks[-count:], lines[-count:], True
             else:
-                result = ''
-                for task in tasks:
-                    result += functions.task_parser(task) + '\n\n'
+                tasks, lines, has_next = tasks[:count], lines[:count], True
 
-                answer = '*' + call_list[1] + '*' + ':\n\n' + '🔹' * 15 + '\n\n' + result + '🔹' * 15
+        answer = ''.join([header, '\n\n'.join(lines), footer])
 
-                markup = types.InlineKeyboardMarkup()
+        markup = types.InlineKeyboardMarkup()
 
-                btn1 = types.InlineKeyboardButton(
-                    text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['add task'][0],
-                    callback_data=f'addtask  {call_list[1].replace(" ", "_")}')
-                btn2 = types.InlineKeyboardButton(
-                    text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['buttons'][0],
-                    callback_data=f'markdone {call_list[1].replace(" ", "_")}'
-                )
-
-                btn3 = types.InlineKeyboardButton(
-                    text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['buttons'][1],
-                    callback_data=f'resetdeadline {call_list[1].replace(" ", "_")}'
-                )
-
-                btn4 = types.InlineKeyboardButton(
-                    text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['buttons'][2],
-                    callback_data=f'deletetask {call_list[1].replace(" ", "_")}'
-                )
-                markup.row_width = 2
-                markup.add(btn1, btn4)
-                markup.add(btn2)
-                markup.add(btn3)
-
-                bot.edit_message_text(answer, message_id=call.message.message_id, chat_id=call.from_user.id,
-                                      parse_mode='Markdown', reply_markup=markup)
-
-        # list is not found
-        else:
-            bot.send_message(call.from_user.id,
-                             functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)[
-                                 'lang switch'][3])
+        btn1 = types.InlineKeyboardButton(text=phrases['add task'][0], callback_data=router.encode('at', sheet_id))
+        btn2 = types.InlineKeyboardButton(text=phrases['buttons'][0], callback_data=router.encode('md', sheet_id))
+        btn3 = types.InlineKeyboardButton(text=phrases['buttons'][1], callback_data=router.encode('rd', sheet_id))
+        btn4 = types.InlineKeyboardButton(text=phrases['buttons'][2], callback_data=router.encode('dt', sheet_id))
+        btn5 = types.InlineKeyboardButton(text=phrases['bulk'][0], callback_data=router.encode('ab', sheet_id))
 
-            logger.info(f'Unable to find list {call_list[1]} in the database...')
-            bot.answer_callback_query(call.id)
+        # tasks[i][2] - status, tasks[i][4] - id
+        navigation = functions.page_buttons(has_previous, has_next,
+                                            router.encode('gp', sheet_id, 'p', tasks[0][2], tasks[0][4]),
+                                            router.encode('gp', sheet_id, 'n', tasks[-1][2], tasks[-1][4]))
+        if navigation:
+            markup.row(*navigation)
 
-    # handling a call from add task button
-    elif call_list[0] == 'addtask':
-        logger.info(f'User with id - {call.from_user.id} is trying to add a task  to a list {call_list[1]}.')
+        markup.row_width = 2
+        markup.add(btn1, btn4)
+        markup.add(btn5)
+        markup.add(btn2)
+        markup.add(btn3)
 
-        exists = functions.list_existence(call_list[1].replace('_', ' '), db_cursor, call.from_user.id)
+    render_cache.put(sheet_id, language, answer, markup, page)
+    return answer, markup
 
-        if exists:
-            msg = bot.send_message(call.from_user.id,
-                                   functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['add task'][1])
 
-            bot.answer_callback_query(call.id)
-            bot.register_next_step_handler(msg, name_step)
-        else:
-            bot.answer_callback_query(call.id, text=
-            functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['list not exist'])
+# handling a call from 'choose list' keyboard
+@callback_router.route('gl', int)
+def get_list(call, context, sheet_id):
+    show_list(call, context, sheet_id)
 
-    # handling a call from mark as done button
-    elif call_list[0] == 'markdone':
 
-        exists = functions.list_existence(call_list[1].replace("_", " "), db_cursor, call.from_user.id)
-        if exists:
-            markup = functions.tasks_buttons(db_cursor, call_list[1], call.from_user.id, 'donetask')
-            bot.edit_message_text(functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['markdone'][0],
-                                  message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
+# handling a call from '<' / '>' buttons of the list
+@callback_router.route('gp', int, str, int, int)
+def get_list_page(call, context, sheet_id, direction, status, task_id):
+    show_list(call, context, sheet_id, direction, (status, task_id))
 
-            bot.answer_callback_query(call.id)
-        else:
-            bot.answer_callback_query(call.id, text=
-            functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['list not exist'])
 
-    # handling a call from delete task button
-    elif call_list[0] == 'deletetask':
+def show_list(call, context, sheet_id, direction=None, key=None):
+    logger.debug('User with id - %s is trying to get a list %s. Fetching data from DB...', call.from_user.id, sheet_id)
 
-        exists = functions.list_existence(call_list[1].replace("_", " "), db_cursor, call.from_user.id)
+    # checking if the list belongs to the user
+    sheet_name = functions.get_sheet_name(context, sheet_id)
 
-        if exists:
-            markup = functions.tasks_buttons(db_cursor, call_list[1], call.from_user.id, 'deltask')
-            bot.edit_message_text(functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['markdone'][0],
-                                  message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
+    if sheet_name is not None:
+        logger.debug('Data is correct.')
 
-            bot.answer_callback_query(call.id)
-        else:
-            bot.answer_callback_query(call.id, text=
-            functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['list not exist'])
+        answer, markup = render_list(context, sheet_id, sheet_name, direction, key)
 
-    # handling a call from set deadline task
-    elif call_list[0] == 'resetdeadline':
+        tracker.edit_text(answer, message_id=call.message.message_id, chat_id=call.from_user.id,
+                          parse_mode='Markdown', reply_markup=markup)
+        bot.answer_callback_query(call.id)
 
-        exists = functions.list_existence(call_list[1].replace("_", " "), db_cursor, call.from_user.id)
+    # list is not found
+    else:
+        bot.send_message(call.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                             'lang switch'][3])
 
-        if exists:
-            markup = functions.tasks_buttons(db_cursor, call_list[1], call.from_user.id, 'setdeadline')
-            bot.edit_message_text(
-                functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['markdone'][0],
-                message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
+        logger.debug('Unable to find list %s in the database...', sheet_id)
+        bot.answer_callback_query(call.id)
 
-            bot.answer_callback_query(call.id)
-        else:
-            bot.answer_callback_query(call.id, text=
-            functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['list not exist'])
 
-    # handling a call from button with task name
-    elif call_list[0] == 'donetask':
-        db_cursor.execute('UPDATE Tasks SET status = ? WHERE sheet_id = ? AND id = ?', (1, int(call_list[2]), int(call_list[1])))
-        db_connection.commit()
+# answers that the list doesn`t exist (or belongs to somebody else)
+def list_not_found(call, context):
+    bot.answer_callback_query(call.id, text=
+    functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['list not exist'])
 
-        db_cursor.execute('SELECT name FROM Sheets WHERE id = ?', (int(call_list[2]),))
-        sheet_name = db_cursor.fetchone()[0]
-        lists = functions.get_lists_db(db_cursor, call.from_user.id)
 
-        # making a keyboard to show the lists
-        i = 0
-        while i < len(lists):
-            if lists[i][2] == sheet_name:
-                break
-            i += 1
+# handling a call from add task button
+# (starts a dialog, the task is collected by name_step, deadline_step and priority_step)
+@callback_router.route('at', int)
+def add_task(call, context, sheet_id):
+    logger.debug('User with id - %s is trying to add a task  to a list %s.', call.from_user.id, sheet_id)
 
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['add task'][10],
-                                              callback_data=f'getlist {sheet_name.replace(" ", "_")} {i}'))
+    if functions.get_sheet_name(context, sheet_id) is not None:
+        bot.send_message(call.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task'][1])
 
-        bot.edit_message_text(functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['markdone'][2],
-                              message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
         bot.answer_callback_query(call.id)
+        context.set_conversation('name', {'sheet_id': sheet_id})
+    else:
+        list_not_found(call, context)
 
-    elif call_list[0] == 'deltask':
-        db_cursor.execute('DELETE FROM Tasks WHERE sheet_id = ? AND id = ?', (int(call_list[2]), int(call_list[1])))
-        db_connection.commit()
 
-        db_cursor.execute('SELECT name FROM Sheets WHERE id = ?', (int(call_list[2]),))
-        sheet_name = db_cursor.fetchone()[0]
-        lists = functions.get_lists_db(db_cursor, call.from_user.id)
+# handling a call from add many tasks button (starts a dialog, the tasks are added by bulk_step)
+@callback_router.route('ab', int)
+def add_tasks(call, context, sheet_id):
+    logger.debug('User with id - %s is trying to add tasks to a list %s.', call.from_user.id, sheet_id)
 
-        # making a keyboard to show the lists
-        i = 0
-        while i < len(lists):
-            if lists[i][2] == sheet_name:
-                break
-            i += 1
+    if functions.get_sheet_name(context, sheet_id) is not None:
+        bot.send_message(call.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['bulk'][1],
+                         parse_mode='Markdown')
 
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text=functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['add task'][10],
-                                              callback_data=f'getlist {sheet_name.replace(" ", "_")} {i}'))
-
-        bot.edit_message_text(functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['markdone'][3],
-                              message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
         bot.answer_callback_query(call.id)
+        context.set_conversation('bulk', {'sheet_id': sheet_id})
+    else:
+        list_not_found(call, context)
+
 
-    elif call_list[0] == 'setdeadline':
+# shows a keyboard with tasks of the list, mode - route of the task buttons
+def choose_task(call, context, sheet_id, mode, direction=None, key=None):
+    if functions.get_sheet_name(context, sheet_id) is not None:
+        markup = functions.tasks_buttons(context, sheet_id, mode, direction, key)
+        tracker.edit_text(functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['markdone'][0],
+                          message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
 
-        msg = bot.send_message(call.from_user.id,
-                               functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)[
-                                   'add task'][5],
-                               parse_mode='Markdown')
         bot.answer_callback_query(call.id)
-        bot.register_next_step_handler(msg, deadline_change)
+    else:
+        list_not_found(call, context)
+
 
-    elif call_list[0] == 'deletelist':
+# handling a call from mark as done button
+@callback_router.route('md', int)
+def mark_done(call, context, sheet_id):
+    choose_task(call, context, sheet_id, 'dn')
 
-        logger.info(f'Deleting a list with id - {call_list[1]}')
 
-        db_cursor.execute('DELETE FROM Tasks WHERE sheet_id = ?', (int(call_list[1]),))
-        db_cursor.execute('DELETE FROM Sheets WHERE id = ?', (int(call_list[1]),))
+# handling a call from delete task button
+@callback_router.route('dt', int)
+def delete_task(call, context, sheet_id):
+    choose_task(call, context, sheet_id, 'xt')
 
-        db_connection.commit()
 
-        bot.edit_message_text(functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['delete list'][1],
-                              message_id=call.message.message_id, chat_id=call.from_user.id)
+# handling a call from set deadline task
+@callback_router.route('rd', int)
+def reset_deadline(call, context, sheet_id):
+    choose_task(call, context, sheet_id, 'sd')
 
+
+# handling a call from '<' / '>' buttons of the tasks keyboard
+@callback_router.route('tp', int, str, str, int, int)
+def choose_task_page(call, context, sheet_id, mode, direction, status, task_id):
+    if mode in ('dn', 'xt', 'sd'):
+        choose_task(call, context, sheet_id, mode, direction, (status, task_id))
+    else:
         bot.answer_callback_query(call.id)
 
-    # changing the language
-    elif call_list[0] == 'setlang':
 
-        db_cursor.execute('UPDATE Users SET language = ? WHERE tele_id = ?', (call_list[1], call.from_user.id))
-        db_connection.commit()
+# handling a call from '<' / '>' buttons of the lists keyboard
+@callback_router.route('lp', str, str, int)
+def lists_page(call, context, mode, direction, sheet_id):
+    markup = functions.lists_buttons(context, mode, direction, (sheet_id,)) if mode in ('gl', 'xl') else None
 
-        try:
-            bot.edit_message_text(functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['lang switch'][2],
-                                  chat_id=call.from_user.id,
-                                  message_id=call.message.message_id)
+    if markup is not None:
+        tracker.edit_markup(chat_id=call.from_user.id, message_id=call.message.message_id, reply_markup=markup)
 
-            bot.answer_callback_query(call.id)
+    bot.answer_callback_query(call.id)
 
-            bot.send_message(call.from_user.id, functions.get_lang_profile_chat(db_cursor, call.from_user.id, PREFERRED_LANGUAGE)['started'],
-                             reply_markup=main_menu_markup(functions.get_language(db_cursor, call.from_user.id)))
-        except TypeError:
-            db_cursor.execute('UPDATE Users SET language = ? WHERE tele_id = ?', (PREFERRED_LANGUAGE, call.from_user.id))
-            bot.answer_callback_query(call.id, text='Something strange has happened.')
 
-    db_cursor.close()
-    db_connection.close()
+# drops the caches with the task once more after a queued write of the task (see write_behind.py)
+def invalidate_task(sheet_id, user_id):
+    render_cache.invalidate(sheet_id)
+    search.invalidate(user_id)
 
 
-def deadline_change(message):
+# shows the message about the changed task with a button to open the list
+def task_changed(call, context, sheet_id, phrase_index):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(text=functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task'][10],
+                                          callback_data=router.encode('gl', sheet_id)))
 
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
+    tracker.edit_text(functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['markdone'][phrase_index],
+                      message_id=call.message.message_id, chat_id=call.from_user.id, reply_markup=markup)
+    bot.answer_callback_query(call.id)
 
-    correct = functions.get_timestamp(message.text)
 
-    # deadline data is incorrect
-    if not correct:
-        msg = bot.send_message(message.from_user.id,
-                               functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                   'add task'][4])
-        logger.info('Problems with date.Trying again...')
-        bot.register_next_step_handler(msg, deadline_change)
+# handling a call from button with task name
+@callback_router.route('dn', int, int)
+def done_task(call, context, task_id, sheet_id):
+    if functions.get_sheet_name(context, sheet_id) is None:
+        return list_not_found(call, context)
 
-    else:
+    write_behind.execute(context.cursor, 'status', ('Tasks.status', task_id),
+                         'UPDATE Tasks SET status = ? WHERE sheet_id = ? AND id = ?', (1, sheet_id, task_id),
+                         on_flush=lambda: invalidate_task(sheet_id, context.id))
+    render_cache.invalidate(sheet_id)
+    search.invalidate(context.id)
+    reminders.task_closed(task_id)
 
-        callback = functions.last_callback(db_cursor, message.from_user.id).split()
-        if callback[0] == 'setdeadline':
-            db_cursor.execute('UPDATE Tasks SET deadline = ? WHERE sheet_id = ? AND id = ?',
-                              (correct, int(callback[2]), int(callback[1])))
+    task_changed(call, context, sheet_id, 2)
 
-            # making a button to open the list
-            lists = functions.get_lists_db(db_cursor, message.from_user.id)
 
-            db_cursor.execute('SELECT name FROM Sheets WHERE id = ?', (int(callback[2]),))
-            sheet_name = db_cursor.fetchone()[0]
+@callback_router.route('xt', int, int)
+def del_task(call, context, task_id, sheet_id):
+    if functions.get_sheet_name(context, sheet_id) is None:
+        return list_not_found(call, context)
 
-            i = 0
-            while i < len(lists):
-                if lists[i][2] == sheet_name:
-                    break
-                i += 1
+    context.cursor.execute('DELETE FROM Tasks WHERE sheet_id = ? AND id = ?', (sheet_id, task_id))
+    render_cache.invalidate(sheet_id)
+    search.invalidate(context.id)
+    reminders.task_closed(task_id)
 
-            phrases = functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['add task']
+    task_changed(call, context, sheet_id, 3)
 
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton(text=phrases[10], callback_data=f'getlist {sheet_name.replace(" ", "_")} {i}'))
 
-            bot.send_message(message.from_user.id, phrases[11], reply_markup=markup)
+# (starts a dialog, deadline_change takes the task from it)
+@callback_router.route('sd', int, int)
+def set_deadline(call, context, task_id, sheet_id):
+    if functions.get_sheet_name(context, sheet_id) is None:
+        return list_not_found(call, context)
 
-            db_connection.commit()
-            db_cursor.close()
-            db_connection.close()
+    bot.send_message(call.from_user.id,
+                     functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                         'add task'][5],
+                     parse_mode='Markdown')
+    bot.answer_callback_query(call.id)
+    context.set_conversation('deadline_change', {'task_id': task_id, 'sheet_id': sheet_id})
 
 
-# next_step_handlers for adding tasks:
-def name_step(message):
-    logger.info('Processing name step...')
+@callback_router.route('xl', int)
+def delete_list_callback(call, context, sheet_id):
+    db_cursor = context.cursor
 
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
+    if functions.get_sheet_name(context, sheet_id) is None:
+        return list_not_found(call, context)
 
-    # checking if data is correct
-    if len(message.text) > 1000:
-        msg = bot.send_message(message.from_user.id,
-                         functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                             'add task'][2])
-        logger.info('Task name is too long.Or "_"-rule is violated')
+    logger.debug('Deleting a list with id - %s', sheet_id)
 
-        bot.register_next_step_handler(msg, name_step)
+    db_cursor.execute('DELETE FROM Tasks WHERE sheet_id = ?', (sheet_id,))
+    db_cursor.execute('DELETE FROM Sheets WHERE id = ?', (sheet_id,))
 
-    else:
-        # getting a last callback
-        callback = functions.last_callback(db_cursor, message.from_user.id).split()
+    render_cache.invalidate(sheet_id)
+    search.invalidate(context.id)
 
-        if callback[0] == 'addtask':
+    tracker.edit_text(functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['delete list'][1],
+                      message_id=call.message.message_id, chat_id=call.from_user.id)
 
-            logger.info('Getting a sheet_id from db...')
+    bot.answer_callback_query(call.id)
 
-            sheet_id = functions.get_sheet_id(db_cursor, message.from_user.id, callback[1].replace("_", " "))
-            try:
-                db_cursor.execute('INSERT INTO Tasks(task, sheet_id, status) VALUES(?, ?, ?)', (message.text, sheet_id, 0))
-                db_cursor.execute('UPDATE Users SET buffer = ? WHERE tele_id = ?', (message.text, message.from_user.id))
-                logger.info('Tasks name was inserted successfully.')
 
-                msg = bot.send_message(message.from_user.id,
-                                       functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['add task'][5],
-                                       parse_mode='Markdown')
+# changing the language
+@callback_router.route('sl', str)
+def set_language_callback(call, context, language):
+    context.set_language(language)
 
-                bot.register_next_step_handler(msg, deadline_step)
-            except sqlite3.IntegrityError:
-                msg = bot.send_message(message.from_user.id, functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                             'add task'][3])
+    try:
+        tracker.edit_text(functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['lang switch'][2],
+                          chat_id=call.from_user.id,
+                          message_id=call.message.message_id)
+
+        bot.answer_callback_query(call.id)
 
-                logger.info('Name is not unique.Trying again.')
-                bot.register_next_step_handler(msg, name_step)
+        bot.send_message(call.from_user.id, functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['started'],
+                         reply_markup=main_menu_markup(functions.get_language(context)))
+    except TypeError:
+        context.set_language(PREFERRED_LANGUAGE)
+        bot.answer_callback_query(call.id, text='Something strange has happened.')
+
+
+# old callbacks (buttons sent before ids were used in callback_data) are redirected to the routes above
+def forward_by_name(action):
+    def handler(call, context, sheet_name, *args):
+        try:
+            sheet_id = functions.get_sheet_id(context, sheet_name)
+        except TypeError:
+            return list_not_found(call, context)
 
-    db_connection.commit()
+        callback_router.forward(action, call, context, sheet_id)
 
-    db_cursor.close()
-    db_connection.close()
+    return handler
 
 
-def deadline_step(message):
-    logger.info('Processing deadline step...')
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
+def forward_to(action):
+    def handler(call, context, *args):
+        callback_router.forward(action, call, context, *args)
 
+    return handler
+
+
+callback_router.route('getlist', router.name, int)(forward_by_name('gl'))
+callback_router.route('addtask', router.name)(forward_by_name('at'))
+callback_router.route('markdone', router.name)(forward_by_name('md'))
+callback_router.route('deletetask', router.name)(forward_by_name('dt'))
+callback_router.route('resetdeadline', router.name)(forward_by_name('rd'))
+
+callback_router.route('donetask', int, int)(forward_to('dn'))
+callback_router.route('deltask', int, int)(forward_to('xt'))
+callback_router.route('setdeadline', int, int)(forward_to('sd'))
+callback_router.route('deletelist', int)(forward_to('xl'))
+callback_router.route('setlang', str)(forward_to('sl'))
+
+
+@conversations.step('deadline_change')
+def deadline_change(message, context, data):
     correct = functions.get_timestamp(message.text)
 
     # deadline data is incorrect
     if not correct:
-        msg = bot.send_message(message.from_user.id, functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['add task'][4])
-        logger.info('Problems with date.Trying again...')
-        bot.register_next_step_handler(msg, deadline_step)
+        bot.send_message(message.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                             'add task'][4])
+        logger.debug('Problems with date.Trying again...')
 
-    # deadline data is correct
     else:
-        # getting last callback
-        callback = functions.last_callback(db_cursor, message.from_user.id).split()
-        if callback[0] == 'addtask':
-            sheet_id = functions.get_sheet_id(db_cursor, message.from_user.id, callback[1].replace("_", " "))
+        context.end_conversation()
+
+        # an overdue task is in process again, the sweeper marks it once more if the deadline is in the past,
+        # the reminder is sent again for the new deadline
+        sheet_id = data['sheet_id']
+        write_behind.execute(context.cursor, 'deadline', ('Tasks.deadline', data['task_id']),
+                             'UPDATE Tasks SET deadline = ?, status = CASE status WHEN 2 THEN 0 ELSE status END, '
+                             'reminded = 0 WHERE sheet_id = ? AND id = ?',
+                             (correct, sheet_id, data['task_id']),
+                             on_flush=lambda: invalidate_task(sheet_id, context.id))
+        render_cache.invalidate(sheet_id)
+        search.invalidate(context.id)
+        reminders.task_changed(data['task_id'], correct)
+
+        phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task']
+
+        # making a button to open the list
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton(text=phrases[10], callback_data=router.encode('gl', sheet_id)))
+
+        bot.send_message(message.from_user.id, phrases[11], reply_markup=markup)
 
-            # saving data
-            db_cursor.execute('SELECT buffer FROM Users WHERE tele_id = ?', (message.from_user.id,))
 
-            db_cursor.execute('UPDATE Tasks SET deadline = ? WHERE task = ? AND sheet_id = ?', (correct, db_cursor.fetchone()[0], sheet_id))
+# steps of adding a task, the task is kept in the dialog and inserted at the last step
+@conversations.step('name')
+def name_step(message, context, data):
+    logger.debug('Processing name step...')
+
+    # checking if data is correct
+    if len(message.text) > functions.MAX_TASK_LENGTH:
+        bot.send_message(message.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                             'add task'][2])
+        logger.debug('Task name is too long.Or "_"-rule is violated')
 
-            logger.info('Deadline was successfully set. Processing priority step...')
+    # names are unique in the list
+    elif functions.task_exists(context, data['sheet_id'], message.text):
+        bot.send_message(message.from_user.id, functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+            'add task'][3])
+        logger.debug('Name is not unique.Trying again.')
 
-            # setting up a priority keyboard
-            markup = types.ReplyKeyboardMarkup()
-            markup.row_width = 2
-            markup.add(types.KeyboardButton('⬜'), types.KeyboardButton('🟩'), types.KeyboardButton('🟨'), types.KeyboardButton('🟥'))
+    else:
+        context.set_conversation('deadline', dict(data, name=message.text))
+        logger.debug('Tasks name was saved successfully.')
+
+        bot.send_message(message.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task'][5],
+                         parse_mode='Markdown')
+
+
+@conversations.step('deadline')
+def deadline_step(message, context, data):
+    logger.debug('Processing deadline step...')
+
+    correct = functions.get_timestamp(message.text)
 
-            msg = bot.send_message(message.from_user.id,
-                                   functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['add task'][6],
-                                   reply_markup=markup)
+    # deadline data is incorrect
+    if not correct:
+        bot.send_message(message.from_user.id, functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task'][4])
+        logger.debug('Problems with date.Trying again...')
 
-            bot.register_next_step_handler(msg, priority_step)
+    # deadline data is correct
+    else:
+        context.set_conversation('priority', dict(data, deadline=correct))
+        logger.debug('Deadline was successfully set. Processing priority step...')
 
-    db_connection.commit()
+        # setting up a priority keyboard
+        markup = types.ReplyKeyboardMarkup()
+        markup.row_width = 2
+        markup.add(types.KeyboardButton('⬜'), types.KeyboardButton('🟩'), types.KeyboardButton('🟨'), types.KeyboardButton('🟥'))
 
-    db_cursor.close()
-    db_connection.close()
+        bot.send_message(message.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task'][6],
+                         reply_markup=markup)
 
 
-def priority_step(message):
+@conversations.step('priority')
+def priority_step(message, context, data):
 
     importance = -1
 
@@ -724,97 +782,454 @@ def priority_step(message):
     elif message.text == '🟥':
         importance = 3
 
-    db_connection = sqlite3.connect(DB_NAME)
-    db_cursor = db_connection.cursor()
-
     # checking if data is correct
     if importance != -1:
+        sheet_id = data['sheet_id']
 
-        callback = functions.last_callback(db_cursor, message.from_user.id).split()
-        sheet_id = functions.get_sheet_id(db_cursor, message.from_user.id, callback[1].replace("_", " "))
+        # the list could be deleted while the task was being added
+        if functions.get_sheet_name(context, sheet_id) is None:
+            context.end_conversation()
+            bot.send_message(message.from_user.id,
+                             functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['list not exist'],
+                             reply_markup=main_menu_markup(functions.get_language(context)))
+            logger.debug('The list was deleted.')
+            return
 
         # saving data
-        db_cursor.execute('SELECT buffer FROM Users WHERE tele_id = ?', (message.from_user.id,))
-
-        db_cursor.execute('UPDATE Tasks SET importance = ? WHERE task = ? AND sheet_id = ?',
-                          (importance, db_cursor.fetchone()[0], sheet_id))
-
-        logger.info('Priority was successfully set.')
+        try:
+            context.cursor.execute('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, ?, ?, ?)',
+                                   (data['name'], data['deadline'], 0, importance, sheet_id))
+        except sqlite3.IntegrityError:
+            # a task with the same name was added meanwhile, asking for another name
+            context.set_conversation('name', {'sheet_id': sheet_id})
+            bot.send_message(message.from_user.id, functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                'add task'][3])
+            logger.debug('Name is not unique.Trying again.')
+            return
+
+        task_id = context.cursor.lastrowid
+
+        context.end_conversation()
+        render_cache.invalidate(sheet_id)
+        search.invalidate(context.id)
+        reminders.task_changed(task_id, data['deadline'])
+
+        logger.debug('Task was successfully added.')
         # sending main menu keyboard
-        markup = main_menu_markup(functions.get_language(db_cursor, message.from_user.id))
+        markup = main_menu_markup(functions.get_language(context))
         bot.send_message(message.from_user.id,
-                         functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                              'add task'][7],
                          reply_markup=markup)
 
-        # making a button to open the list
-        lists = functions.get_lists_db(db_cursor, message.from_user.id)
-
-        i = 0
-        while i < len(lists):
-            if lists[i][2] == callback[1].replace("_", " "):
-                break
-            i += 1
-
-        phrases = functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['add task']
+        phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['add task']
 
+        # making a button to open the list
         markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton(text=phrases[10], callback_data=f'getlist {callback[1].replace(" ", "_")} {i}'))
+        markup.add(types.InlineKeyboardButton(text=phrases[10], callback_data=router.encode('gl', sheet_id)))
 
         # sending a button
         bot.send_message(message.from_user.id, phrases[9], reply_markup=markup)
     else:
         # data is incorrect
-        msg = bot.send_message(message.from_user.id,
-                         functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
+        bot.send_message(message.from_user.id,
+                         functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
                              'add task'][8])
 
-        logger.info('User entered incorrect data. Trying again...')
-        bot.register_next_step_handler(msg, priority_step)
+        logger.debug('User entered incorrect data. Trying again...')
+
+
+# phrases of the 'bulk' profile that describe errors of functions.parse_tasks and bulk_step
+BULK_ERRORS = {'format': 3, 'name': 4, 'date': 5, 'priority': 6, 'exists': 7, 'repeated': 8}
+
+
+# many tasks in one message, a line for every task (see functions.parse_tasks), the correct lines
+# are added at once, the others are reported
+@conversations.step('bulk')
+def bulk_step(message, context, data):
+    sheet_id = data['sheet_id']
+    phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)
+
+    # the list could be deleted meanwhile
+    if functions.get_sheet_name(context, sheet_id) is None:
+        context.end_conversation()
+        bot.send_message(message.from_user.id, phrases['list not exist'])
+        return
+
+    tasks = []
+    errors = []
+    names = set()
+
+    for number, task, error in functions.parse_tasks(message.text):
+        if error is None and task[0] in names:
+            error = 'repeated'
+
+        if error is None:
+            names.add(task[0])
+            tasks.append((number, task))
+        else:
+            errors.append((number, error))
+
+    # everything is inserted by one statement, the names that the list already has (even the ones added
+    # meanwhile) are ignored, they are the names that aren`t returned
+    rows = [(name, deadline, 0, importance, sheet_id) for number, (name, deadline, importance) in tasks]
+    context.cursor.execute(f'{transfer.INSERT_TASKS_SQL} RETURNING id, task', (json.dumps(rows),))
+    added = {name: task_id for task_id, name in context.cursor.fetchall()}
+
+    context.end_conversation()
+
+    errors += [(number, 'exists') for number, task in tasks if task[0] not in added]
+    tasks = [task for number, task in tasks if task[0] in added]
+
+    if tasks:
+        render_cache.invalidate(sheet_id)
+        search.invalidate(context.id)
 
-    db_connection.commit()
+        for name, deadline, importance in tasks:
+            reminders.task_changed(added[name], deadline)
 
-    db_cursor.close()
-    db_connection.close()
+    logger.debug('%s tasks were added, %s lines are incorrect.', len(tasks), len(errors))
+
+    header = phrases['bulk'][2].format(count=len(tasks))
+    lines = [phrases['bulk'][BULK_ERRORS[error]].format(line=number) for number, error in sorted(errors)]
+
+    # the errors that don`t fit into one message are only counted
+    count = functions.fit_lines(lines, functions.MESSAGE_LIMIT - functions.message_length(header) - 100)
+    if count < len(lines):
+        lines = lines[:count] + [phrases['bulk'][9].format(count=len(lines) - count)]
+
+    # making a button to open the list
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(text=phrases['add task'][10], callback_data=router.encode('gl', sheet_id)))
+
+    bot.send_message(message.from_user.id, '\n\n'.join([header, *lines]), reply_markup=markup)
+
+
+# /export [jsonl|csv|ics] - sends all lists of the user as a file
+@bot.message_handler(commands=['export'])
+def export_lists(message):
+    if message.chat.type != 'private':
+        return
+
+    parts = message.text.split(maxsplit=1)
+    file_format = parts[1].strip().lower() if len(parts) > 1 else transfer.FORMATS[0]
+
+    # the file is written to the disk, so memory doesn`t depend on the number of tasks
+    with tempfile.TemporaryFile() as file:
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
+            phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)
+
+            if not context.registered:
+                bot.send_message(message.from_user.id, phrases['lang switch'][3])
+                return
+            elif file_format not in transfer.FORMATS:
+                bot.send_message(message.from_user.id, phrases['transfer'][0])
+                return
+
+            logger.debug('User with id - %s is exporting lists to %s.', message.from_user.id, file_format)
+            count = transfer.export(db_cursor, context.id, file_format, file)
+
+        # the file is sent after the session, the database isn`t read while it`s uploaded
+        file.seek(0)
+        bot.send_document(message.from_user.id, file, visible_file_name=f'todo.{file_format}',
+                          caption=phrases['transfer'][1].format(count=count))
+
+
+@bot.message_handler(commands=['import'])
+def import_hint(message):
+    if message.chat.type == 'private':
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
+            bot.send_message(message.from_user.id,
+                             functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['transfer'][2])
+
+
+# a file made by /export (or any file of the same format) adds its lists and tasks to the lists of the user,
+# the whole file is imported or nothing
+@bot.message_handler(content_types=['document'])
+def import_lists(message):
+    if message.chat.type != 'private':
+        return
+
+    document = message.document
+    file_format = (document.file_name or '').rsplit('.', 1)[-1].lower()
+
+    with database.session() as db_cursor:
+        context = user_context.load(db_cursor, message.from_user.id)
+        phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)
+
+        if not context.registered:
+            bot.send_message(message.from_user.id, phrases['lang switch'][3])
+            return
+        elif file_format not in transfer.FORMATS or (document.file_size or 0) > transfer.MAX_IMPORT_BYTES:
+            bot.send_message(message.from_user.id, phrases['transfer'][3])
+            return
+
+    # the file is downloaded before the session, the database isn`t locked meanwhile
+    data = bot.download_file(bot.get_file(document.file_id).file_path)
+
+    with database.session() as db_cursor:
+        context = user_context.load(db_cursor, message.from_user.id)
+
+        db_cursor.execute('SAVEPOINT import')
+        try:
+            changed, lists, tasks, skipped = transfer.load(db_cursor, context.id,
+                                                           transfer.parse(file_format, io.BytesIO(data)))
+            db_cursor.execute('RELEASE import')
+        except (transfer.FormatError, UnicodeDecodeError) as e:
+            db_cursor.execute('ROLLBACK TO import')
+            db_cursor.execute('RELEASE import')
+
+            bot.send_message(message.from_user.id, phrases['transfer'][5].format(line=getattr(e, 'line', 1)))
+            logger.debug('Import failed: %s', e)
+            return
+
+        for sheet_id in changed:
+            render_cache.invalidate(sheet_id)
+        search.invalidate(context.id)
+
+        logger.debug('Imported %s lists and %s tasks, %s tasks are skipped.', lists, tasks, skipped)
+
+    # reminders of the new tasks are loaded from the database after the commit
+    if tasks:
+        reminders.reload()
+
+    bot.send_message(message.from_user.id, phrases['transfer'][4].format(lists=lists, tasks=tasks, skipped=skipped),
+                     reply_markup=main_menu_markup(functions.get_language(context)))
 
 
 @bot.message_handler(func=lambda x: x.text == 'ВИДАЛИТИ TODO СПИСОК' or x.text == 'DELETE TODO LIST' or x.text == 'УДАЛИТЬ TODO СПИСОК')
 def delete_list(message):
     if message.chat.type == 'private':
-        db_connection = sqlite3.connect(DB_NAME)
-        db_cursor = db_connection.cursor()
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
 
-        logger.info(f'User with id - {message.from_user.id} is trying to access deletelist keyboard.')
+            logger.debug('User with id - %s is trying to access deletelist keyboard.', message.from_user.id)
 
-        # getting a data from a db (format - [(id1, time1, name1),...,(idn, timen, namen), ])
-        lists = functions.get_lists_db(db_cursor, message.from_user.id)
+            # setting a keyboard with the first page of lists
+            markup = functions.lists_buttons(context, 'xl')
+
+            # user has no lists
+            if markup is None:
+                bot.send_message(message.from_user.id,
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)[
+                                     'get lists'][0])
+                logger.debug('User has no lists.')
+            else:
+                phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['delete list'][0]
+
+                bot.send_message(message.from_user.id, phrases, reply_markup=markup)
+
+                logger.debug('Success.')
+
+
+# lines of tasks from different lists, rows - (task, deadline, status, importance, task id, list id, list name)
+def render_tasks_of_lists(rows):
+    return [f'{line}\n📋 _{functions.escape_italic(row[6])}_'
+            for line, row in zip(functions.render_task_lines(rows), rows)]
+
+
+# buttons that open the lists of the tasks
+def lists_of_tasks_markup(rows):
+    markup = types.InlineKeyboardMarkup()
+    for sheet_id, sheet_name in dict.fromkeys((row[5], row[6]) for row in rows):
+        markup.add(types.InlineKeyboardButton(text='📋 ' + sheet_name, callback_data=router.encode('gl', sheet_id)))
+
+    return markup
+
+
+# returns a text and a keyboard of one page of the search results (see search.py)
+def render_search(context, query, offset=0):
+    phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['search']
+    rows, has_next = search.get_page(context.cursor, context.id, query, offset)
+
+    # the page became empty (tasks were deleted), showing the first one
+    if not rows and offset:
+        offset = 0
+        rows, has_next = search.get_page(context.cursor, context.id, query)
+
+    if not rows:
+        return phrases[1].format(query=query), None
+
+    header = phrases[2].format(query=query) + '\n\n'
+    lines = render_tasks_of_lists(rows)
+
+    # cutting the page if it doesn`t fit into one message
+    count = functions.fit_lines(lines, functions.MESSAGE_LIMIT - functions.message_length(header))
+    if count < len(lines):
+        rows, lines, has_next = rows[:count], lines[:count], True
+
+    markup = lists_of_tasks_markup(rows)
+
+    navigation = functions.page_buttons(offset > 0, has_next,
+                                        router.encode('sr', max(offset - search.PAGE_SIZE, 0), query),
+                                        router.encode('sr', offset + len(rows), query))
+    if navigation:
+        markup.row(*navigation)
+
+    return header + '\n\n'.join(lines), markup
+
+
+# /search <words> - finds tasks in all lists of the user
+@bot.message_handler(commands=['search'])
+def search_tasks(message):
+    if message.chat.type == 'private':
+        with database.session() as db_cursor:
+            context = user_context.load(db_cursor, message.from_user.id)
+
+            parts = message.text.split(maxsplit=1)
+            query = search.normalize(parts[1]) if len(parts) > 1 else ''
+
+            logger.debug('User with id - %s is searching for "%s".', message.from_user.id, query)
+
+            if not context.registered:
+                bot.send_message(message.from_user.id,
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['lang switch'][3])
+            elif not query:
+                bot.send_message(message.from_user.id,
+                                 functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)['search'][0])
+            else:
+                answer, markup = render_search(context, query)
+                bot.send_message(message.from_user.id, answer, parse_mode='Markdown', reply_markup=markup)
 
-        # user has no lists
-        if not len(lists):
-            bot.send_message(message.from_user.id,
-                             functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)[
-                                 'get lists'][0])
-            logger.info('User has no lists.')
-        else:
-            i = 0
-            phrases = functions.get_lang_profile_chat(db_cursor, message.from_user.id, PREFERRED_LANGUAGE)['delete list'][0]
 
-            # setting a keyboard
-            markup = types.InlineKeyboardMarkup()
-            markup.row_width = 4
+# handling a call from '<' / '>' buttons of the search results
+@callback_router.route('sr', int, str)
+def search_page(call, context, offset, query):
+    if context.registered:
+        answer, markup = render_search(context, query, offset)
+        tracker.edit_text(answer, message_id=call.message.message_id, chat_id=call.from_user.id,
+                          parse_mode='Markdown', reply_markup=markup)
 
-            while i < len(lists):
-                markup.add(types.InlineKeyboardButton(lists[i][2],
-                                                      callback_data=f'deletelist {lists[i][0]}'))
-                i += 1
+    bot.answer_callback_query(call.id)
 
-            bot.send_message(message.from_user.id, phrases, reply_markup=markup)
 
-            logger.info('Success.')
+# /overdue - tasks of all lists that weren`t done before their deadlines (marked by overdue.Sweeper)
+@bot.message_handler(commands=['overdue'])
+def overdue_tasks(message):
+    if message.chat.type != 'private':
+        return
 
-        db_cursor.close()
-        db_connection.close()
+    with database.session() as db_cursor:
+        context = user_context.load(db_cursor, message.from_user.id)
+        phrases = functions.get_lang_profile_chat(context, PREFERRED_LANGUAGE)
+
+        logger.debug('User with id - %s is getting overdue tasks.', message.from_user.id)
+
+        if context.registered:
+            count = overdue.count_overdue_tasks(db_cursor, context.id)
+            rows = overdue.get_overdue_tasks(db_cursor, context.id, functions.TASKS_PAGE_SIZE)
+
+    if not context.registered:
+        bot.send_message(message.from_user.id, phrases['lang switch'][3])
+        return
+    elif not rows:
+        bot.send_message(message.from_user.id, phrases['overdue'][0])
+        return
+
+    header = phrases['overdue'][1].format(count=count)
+    lines = render_tasks_of_lists(rows)
+
+    # the tasks that don`t fit into one message are only counted
+    shown = functions.fit_lines(lines, functions.MESSAGE_LIMIT - functions.message_length(header) - 100)
+    lines = lines[:shown]
+    if shown < count:
+        lines.append(phrases['overdue'][2].format(count=count - shown))
+
+    bot.send_message(message.from_user.id, '\n\n'.join([header, *lines]), parse_mode='Markdown',
+                     reply_markup=lists_of_tasks_markup(rows[:shown]))
+
+
+# "@bot words" in any chat, the chosen task is sent to the chat, offset - how many results were already shown
+@bot.inline_handler(func=lambda inline_query: True)
+def inline_search(inline_query):
+    query = search.normalize(inline_query.query)
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+
+    rows, has_next = [], False
+
+    with database.session() as db_cursor:
+        context = user_context.load(db_cursor, inline_query.from_user.id)
+
+        if context.registered and query:
+            rows, has_next = search.get_page(db_cursor, context.id, query, offset)
+
+    results = [types.InlineQueryResultArticle(str(row[4]), row[0],
+                                              types.InputTextMessageContent(text, parse_mode='Markdown'),
+                                              description='📋 ' + row[6])
+               for text, row in zip(render_tasks_of_lists(rows), rows)]
+
+    bot.answer_inline_query(inline_query.id, results, cache_time=INLINE_CACHE_TIME, is_personal=True,
+                            next_offset=str(offset + len(rows)) if has_next else '')
+
+
+# all handlers are registered, their names are used by metrics
+metrics.instrument(bot)
+
+
+# sends a deadline reminder (see reminders.py), replies to users go first
+def send_reminder(tele_id, text):
+    with api_client.priority(api_client.LOW):
+        bot.send_message(tele_id, text, parse_mode='Markdown')
+
+
+# handles one update in the calling thread, the order of updates is kept by the caller (see workers.py),
+# all sessions of the handlers go to the shard of the user
+def handle_update(update):
+    bot.threaded = False
+    user_id = workers.get_user_id(update)
+
+    with logs.context(update_id=update.update_id, user_id=user_id), database.use_shard(database.shard_of(user_id)):
+        try:
+            with metrics.update() as trace:
+                TeleBot.process_new_updates(bot, [update])
+        except Exception as e:
+            logger.info('Update %s failed: %r', update.update_id, e, extra={'duration_ms': round(trace.seconds * 1000, 2)})
+            raise
+
+        logger.info('Update is handled by %s.', trace.label(), extra={'duration_ms': round(trace.seconds * 1000, 2)})
 
 
 if __name__ == '__main__':
-    bot.polling()
\ No newline at end of file
+    # requests to the API are rate limited and sent through a pool of kept-alive connections,
+    # lane processes have their own clients (see api_client.install_shared)
+    if LANE_PROCESSES:
+        client = api_client.install_shared(LANES + 1)
+        initializer = functools.partial(api_client.install_shared, LANES + 1)
+    else:
+        client = api_client.install()
+        initializer = None
+
+    executor = workers.ShardedExecutor(handle_update, LANES, processes=LANE_PROCESSES, initializer=initializer)
+    executor.start()
+
+    # handlers, SQL and API requests are measured (see metrics.py), lanes of processes aren`t exported
+    metrics.add_gauges('lanes', executor.metrics)
+    metrics.add_gauges('api', client.metrics)
+    metrics.add_gauges('logs', lambda: logs.stats)
+    metrics.start()
+
+    sweeper = overdue.Sweeper()
+    sweeper.start()
+    reminders.start(send_reminder)
+
+    # small writes of the handlers are committed in batches (see write_behind.py)
+    if write_behind.ENABLED:
+        write_behind.start()
+        metrics.add_gauges('write_behind', write_behind.writer.metrics)
+
+    # polling puts received updates to the lanes and waits when they are full
+    bot.threaded = False
+    bot.process_new_updates = lambda updates: executor.submit(updates, block=True)
+
+    try:
+        bot.polling()
+    finally:
+        reminders.stop()
+        sweeper.stop()
+        executor.stop()
+        write_behind.stop()
+        tracker.flush()
+        metrics.stop()
+        database.close_all()
\ No newline at end of file
@@ -0,0 +1,414 @@
+# counters of the handled updates: wall time per handler and callback route, SQL statements
+# (see database.add_query_hook) and requests to the API made while handling them,
+# exported in Prometheus text format, slow updates can be profiled by sampling their stacks
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import requests
+
+from telebot import apihelper
+
+import database
+
+# the endpoint is only for the local Prometheus, an empty METRICS_PORT disables it
+HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+PORT = os.environ.get('METRICS_PORT', '9464')
+
+# updates that take longer (seconds) are logged with the stacks they spent time in,
+# an empty SLOW_UPDATE disables the profiler
+SLOW_UPDATE = os.environ.get('SLOW_UPDATE', '')
+
+# seconds between samples of the stacks and how many of the most frequent stacks are logged
+SAMPLE_INTERVAL = 0.005
+TOP_STACKS = 5
+
+# upper bounds of the update duration histogram, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger('main.metrics')
+
+_local = threading.local()
+_lock = threading.Lock()
+
+# label -> counters of the updates, statements outside updates are counted as 'background:<thread name>'
+_handlers = collections.defaultdict(lambda: {'updates': 0, 'failed': 0, 'seconds': 0.0, 'buckets': [0] * len(BUCKETS),
+                                             'sql_statements': 0, 'sql_seconds': 0.0})
+# (label, API method) -> [requests, seconds]
+_requests = collections.defaultdict(lambda: [0, 0.0])
+
+# prefix -> function returning a dict, its numbers are exported as gauges
+_gauges = {}
+
+# thread id -> trace of the update the thread is handling (for the profiler)
+_active = {}
+
+# functions called with (label, seconds, trace) after every update that took longer than the threshold
+_slow_hooks = []
+_slow_threshold = None
+
+_server = None
+_profiler = None
+
+
+class UpdateTrace:
+
+    def __init__(self):
+        self.handler = None
+        self.route = None
+        # wall time, known when the update is handled
+        self.seconds = None
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        # API method -> [requests, seconds]
+        self.requests = collections.defaultdict(lambda: [0, 0.0])
+        # folded stack -> samples
+        self.samples = collections.Counter()
+
+    def label(self):
+        if self.handler is None:
+            return 'unhandled'
+        return f'{self.handler}:{self.route}' if self.route else self.handler
+
+
+# wraps the handling of one update
+@contextmanager
+def update():
+    trace = UpdateTrace()
+    _local.trace = trace
+    _active[threading.get_ident()] = trace
+
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield trace
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        seconds = trace.seconds = time.perf_counter() - start
+        _local.trace = None
+        _active.pop(threading.get_ident(), None)
+
+        _record_update(trace, seconds, failed)
+
+
+def _record_update(trace, seconds, failed):
+    label = trace.label()
+
+    with _lock:
+        counters = _handlers[label]
+        counters['updates'] += 1
+        counters['failed'] += failed
+        counters['seconds'] += seconds
+        counters['sql_statements'] += trace.sql_statements
+        counters['sql_seconds'] += trace.sql_seconds
+
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                counters['buckets'][index] += 1
+                break
+
+        for method, (count, spent) in trace.requests.items():
+            total = _requests[(label, method)]
+            total[0] += count
+            total[1] += spent
+
+    if _slow_threshold is not None and seconds > _slow_threshold:
+        for hook in _slow_hooks:
+            hook(label, seconds, trace)
+
+
+def _background_label():
+    return f'background:{threading.current_thread().name}'
+
+
+def _record_query(sql, seconds):
+    trace = getattr(_local, 'trace', None)
+
+    if trace is not None:
+        trace.sql_statements += 1
+        trace.sql_seconds += seconds
+    else:
+        with _lock:
+            counters = _handlers[_background_label()]
+            counters['sql_statements'] += 1
+            counters['sql_seconds'] += seconds
+
+
+def _record_request(method, seconds):
+    trace = getattr(_local, 'trace', None)
+
+    if trace is not None:
+        counters = trace.requests[method]
+        counters[0] += 1
+        counters[1] += seconds
+    else:
+        with _lock:
+            counters = _requests[(_background_label(), method)]
+            counters[0] += 1
+            counters[1] += seconds
+
+
+database.add_query_hook(_record_query)
+
+
+# names the handlers of the bot in the traces, should be called after all handlers are registered
+def instrument(bot):
+    for handlers in (bot.message_handlers, bot.callback_query_handlers, bot.inline_handlers):
+        for handler in handlers:
+            handler['function'] = _named(handler['function'])
+
+
+def _named(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.handler = function.__name__
+
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+# the second part of the label (e.g. the callback route or the step of a dialog), the first name is kept
+def set_route(name):
+    trace = getattr(_local, 'trace', None)
+    if trace is not None and trace.route is None:
+        trace.route = name
+
+
+# router middleware, forwarded old callbacks keep the name of their route
+def route_middleware(route, call, proceed):
+    set_route(route.action)
+    return proceed()
+
+
+# the sender used by telebot when there is no apihelper.CUSTOM_REQUEST_SENDER
+def _send(method, url, params=None, files=None, timeout=None, proxies=None):
+    return requests.request(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+
+
+# measures every request to the API, the time includes waiting for the rate limits of api_client
+class TracingSender:
+
+    def __init__(self, sender):
+        self.sender = sender
+
+    def __call__(self, method, url, params=None, files=None, timeout=None, proxies=None):
+        start = time.perf_counter()
+        try:
+            return self.sender(method, url, params=params, files=files, timeout=timeout, proxies=proxies)
+        finally:
+            _record_request(url.rsplit('/', 1)[-1], time.perf_counter() - start)
+
+
+# wraps the installed sender, should be called after api_client.install()
+def trace_requests():
+    if not isinstance(apihelper.CUSTOM_REQUEST_SENDER, TracingSender):
+        apihelper.CUSTOM_REQUEST_SENDER = TracingSender(apihelper.CUSTOM_REQUEST_SENDER or _send)
+
+
+# numbers of func() are exported as todobot_<prefix>_<key>, e.g. add_gauges('lanes', executor.metrics)
+def add_gauges(prefix, func):
+    _gauges[prefix] = func
+
+
+def add_slow_hook(func):
+    _slow_hooks.append(func)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+# all metrics in Prometheus text format
+def render():
+    with _lock:
+        handlers = {label: dict(counters, buckets=list(counters['buckets'])) for label, counters in _handlers.items()}
+        api = {key: list(counters) for key, counters in _requests.items()}
+
+    lines = []
+
+    def family(name, kind, description):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    updates = {label: counters for label, counters in sorted(handlers.items()) if counters['updates']}
+
+    family('todobot_updates_total', 'counter', 'Updates handled by the handler (callbacks by the route).')
+    for label, counters in updates.items():
+        lines.append(f'todobot_updates_total{_labels(handler=label)} {counters["updates"]}')
+
+    family('todobot_update_failures_total', 'counter', 'Updates that raised an exception.')
+    for label, counters in updates.items():
+        lines.append(f'todobot_update_failures_total{_labels(handler=label)} {counters["failed"]}')
+
+    family('todobot_update_duration_seconds', 'histogram', 'Wall time of handling an update.')
+    for label, counters in updates.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS, counters['buckets']):
+            cumulative += count
+            lines.append(f'todobot_update_duration_seconds_bucket{_labels(handler=label, le=bound)} {cumulative}')
+
+        lines.append(f'todobot_update_duration_seconds_bucket{_labels(handler=label, le="+Inf")} {counters["updates"]}')
+        lines.append(f'todobot_update_duration_seconds_sum{_labels(handler=label)} {counters["seconds"]}')
+        lines.append(f'todobot_update_duration_seconds_count{_labels(handler=label)} {counters["updates"]}')
+
+    family('todobot_sql_statements_total', 'counter', 'SQL statements executed.')
+    for label, counters in sorted(handlers.items()):
+        lines.append(f'todobot_sql_statements_total{_labels(handler=label)} {counters["sql_statements"]}')
+
+    family('todobot_sql_seconds_total', 'counter', 'Time spent executing SQL statements.')
+    for label, counters in sorted(handlers.items()):
+        lines.append(f'todobot_sql_seconds_total{_labels(handler=label)} {counters["sql_seconds"]}')
+
+    family('todobot_api_requests_total', 'counter', 'Requests to the Telegram API.')
+    for (label, method), (count, _) in sorted(api.items()):
+        lines.append(f'todobot_api_requests_total{_labels(handler=label, method=method)} {count}')
+
+    family('todobot_api_seconds_total', 'counter', 'Time spent waiting for the Telegram API.')
+    for (label, method), (_, seconds) in sorted(api.items()):
+        lines.append(f'todobot_api_seconds_total{_labels(handler=label, method=method)} {seconds}')
+
+    for prefix, func in sorted(_gauges.items()):
+        try:
+            values = func()
+        except Exception as e:
+            logger.info('Gauges %s failed: %r', prefix, e)
+            continue
+
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                name = f'todobot_{prefix}_{key}'
+                family(name, 'gauge', f'{key} of {prefix}.')
+                lines.append(f'{name} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(host=HOST, port=PORT):
+    return ThreadingHTTPServer((host, int(port)), MetricsHandler)
+
+
+# samples the stacks of the threads that are handling updates
+class Profiler:
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+
+            for ident, trace in list(_active.items()):
+                frame = frames.get(ident)
+                if frame is not None:
+                    trace.samples[_fold(frame)] += 1
+
+
+# 'module.function;module.function;...' from the outermost frame, like flame graph tools expect
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        module = os.path.splitext(os.path.basename(code.co_filename))[0]
+
+        # a package
+        if module == '__init__':
+            module = os.path.basename(os.path.dirname(code.co_filename))
+
+        names.append(f'{module}.{code.co_name}')
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+def log_slow_update(label, seconds, trace):
+    api_count = sum(count for count, _ in trace.requests.values())
+    api_seconds = sum(spent for _, spent in trace.requests.values())
+
+    lines = [f'Slow update: {label} took {seconds * 1000:.0f} ms, {trace.sql_statements} SQL statements '
+             f'({trace.sql_seconds * 1000:.0f} ms), {api_count} API requests ({api_seconds * 1000:.0f} ms).']
+
+    for stack, samples in trace.samples.most_common(TOP_STACKS):
+        lines.append(f'{samples * SAMPLE_INTERVAL * 1000:>6.0f} ms {stack}')
+
+    logger.info('\n'.join(lines))
+
+
+# traces requests to the API and starts the endpoint and the profiler if they are enabled
+def start():
+    global _server, _profiler, _slow_threshold
+
+    trace_requests()
+
+    if PORT:
+        _server = make_server()
+        threading.Thread(target=_server.serve_forever, name='metrics', daemon=True).start()
+        logger.info('Metrics are served on %s:%s/metrics', HOST, PORT)
+
+    if SLOW_UPDATE:
+        _slow_threshold = float(SLOW_UPDATE)
+        add_slow_hook(log_slow_update)
+
+        _profiler = Profiler()
+        _profiler.start()
+
+
+def stop():
+    global _server, _profiler
+
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+    if _profiler is not None:
+        _profiler.stop()
+        _profiler = None
@@ -0,0 +1,168 @@
+# every migration is applied only once, PRAGMA user_version stores how many of them were applied
+#
+# status - 0 - in process, 1 - completed, 2 - incompleted before deadline
+# importance - 0 - grey, 1 - green, 2 - yellow, 3 - red
+
+# adds search_terms() to the connections, migration 7 uses it (migration 8 replaces its triggers)
+import search
+
+MIGRATIONS = [
+    # 1 - initial schema
+    '''
+CREATE TABLE IF NOT EXISTS Users(
+id INTEGER NOT NULL PRIMARY KEY  AUTOINCREMENT UNIQUE,
+tele_id INTEGER NOT NULL UNIQUE,
+language TEXT,
+last_callback TEXT,
+buffer TEXT
+);
+
+CREATE TABLE IF NOT EXISTS Sheets(
+id INTEGER NOT NULL PRIMARY KEY  AUTOINCREMENT UNIQUE,
+time FLOAT,
+user_id INTEGER NOT NULL,
+name TEXT,
+UNIQUE (user_id, name)
+);
+
+CREATE TABLE IF NOT EXISTS Tasks(
+id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,
+task TEXT,
+deadline FLOAT,
+status INTEGER,
+importance INTEGER,
+user_id INTEGER,
+sheet_id INTEGER NOT NULL,
+UNIQUE(task, sheet_id)
+);
+''',
+
+    # 2 - indexes for the list queries, so they depend on the size of the list and not of the whole table
+    '''
+CREATE INDEX IF NOT EXISTS Tasks_sheet_status_deadline ON Tasks(sheet_id, status, deadline);
+
+CREATE INDEX IF NOT EXISTS Sheets_user_id ON Sheets(user_id, id, name, time);
+''',
+
+    # 3 - tasks are paginated by (status, id)
+    '''
+DROP INDEX IF EXISTS Tasks_sheet_status_deadline;
+
+CREATE INDEX IF NOT EXISTS Tasks_sheet_status_id ON Tasks(sheet_id, status, id);
+''',
+
+    # 4 - dialogs are kept in their own table (user_id - tele_id of the user, data - JSON)
+    '''
+CREATE TABLE IF NOT EXISTS Conversations(
+user_id INTEGER NOT NULL PRIMARY KEY,
+step TEXT NOT NULL,
+data TEXT NOT NULL,
+expires FLOAT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS Conversations_expires ON Conversations(expires);
+
+ALTER TABLE Users DROP COLUMN last_callback;
+
+ALTER TABLE Users DROP COLUMN buffer;
+''',
+
+    # 5 - overdue tasks are marked by the sweeper (see overdue.py)
+    '''
+CREATE INDEX IF NOT EXISTS Tasks_status_deadline ON Tasks(status, deadline);
+''',
+
+    # 6 - deadline reminders are sent once (see reminders.py)
+    '''
+ALTER TABLE Tasks ADD COLUMN reminded INTEGER NOT NULL DEFAULT 0;
+''',
+
+    # 7 - full-text search of tasks (see search.py), the index is kept in sync with Tasks by triggers
+    '''
+CREATE VIRTUAL TABLE IF NOT EXISTS Tasks_search USING fts5(terms, tokenize = 'unicode61 remove_diacritics 2');
+
+CREATE TRIGGER IF NOT EXISTS Tasks_search_insert AFTER INSERT ON Tasks BEGIN
+INSERT INTO Tasks_search(rowid, terms) SELECT new.id, search_terms(user_id, new.task) FROM Sheets
+WHERE id = new.sheet_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Tasks_search_delete AFTER DELETE ON Tasks BEGIN
+DELETE FROM Tasks_search WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Tasks_search_update AFTER UPDATE OF task, sheet_id ON Tasks BEGIN
+DELETE FROM Tasks_search WHERE rowid = old.id;
+INSERT INTO Tasks_search(rowid, terms) SELECT new.id, search_terms(user_id, new.task) FROM Sheets
+WHERE id = new.sheet_id;
+END;
+
+INSERT INTO Tasks_search(rowid, terms)
+SELECT Tasks.id, search_terms(Sheets.user_id, Tasks.task) FROM Tasks JOIN Sheets ON Sheets.id = Tasks.sheet_id;
+''',
+
+    # 8 - the triggers of migration 7 are replaced by ones that don`t call search_terms(), so every program that
+    # writes Tasks (not only the bot) keeps the index in sync. The words of the task are made by the same tokenizer:
+    # the task is put to the empty Tasks_words for a moment and its words are read back from Tasks_words_instance.
+    # The index is refilled by these triggers.
+    '''
+CREATE VIRTUAL TABLE IF NOT EXISTS Tasks_words USING fts5(task, content = '', tokenize = 'unicode61 remove_diacritics 2');
+
+CREATE VIRTUAL TABLE IF NOT EXISTS Tasks_words_instance USING fts5vocab(Tasks_words, instance);
+
+DROP TRIGGER IF EXISTS Tasks_search_insert;
+
+DROP TRIGGER IF EXISTS Tasks_search_update;
+
+CREATE TRIGGER Tasks_search_insert AFTER INSERT ON Tasks BEGIN
+INSERT INTO Tasks_words(rowid, task) VALUES(new.id, new.task);
+INSERT INTO Tasks_search(rowid, terms) SELECT new.id, (SELECT group_concat(Sheets.user_id || 'x' || term, ' ')
+FROM Tasks_words_instance WHERE doc = new.id) FROM Sheets WHERE Sheets.id = new.sheet_id;
+INSERT INTO Tasks_words(Tasks_words, rowid, task) VALUES('delete', new.id, new.task);
+END;
+
+CREATE TRIGGER Tasks_search_update AFTER UPDATE OF task, sheet_id ON Tasks BEGIN
+DELETE FROM Tasks_search WHERE rowid = old.id;
+INSERT INTO Tasks_words(rowid, task) VALUES(new.id, new.task);
+INSERT INTO Tasks_search(rowid, terms) SELECT new.id, (SELECT group_concat(Sheets.user_id || 'x' || term, ' ')
+FROM Tasks_words_instance WHERE doc = new.id) FROM Sheets WHERE Sheets.id = new.sheet_id;
+INSERT INTO Tasks_words(Tasks_words, rowid, task) VALUES('delete', new.id, new.task);
+END;
+
+DELETE FROM Tasks_search;
+
+UPDATE Tasks SET task = task;
+''',
+]
+
+
+# ids of every shard (see database.SHARDS) start at shard * SHARD_IDS, so ids of users, lists and tasks are
+# unique across the shards, caches and callback data keep using them alone
+SHARD_IDS = 1 << 40
+
+SEQUENCE_TABLES = ('Users', 'Sheets', 'Tasks')
+
+
+# next ids of the shard are bigger than shard * SHARD_IDS and than minimum (e.g. ids copied from another file)
+def reserve_ids(cursor, shard, minimum=0):
+    first = max(shard * SHARD_IDS, minimum)
+
+    for table in SEQUENCE_TABLES:
+        cursor.execute('UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?', (first, table, first))
+        cursor.execute('INSERT INTO sqlite_sequence(name, seq) SELECT ?, ? '
+                       'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)', (table, first, table))
+
+
+def get_version(cursor):
+    cursor.execute('PRAGMA user_version')
+    return cursor.fetchone()[0]
+
+
+# applies all new migrations, returns the version of the schema
+def migrate(cursor):
+    version = get_version(cursor)
+
+    for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+        # the migration and the new version are committed together
+        cursor.executescript(f'BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;')
+
+    return len(MIGRATIONS)
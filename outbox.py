@@ -0,0 +1,58 @@
+# requests to the API made by a handler while its session has an uncommitted write are sent after the commit:
+# a message can wait for the rate limit of its chat (see api_client.py) and other writers shouldn`t wait
+# for the database meanwhile, requests of a session that is rolled back aren`t sent
+import database
+import functools
+import threading
+
+# requests of the current thread waiting for the commit: [(function, args, kwargs)]
+_pending = threading.local()
+
+
+def _requests():
+    if not hasattr(_pending, 'requests'):
+        _pending.requests = []
+    return _pending.requests
+
+
+# calls of the returned function wait for the commit if there is a write (they return None then),
+# and if earlier calls wait, so the order of the messages is kept
+def deferred(function):
+    @functools.wraps(function)
+    def call(*args, **kwargs):
+        requests = _requests()
+
+        if requests or database.in_transaction():
+            requests.append((function, args, kwargs))
+            return None
+
+        return function(*args, **kwargs)
+
+    return call
+
+
+# replaces the methods of target (e.g. the bot) with deferred ones
+def install(target, names):
+    for name in names:
+        setattr(target, name, deferred(getattr(target, name)))
+
+
+def _on_commit():
+    requests = _requests()
+    if not requests:
+        return
+
+    # cleared first, the requests are sent once even if one of them fails
+    waiting = list(requests)
+    requests.clear()
+
+    for function, args, kwargs in waiting:
+        function(*args, **kwargs)
+
+
+def _on_rollback():
+    _requests().clear()
+
+
+database.add_commit_hook(_on_commit)
+database.add_rollback_hook(_on_rollback)
@@ -0,0 +1,93 @@
+# tasks that are in process after their deadline get status 2 (see migrations.py),
+# the sweeper finds them by the Tasks(status, deadline) index
+import database
+import logging
+import render_cache
+import threading
+import time
+
+# seconds between sweeps
+SWEEP_INTERVAL = 60
+
+# tasks updated in one transaction, so the database isn`t locked for long
+BATCH_SIZE = 500
+
+logger = logging.getLogger('main.overdue')
+
+SWEEP_SQL = ('UPDATE Tasks SET status = 2 WHERE id IN '
+             '(SELECT id FROM Tasks WHERE status = 0 AND deadline < ? LIMIT ?) RETURNING sheet_id')
+
+# CROSS JOIN keeps the order of tables: lists of the user first, then their overdue tasks by Tasks_sheet_status_id
+OVERDUE_SQL = ('SELECT Tasks.task, Tasks.deadline, Tasks.status, Tasks.importance, Tasks.id, Sheets.id, Sheets.name '
+               'FROM Sheets CROSS JOIN Tasks ON Tasks.sheet_id = Sheets.id AND Tasks.status = 2 WHERE Sheets.user_id = ? '
+               'LIMIT ?')
+
+OVERDUE_COUNT_SQL = ('SELECT COUNT(*) FROM Sheets CROSS JOIN Tasks ON Tasks.sheet_id = Sheets.id AND Tasks.status = 2 '
+                     'WHERE Sheets.user_id = ?')
+
+
+# marks every overdue task of the shard (the current one by default), returns how many tasks were marked
+def sweep(now=None, batch_size=BATCH_SIZE, shard=None):
+    now = time.time() if now is None else now
+    total = 0
+
+    while True:
+        with database.session(shard) as cursor:
+            cursor.execute(SWEEP_SQL, (now, batch_size))
+            rows = cursor.fetchall()
+
+            # order of the tasks in these lists has changed
+            for sheet_id in {row[0] for row in rows}:
+                render_cache.invalidate(sheet_id)
+
+        marked = len(rows)
+        total += marked
+        if marked < batch_size:
+            return total
+
+
+# user_id - id of the user in the database, tasks are ordered by list, at most limit of them (all if it`s -1)
+def get_overdue_tasks(cursor, user_id, limit=-1):
+    cursor.execute(OVERDUE_SQL, (user_id, limit))
+    return cursor.fetchall()
+
+
+def count_overdue_tasks(cursor, user_id):
+    cursor.execute(OVERDUE_COUNT_SQL, (user_id,))
+    return cursor.fetchone()[0]
+
+
+# runs sweep() every interval seconds in background threads, one for every shard
+class Sweeper:
+
+    def __init__(self, interval=SWEEP_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for shard in range(database.SHARDS):
+            thread = threading.Thread(target=self._run, args=(shard,), name=f'overdue-sweeper-{shard}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _run(self, shard):
+        while True:
+            try:
+                marked = sweep(shard=shard)
+                if marked:
+                    logger.info('%s tasks of shard %s are overdue now.', marked, shard)
+            except Exception as e:
+                logger.info('Sweep of shard %s failed: %r', shard, e)
+
+            if self._stop.wait(self.interval):
+                break
+
+        database.close()
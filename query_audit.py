@@ -0,0 +1,74 @@
+import ast
+import os
+import re
+import sqlite3
+import sys
+
+import database
+import migrations
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# plan details that mean the query depends on the size of the whole table
+BAD_PLANS = ('SCAN ', 'USE TEMP B-TREE')
+
+# scans that don`t depend on the data: a SELECT without a table, sqlite_sequence has a row per table
+SMALL_SCANS = ('SCAN CONSTANT ROW', 'SCAN sqlite_sequence')
+
+# virtual tables (full-text search, json_each of a parameter) are always "scanned", the plan the table
+# has chosen is shown as "VIRTUAL TABLE INDEX 32:M2", "INDEX 0:" means no constraint is used
+VIRTUAL_INDEX = re.compile(r'VIRTUAL TABLE INDEX (?!0:$)')
+
+# offline tools that read whole tables on purpose
+SKIPPED = ('rebalance.py',)
+
+SQL = re.compile(r'\s*(SELECT\s.+\sFROM\s|INSERT\s+INTO\s|UPDATE\s+\w+\s+SET\s|DELETE\s+FROM\s|REPLACE\s+INTO\s)', re.S)
+
+
+# finds every constant SQL statement in the bot`s modules (passed to execute() or kept in a constant)
+def collect_queries(base_dir=BASE_DIR):
+    queries = []
+
+    for filename in sorted(os.listdir(base_dir)):
+        if not filename.endswith('.py') or filename in SKIPPED:
+            continue
+
+        with open(os.path.join(base_dir, filename), encoding='utf-8') as file:
+            tree = ast.parse(file.read(), filename)
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL.match(node.value):
+                queries.append((f'{filename}:{node.lineno}', node.value))
+
+    return queries
+
+
+# returns a list of (place, query, plan detail) for every query that scans a table
+def audit(queries):
+    connection = sqlite3.connect(':memory:')
+    database.create_functions(connection)
+    cursor = connection.cursor()
+    migrations.migrate(cursor)
+
+    problems = []
+    for place, query in queries:
+        cursor.execute('EXPLAIN QUERY PLAN ' + query, (None,) * query.count('?'))
+
+        for row in cursor.fetchall():
+            detail = row[-1]
+            if detail.startswith(BAD_PLANS) and not detail.startswith(SMALL_SCANS) and not VIRTUAL_INDEX.search(detail):
+                problems.append((place, query, detail))
+
+    connection.close()
+    return problems
+
+
+if __name__ == '__main__':
+    collected = collect_queries()
+    found = audit(collected)
+
+    for place, sql, plan in found:
+        print(f'{place}: {plan}\n    {sql}')
+
+    print(f'{len(collected)} queries checked, {len(found)} problems found.')
+    sys.exit(1 if found else 0)
@@ -0,0 +1,129 @@
+# moves the users of one database file to shards (see database.shard_of()), should be run while the bot is stopped:
+# python rebalance.py planner_bot_DB.sqlite 4
+# then the bot is started with BOT_DB_SHARDS=4, the shards are new files next to the source (planner_bot_DB.0.sqlite,
+# planner_bot_DB.1.sqlite ...), ids are kept, so the buttons of the sent messages keep working, the source is only
+# migrated to the current schema (like the bot does at start)
+import argparse
+import os
+import sys
+import time
+
+import database
+import migrations
+
+# rows of every user are copied by one statement for every table, the full-text index is filled by the triggers,
+# lists and tasks without an owner aren`t copied
+COPY_SQL = (
+    'INSERT INTO Users(id, tele_id, language) SELECT id, tele_id, language FROM source.Users '
+    'WHERE shard_of(tele_id, ?) = ?',
+
+    'INSERT INTO Conversations(user_id, step, data, expires) SELECT user_id, step, data, expires '
+    'FROM source.Conversations WHERE shard_of(user_id, ?) = ?',
+
+    'INSERT INTO Sheets(id, time, user_id, name) SELECT s.id, s.time, s.user_id, s.name '
+    'FROM source.Sheets AS s JOIN source.Users AS u ON u.id = s.user_id WHERE shard_of(u.tele_id, ?) = ?',
+
+    'INSERT INTO Tasks(id, task, deadline, status, importance, user_id, sheet_id, reminded) '
+    'SELECT t.id, t.task, t.deadline, t.status, t.importance, t.user_id, t.sheet_id, t.reminded '
+    'FROM source.Tasks AS t JOIN source.Sheets AS s ON s.id = t.sheet_id JOIN source.Users AS u ON u.id = s.user_id '
+    'WHERE shard_of(u.tele_id, ?) = ?',
+)
+
+TABLES = ('Users', 'Conversations', 'Sheets', 'Tasks', 'Tasks_search')
+
+# ids of the source that are kept by the shards
+MAX_ID_SQL = ('SELECT MAX((SELECT IFNULL(MAX(id), 0) FROM Users), (SELECT IFNULL(MAX(id), 0) FROM Sheets), '
+              '(SELECT IFNULL(MAX(id), 0) FROM Tasks))')
+
+
+def count(cursor):
+    counts = {}
+
+    for table in TABLES:
+        cursor.execute(f'SELECT COUNT(*) FROM main.{table}')
+        counts[table] = cursor.fetchone()[0]
+
+    return counts
+
+
+# copies the rows of the users of the shard from the source, returns the numbers of rows of the shard
+def fill_shard(source, shard, shards, max_id):
+    with database.session(shard) as cursor:
+        migrations.migrate(cursor)
+
+    connection = database.get_connection(shard)
+    connection.execute('ATTACH DATABASE ? AS source', (source,))
+
+    try:
+        with database.session(shard) as cursor:
+            for sql in COPY_SQL:
+                cursor.execute(sql, (shards, shard))
+
+            # new ids of the shard are bigger than the copied ones of every shard
+            migrations.reserve_ids(cursor, shard, max_id)
+
+            return count(cursor)
+    finally:
+        connection.execute('DETACH DATABASE source')
+
+
+def rebalance(source, shards):
+    database.configure(source)
+    database.add_function('shard_of', 2, database.shard_of)
+
+    try:
+        with database.session() as cursor:
+            migrations.migrate(cursor)
+            expected = count(cursor)
+
+            cursor.execute(MAX_ID_SQL)
+            max_id = cursor.fetchone()[0]
+    finally:
+        database.close_all()
+
+    if max_id >= migrations.SHARD_IDS:
+        raise ValueError(f'{source} has ids of shards, only one file can be split')
+
+    database.configure(source, shards)
+    names = [database.shard_name(shard) for shard in range(shards)]
+    existing = [name for name in names if os.path.exists(name)]
+    if existing:
+        raise ValueError(f'{", ".join(existing)} already exist')
+
+    try:
+        results = [fill_shard(source, shard, shards, max_id) for shard in range(shards)]
+    finally:
+        database.close_all()
+
+    return names, expected, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Splits the database of the bot into shards.')
+    parser.add_argument('source', help='the database file, e.g. planner_bot_DB.sqlite')
+    parser.add_argument('shards', type=int, help='number of shards (BOT_DB_SHARDS of the bot)')
+    arguments = parser.parse_args()
+
+    if arguments.shards < 2:
+        parser.error('at least 2 shards are needed')
+
+    start = time.perf_counter()
+    try:
+        shard_names, source_counts, shard_counts = rebalance(arguments.source, arguments.shards)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    print(f'{"file":>30} ' + ' '.join(f'{table:>13}' for table in TABLES))
+    print(f'{arguments.source:>30} ' + ' '.join(f'{source_counts[table]:>13}' for table in TABLES))
+    for name, counts in zip(shard_names, shard_counts):
+        print(f'{name:>30} ' + ' '.join(f'{counts[table]:>13}' for table in TABLES))
+
+    # rows without an owner are the only difference
+    missing = {table: source_counts[table] - sum(counts[table] for counts in shard_counts) for table in TABLES}
+    print(f'\n{time.perf_counter() - start:.1f} s, rows that weren`t copied: {missing}')
+
+    indexed = all(counts['Tasks_search'] == counts['Tasks'] for counts in shard_counts)
+    if not indexed:
+        print('the full-text index of a shard doesn`t match its tasks')
+    sys.exit(0 if indexed else 1)
@@ -0,0 +1,361 @@
+# sends a reminder on the last day of every task in process,
+# upcoming reminders are kept in a min-heap which is refilled page by page from the Tasks(status, deadline) index
+import database
+import functions
+import heapq
+import localization
+import logging
+import threading
+import time
+
+# seconds before the deadline (deadlines are midnights after the last day, so it`s 9:00 of the last day)
+REMIND_BEFORE = 15 * 3600
+
+# reminders sent per second (Telegram allows about 30 messages per second to different chats)
+RATE = 20
+
+# reminders loaded by one refill, the heap is refilled when it has less than LOW_WATER reminders
+PAGE_SIZE = 1000
+LOW_WATER = 100
+
+# the longest sleep between checks, seconds
+MAX_WAIT = 60
+
+# a reminder that couldn`t be sent is tried again after RETRY_DELAY seconds, MAX_ATTEMPTS times in total
+RETRY_DELAY = 60
+MAX_ATTEMPTS = 3
+
+# seconds before a reminder is checked again when the deadline of the task in the database isn`t the scheduled
+# one: the handler that has changed it may not have committed yet (see write_behind.py)
+RECHECK_DELAY = 1
+
+# language of the users who haven`t chosen it
+DEFAULT_LANGUAGE = 'UA'
+
+logger = logging.getLogger('main.reminders')
+
+PAGE_SQL = ('SELECT deadline, id FROM Tasks WHERE status = 0 AND reminded = 0 AND (deadline, id) > (?, ?) '
+            'ORDER BY deadline, id LIMIT ?')
+
+TASK_SQL = ('SELECT Tasks.task, Tasks.deadline, Sheets.name, Users.tele_id, Users.language '
+            'FROM Tasks JOIN Sheets ON Sheets.id = Tasks.sheet_id JOIN Users ON Users.id = Sheets.user_id '
+            'WHERE Tasks.id = ? AND Tasks.status = 0 AND Tasks.reminded = 0')
+
+MARK_SQL = 'UPDATE Tasks SET reminded = 1 WHERE id = ?'
+
+# schedulers of the running bot, one for every shard (see start())
+schedulers = []
+
+
+class Scheduler:
+
+    # send(tele_id, text) sends a message, clock() returns the current time, reminders of the tasks of the shard
+    # are sent (see database.SHARDS)
+    def __init__(self, send, clock=time.time, rate=RATE, shard=0):
+        self.send = send
+        self.clock = clock
+        self.rate = rate
+        self.shard = shard
+
+        # (remind time, task id, deadline), contains every pending reminder up to self._key
+        self._heap = []
+        # task id -> deadline, heap entries that don`t match it are outdated
+        self._scheduled = {}
+        # (deadline, id) of the last loaded task
+        self._key = None
+        # bumped by reload(), a page loaded before it is dropped
+        self._generation = 0
+        # task id -> deadline (None if closed) of the changes made while a page is loaded, None if it isn`t
+        self._changes = None
+
+        # task id -> failed attempts to send the reminder
+        self._attempts = {}
+        # task id -> scheduled deadline that didn`t match the database once (see _recheck())
+        self._rechecked = {}
+
+        self._tokens = rate
+        self._refilled_at = clock()
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        self.stats = {'loaded': 0, 'refills': 0, 'sent': 0, 'outdated': 0, 'failed': 0}
+
+    # should be called when a task is added or its deadline is changed
+    def task_changed(self, task_id, deadline):
+        with self._lock:
+            self._schedule(task_id, deadline)
+
+            if self._changes is not None:
+                self._changes[task_id] = deadline
+
+        self._wakeup.set()
+
+    # should be called when a task is done or deleted
+    def task_closed(self, task_id):
+        with self._lock:
+            self._scheduled.pop(task_id, None)
+
+            if self._changes is not None:
+                self._changes[task_id] = None
+
+    # should be called when many tasks are added at once (e.g. imported), the loaded reminders are
+    # forgotten and loaded again from the index
+    def reload(self):
+        with self._lock:
+            self._heap = []
+            self._scheduled = {}
+            self._key = None
+            self._generation += 1
+
+        self._wakeup.set()
+
+    # sends reminders that are due (as many as the rate allows), returns how many of them were sent
+    def tick(self):
+        now = self.clock()
+        self._load(now)
+
+        with self._lock:
+            # at least one reminder, the rate of a shard can be less than one per second
+            self._tokens = min(max(self.rate, 1), self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < int(self._tokens):
+                remind_at, task_id, deadline = heapq.heappop(self._heap)
+
+                # the deadline was changed or the task was closed
+                if self._scheduled.get(task_id) != deadline:
+                    continue
+
+                del self._scheduled[task_id]
+                due.append((task_id, deadline))
+
+            self._tokens -= len(due)
+
+        return self._deliver(due) if due else 0
+
+    # seconds until the next reminder (or until the rate allows to send it)
+    def next_wait(self):
+        with self._lock:
+            if not self._heap:
+                return MAX_WAIT
+
+            wait = self._heap[0][0] - self.clock()
+            if self._tokens < 1:
+                wait = max(wait, (1 - self._tokens) / self.rate)
+
+            return min(max(wait, 0), MAX_WAIT)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f'reminders-{self.shard}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                logger.info('Reminders failed: %r', e)
+
+            self._wakeup.wait(self.next_wait())
+            self._wakeup.clear()
+
+        database.close()
+
+    # the body of task_changed(), called with the lock
+    def _schedule(self, task_id, deadline):
+        remind_at = deadline - REMIND_BEFORE
+        self._attempts.pop(task_id, None)
+        self._rechecked.pop(task_id, None)
+
+        # beyond the loaded part of the index, it`s going to be loaded by refill
+        if self._key is None or (deadline, task_id) > self._key:
+            self._scheduled.pop(task_id, None)
+
+        # the task is already on its last day, the user has just seen the deadline
+        elif remind_at <= self.clock():
+            self._scheduled.pop(task_id, None)
+
+        else:
+            self._scheduled[task_id] = deadline
+            heapq.heappush(self._heap, (remind_at, task_id, deadline))
+
+    # loads the next page of pending reminders if the heap is running low, the query is made without the lock,
+    # so handlers calling task_changed() don`t wait for it
+    def _load(self, now):
+        with self._lock:
+            if len(self._heap) >= LOW_WATER:
+                return
+
+            key = self._key or (now, 0)
+            generation = self._generation
+            self._changes = {}
+
+        try:
+            with database.session(self.shard) as cursor:
+                cursor.execute(PAGE_SQL, (*key, PAGE_SIZE))
+                rows = cursor.fetchall()
+        except Exception:
+            with self._lock:
+                self._changes = None
+            raise
+
+        with self._lock:
+            changes, self._changes = self._changes, None
+
+            # the loaded reminders were forgotten meanwhile, the page is loaded again by the next tick
+            if generation != self._generation:
+                return
+
+            for deadline, task_id in rows:
+                self._scheduled[task_id] = deadline
+                heapq.heappush(self._heap, (deadline - REMIND_BEFORE, task_id, deadline))
+
+            if rows:
+                self._key = rows[-1]
+            elif self._key is None:
+                self._key = key
+
+            # the query may have missed the changes that weren`t committed yet, they are applied to the new page
+            for task_id, deadline in changes.items():
+                if deadline is None:
+                    self._scheduled.pop(task_id, None)
+                else:
+                    self._schedule(task_id, deadline)
+
+            self.stats['loaded'] += len(rows)
+            self.stats['refills'] += 1
+
+    def _deliver(self, due):
+        messages = []
+
+        with database.session(self.shard) as cursor:
+            for task_id, deadline in due:
+                cursor.execute(TASK_SQL, (task_id,))
+                row = cursor.fetchone()
+
+                # the task was closed or changed after it was scheduled
+                if row is None or row[1] != deadline:
+                    self.stats['outdated'] += 1
+                    if row is not None:
+                        self._recheck(task_id, deadline, row[1])
+                    continue
+
+                name, deadline, sheet_name, tele_id, language = row
+                text = localization.get_profile(language or DEFAULT_LANGUAGE)['reminder'].format(
+                    task=functions.escape_bold(name), list=functions.escape_bold(sheet_name))
+                messages.append((task_id, deadline, tele_id, text))
+
+        with self._lock:
+            for task_id, *_ in messages:
+                self._rechecked.pop(task_id, None)
+
+        # messages are sent after the session, it doesn`t wait for the API
+        marked = []
+        sent = 0
+        for task_id, deadline, tele_id, text in messages:
+            try:
+                self.send(tele_id, text)
+                marked.append((task_id,))
+                sent += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.warning('Reminder about task %s failed: %r', task_id, e)
+
+                if not self._retry(task_id, deadline):
+                    marked.append((task_id,))
+
+        # reminders are sent only once, even if the bot is restarted
+        if marked:
+            with database.session(self.shard) as cursor:
+                cursor.executemany(MARK_SQL, marked)
+
+        with self._lock:
+            for task_id, in marked:
+                self._attempts.pop(task_id, None)
+
+        self.stats['sent'] += sent
+        return sent
+
+    # the deadline of the task in the database isn`t the scheduled one: the scheduled deadline is checked once
+    # more after RECHECK_DELAY, a handler may not have committed it yet, then the one from the database is used
+    def _recheck(self, task_id, scheduled, deadline):
+        with self._lock:
+            # a handler has changed the task after the reminder was taken
+            if task_id in self._scheduled:
+                return
+
+            if self._rechecked.pop(task_id, None) == scheduled:
+                self._schedule(task_id, deadline)
+            else:
+                self._rechecked[task_id] = scheduled
+                self._scheduled[task_id] = scheduled
+                heapq.heappush(self._heap, (self.clock() + RECHECK_DELAY, task_id, scheduled))
+
+    # schedules the failed reminder again, returns False when there are no attempts left
+    def _retry(self, task_id, deadline):
+        with self._lock:
+            attempts = self._attempts.pop(task_id, 0) + 1
+            if attempts >= MAX_ATTEMPTS:
+                return False
+
+            # a handler has changed the task after the reminder was taken
+            if task_id not in self._scheduled:
+                self._attempts[task_id] = attempts
+                self._scheduled[task_id] = deadline
+                heapq.heappush(self._heap, (self.clock() + RETRY_DELAY, task_id, deadline))
+
+            return True
+
+
+# shards are served in parallel, the rate is shared by them
+def start(send):
+    global schedulers
+
+    schedulers = [Scheduler(send, rate=RATE / database.SHARDS, shard=shard) for shard in range(database.SHARDS)]
+    for scheduler in schedulers:
+        scheduler.start()
+
+
+def stop():
+    global schedulers
+
+    for scheduler in schedulers:
+        scheduler.stop()
+    schedulers = []
+
+
+# the scheduler of the shard the handler works with, None if the schedulers aren`t running in this process
+def _current():
+    shard = database.current_shard()
+    return schedulers[shard] if shard < len(schedulers) else None
+
+
+# called by the handlers
+def task_changed(task_id, deadline):
+    scheduler = _current()
+    if scheduler is not None:
+        scheduler.task_changed(task_id, deadline)
+
+
+def task_closed(task_id):
+    scheduler = _current()
+    if scheduler is not None:
+        scheduler.task_closed(task_id)
+
+
+def reload():
+    scheduler = _current()
+    if scheduler is not None:
+        scheduler.reload()
@@ -0,0 +1,90 @@
+import database
+import threading
+
+from collections import OrderedDict
+from datetime import date
+
+# how many lists are kept in memory, 0 disables the cache
+CACHE_SIZE = 5000
+
+# sheet_id -> {(language, day, page): (text, markup)}
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+# sheet ids changed by the current thread in a not yet committed session
+_pending = threading.local()
+
+
+# rendered list depends on the current day (days left, failed deadlines)
+def day_bucket():
+    return date.today().toordinal()
+
+
+# page - anything hashable that identifies the page of the list (None for the first one)
+def get(sheet_id, language, page=None):
+    with _lock:
+        renders = _cache.get(sheet_id)
+        value = renders.get((language, day_bucket(), page)) if renders else None
+
+        if value is None:
+            stats['misses'] += 1
+        else:
+            _cache.move_to_end(sheet_id)
+            stats['hits'] += 1
+
+        return value
+
+
+def put(sheet_id, language, text, markup, page=None):
+    if not CACHE_SIZE:
+        return
+
+    with _lock:
+        day = day_bucket()
+
+        # renders of the previous days are useless
+        renders = {key: value for key, value in _cache.get(sheet_id, {}).items() if key[1] == day}
+        renders[(language, day, page)] = (text, markup)
+
+        _cache[sheet_id] = renders
+        _cache.move_to_end(sheet_id)
+
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _drop(sheet_id):
+    with _lock:
+        if _cache.pop(sheet_id, None) is not None:
+            stats['invalidations'] += 1
+
+
+# should be called by everything that changes tasks of the list or the list itself,
+# the render is dropped right away and once more after commit, so a render made from
+# not yet committed data by another thread doesn`t stay in the cache
+def invalidate(sheet_id):
+    _drop(sheet_id)
+
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    _pending.ids.add(sheet_id)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _on_session_end():
+    ids = getattr(_pending, 'ids', None)
+
+    if ids:
+        for sheet_id in ids:
+            _drop(sheet_id)
+        ids.clear()
+
+
+database.add_commit_hook(_on_session_end)
+database.add_rollback_hook(_on_session_end)
@@ -0,0 +1,114 @@
+import time
+
+# callback_data of the current format looks like "1:gl:12" - version, short route name and arguments,
+# everything else is treated as an old space separated callback ("getlist Name 0")
+VERSION = '1'
+SEPARATOR = ':'
+
+# Telegram doesn`t accept longer callback_data
+MAX_LENGTH = 64
+
+
+def encode(action, *args):
+    data = SEPARATOR.join([VERSION, action, *map(str, args)])
+
+    if len(data.encode()) > MAX_LENGTH:
+        raise ValueError(f'callback_data is too long - {data}')
+
+    return data
+
+
+# returns (action, list of raw arguments)
+def decode(data):
+    if data.startswith(VERSION + SEPARATOR):
+        parts = data.split(SEPARATOR)[1:]
+    else:
+        parts = data.split()
+
+    if not parts:
+        return None, []
+
+    return parts[0], parts[1:]
+
+
+# argument parsers for routes
+def name(value):
+    # spaces in names are sent as "_"
+    return value.replace('_', ' ')
+
+
+class Route:
+
+    def __init__(self, action, handler, parsers, middlewares):
+        self.action = action
+        self.handler = handler
+        self.parsers = parsers
+        self.middlewares = middlewares
+
+        # how many times the route was called and how long it took in total (seconds)
+        self.calls = 0
+        self.total_time = 0
+
+    def parse(self, args):
+        if len(args) != len(self.parsers):
+            raise ValueError(f'{self.action} expects {len(self.parsers)} arguments, got {len(args)}')
+
+        return [parser(arg) for parser, arg in zip(self.parsers, args)]
+
+
+# maps the action of callback_data to a handler
+class CallbackRouter:
+
+    def __init__(self):
+        self.routes = {}
+        self.middlewares = []
+
+    def route(self, action, *parsers, middlewares=()):
+        def decorator(handler):
+            self.routes[action] = Route(action, handler, parsers, list(middlewares))
+            return handler
+
+        return decorator
+
+    # middleware(route, call, proceed) is called around every handler, proceed() runs the rest of the chain
+    def add_middleware(self, middleware):
+        self.middlewares.append(middleware)
+
+    # returns False if callback_data doesn`t match any route
+    def dispatch(self, call, context):
+        action, args = decode(call.data)
+        route = self.routes.get(action)
+
+        if route is None:
+            return False
+
+        try:
+            args = route.parse(args)
+        except ValueError:
+            return False
+
+        self._run(route, call, context, args)
+        return True
+
+    # runs another route as if its callback was received (used to redirect old callbacks)
+    def forward(self, action, call, context, *args):
+        self._run(self.routes[action], call, context, list(args))
+
+    def _run(self, route, call, context, args):
+        def proceed():
+            return route.handler(call, context, *args)
+
+        # the first middleware is the outermost one
+        for middleware in reversed(self.middlewares + route.middlewares):
+            proceed = self._wrap(middleware, route, call, proceed)
+
+        start = time.perf_counter()
+        try:
+            proceed()
+        finally:
+            route.calls += 1
+            route.total_time += time.perf_counter() - start
+
+    @staticmethod
+    def _wrap(middleware, route, call, proceed):
+        return lambda: middleware(route, call, proceed)
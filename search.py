@@ -0,0 +1,150 @@
+import database
+import re
+import threading
+
+from collections import OrderedDict
+
+# results shown in one message (or returned to one inline query)
+PAGE_SIZE = 10
+
+# the best results that are kept for paging, the rest isn`t shown
+MAX_RESULTS = 100
+
+# the query is sent back in callback_data of the page buttons (see router.MAX_LENGTH), so it`s cut to whole words
+MAX_QUERY_BYTES = 45
+
+# how many users keep their recent results in memory, 0 disables the cache
+CACHE_SIZE = 5000
+
+# recent queries of one user that are kept
+QUERIES_PER_USER = 10
+
+# words are split the same way the unicode61 tokenizer of Tasks_search splits them
+WORD = re.compile(r'[^\W_]+')
+
+# rows - (task, deadline, status, importance, task id, sheet id, sheet name), best first
+SEARCH_QUERY = ('SELECT Tasks.task, Tasks.deadline, Tasks.status, Tasks.importance, Tasks.id, Sheets.id, Sheets.name '
+                'FROM Tasks_search JOIN Tasks ON Tasks.id = Tasks_search.rowid '
+                'JOIN Sheets ON Sheets.id = Tasks.sheet_id '
+                'WHERE Tasks_search MATCH ? AND Sheets.user_id = ? ORDER BY Tasks_search.rank LIMIT ?')
+
+# user_id -> OrderedDict {query: rows}
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+# user ids whose tasks were changed by the current thread in a not yet committed session
+_pending = threading.local()
+
+
+# 'Buy  MILK, today!' -> 'buy milk today', the query the results are kept for
+def normalize(text):
+    words = []
+    length = -1
+
+    for word in WORD.findall(text.lower()):
+        length += len(word.encode()) + 1
+        if length > MAX_QUERY_BYTES:
+            break
+        words.append(word)
+
+    return ' '.join(words)
+
+
+# the words of the task as they are indexed (by the triggers of migration 8, search_terms() in SQL is used only
+# by migration 7): every word is prefixed by the owner of the task (Sheets.user_id), so a query reads only
+# the terms of its user however big the table is, 'Buy milk' of user 42 -> '42xbuy 42xmilk'
+def terms(user_id, text):
+    return ' '.join(f'{user_id}x{word}' for word in WORD.findall(text.lower()))
+
+
+# every word of the query has to be in the task name, the last letters can be missing ('mil' finds 'milk')
+def make_match(user_id, query):
+    return ' '.join(f'"{user_id}x{word}"*' for word in query.split())
+
+
+def _cache_get(user_id, query):
+    with _lock:
+        queries = _cache.get(user_id)
+        rows = queries.get(query) if queries else None
+
+        if rows is None:
+            stats['misses'] += 1
+        else:
+            queries.move_to_end(query)
+            _cache.move_to_end(user_id)
+            stats['hits'] += 1
+
+        return rows
+
+
+def _cache_put(user_id, query, rows):
+    if not CACHE_SIZE:
+        return
+
+    with _lock:
+        queries = _cache.setdefault(user_id, OrderedDict())
+        queries[query] = rows
+        queries.move_to_end(query)
+        _cache.move_to_end(user_id)
+
+        while len(queries) > QUERIES_PER_USER:
+            queries.popitem(last=False)
+
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+# returns up to MAX_RESULTS tasks of the user that match the query (see normalize), best first
+def search(cursor, user_id, query):
+    if not query:
+        return []
+
+    rows = _cache_get(user_id, query)
+    if rows is None:
+        cursor.execute(SEARCH_QUERY, (make_match(user_id, query), user_id, MAX_RESULTS))
+        rows = cursor.fetchall()
+        _cache_put(user_id, query, rows)
+
+    return rows
+
+
+# returns (rows, has_next) of the page that starts at offset
+def get_page(cursor, user_id, query, offset=0, size=PAGE_SIZE):
+    rows = search(cursor, user_id, query)
+    return rows[offset:offset + size], offset + size < len(rows)
+
+
+def _drop(user_id):
+    with _lock:
+        if _cache.pop(user_id, None) is not None:
+            stats['invalidations'] += 1
+
+
+# should be called by everything that changes tasks of the user (see render_cache.invalidate)
+def invalidate(user_id):
+    _drop(user_id)
+
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    _pending.ids.add(user_id)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+def _on_session_end():
+    ids = getattr(_pending, 'ids', None)
+
+    if ids:
+        for user_id in ids:
+            _drop(user_id)
+        ids.clear()
+
+
+database.add_function('search_terms', 2, terms)
+database.add_commit_hook(_on_session_end)
+database.add_rollback_hook(_on_session_end)
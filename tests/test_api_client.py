@@ -0,0 +1,19 @@
+from telebot import apihelper
+
+import api_client
+
+
+def test_shared_client_gets_its_part_of_the_global_limit():
+    sender = apihelper.CUSTOM_REQUEST_SENDER
+
+    try:
+        client = api_client.install_shared(5)
+        assert apihelper.CUSTOM_REQUEST_SENDER is client
+        assert client._global.rate == api_client.GLOBAL_RATE / 5
+        assert client._global.burst == max(1, api_client.GLOBAL_BURST / 5)
+        assert (client.chat_rate, client.chat_burst) == (api_client.CHAT_RATE, api_client.CHAT_BURST)
+
+        # every client keeps at least one token, otherwise it would never send anything
+        assert api_client.install_shared(100)._global.burst == 1
+    finally:
+        apihelper.CUSTOM_REQUEST_SENDER = sender
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+import functions
+
+NOW = datetime(2030, 10, 1)
+DEADLINE = datetime(2030, 10, 23).timestamp()
+
+
+def test_escape_bold():
+    assert functions.escape_bold('snake_case *x* `y` [z]') == 'snake*\\_*case *\\**x*\\** *\\`*y*\\`* *\\[*z]'
+    assert functions.escape_bold('Buy milk') == 'Buy milk'
+
+
+def test_escape_italic():
+    assert functions.escape_italic('a_b*c') == 'a_\\__b_\\*_c'
+
+
+# names are put between * of Markdown messages
+def test_task_names_are_escaped():
+    lines = functions.render_task_lines([('snake_case', DEADLINE, 0, 3), ('Buy milk', DEADLINE, 1, 0)], NOW)
+
+    assert lines == ['🔄🟥*snake*\\_*case*⏱22.10.2030⏱(23 days)', '✅⬜*Buy milk*⏱22.10.2030⏱(23 days)']
@@ -0,0 +1,43 @@
+import pytest
+
+import database
+import migrations
+import outbox
+
+
+@pytest.fixture
+def calls(tmp_path):
+    database.configure(str(tmp_path / 'outbox.sqlite'))
+
+    with database.session() as cursor:
+        migrations.migrate(cursor)
+
+    yield []
+    database.close_all()
+
+
+def test_requests_wait_for_the_commit(calls):
+    send = outbox.deferred(calls.append)
+
+    with database.session() as cursor:
+        send('before the write')
+        cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (42, 'EN'))
+        send('after the write')
+        send('last')
+
+        assert calls == ['before the write']
+
+    assert calls == ['before the write', 'after the write', 'last']
+
+
+def test_requests_of_rolled_back_session_are_dropped(calls):
+    send = outbox.deferred(calls.append)
+
+    with pytest.raises(ZeroDivisionError):
+        with database.session() as cursor:
+            cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (42, 'EN'))
+            send('not sent')
+            1 / 0
+
+    send('sent')
+    assert calls == ['sent']
@@ -0,0 +1,21 @@
+import query_audit
+
+
+def test_queries_are_found():
+    places = [place for place, query in query_audit.collect_queries()]
+
+    assert any(place.startswith('main.py:') for place in places)
+    assert not any(place.startswith(query_audit.SKIPPED) for place in places)
+
+
+# every query of the bot has to use an index (see query_audit.py)
+def test_no_table_scans():
+    problems = query_audit.audit(query_audit.collect_queries())
+
+    assert not problems, '\n'.join(f'{place}: {plan}\n    {sql}' for place, sql, plan in problems)
+
+
+def test_scan_is_reported():
+    problems = query_audit.audit([('test:1', 'SELECT id FROM Tasks WHERE importance = ?')])
+
+    assert [(place, plan) for place, sql, plan in problems] == [('test:1', 'SCAN Tasks')]
@@ -0,0 +1,188 @@
+import pytest
+
+import database
+import migrations
+import reminders
+
+NOW = 1_000_000_000
+DEADLINE = NOW + 2 * 86400
+REMIND_AT = DEADLINE - reminders.REMIND_BEFORE
+
+
+class Clock:
+
+    def __init__(self, now=NOW):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def sheet_id(tmp_path):
+    database.configure(str(tmp_path / 'reminders.sqlite'))
+
+    with database.session() as cursor:
+        migrations.migrate(cursor)
+        cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (42, 'EN'))
+        cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)', (0, cursor.lastrowid, 'Home'))
+        sheet = cursor.lastrowid
+
+    yield sheet
+    database.close_all()
+
+
+def add_task(sheet_id, name='Buy milk', deadline=DEADLINE):
+    with database.session() as cursor:
+        cursor.execute('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, ?, ?, ?, ?)',
+                       (name, deadline, 0, 0, sheet_id))
+        return cursor.lastrowid
+
+
+def set_deadline(task_id, deadline):
+    with database.session() as cursor:
+        cursor.execute('UPDATE Tasks SET deadline = ? WHERE id = ?', (deadline, task_id))
+
+
+def reminded(task_id):
+    with database.session() as cursor:
+        cursor.execute('SELECT reminded FROM Tasks WHERE id = ?', (task_id,))
+        return cursor.fetchone()[0]
+
+
+def make_scheduler(clock, fail=0):
+    sent = []
+
+    def send(tele_id, text):
+        if len(sent) < fail:
+            sent.append(None)
+            raise ConnectionError('API is unavailable')
+        sent.append((tele_id, text))
+
+    return reminders.Scheduler(send, clock=clock), sent
+
+
+def test_reminder_is_sent_once_when_due(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock)
+    task_id = add_task(sheet_id)
+
+    assert scheduler.tick() == 0
+    assert scheduler.next_wait() == reminders.MAX_WAIT
+
+    clock.now = REMIND_AT - 1
+    assert scheduler.tick() == 0
+    assert scheduler.next_wait() == 1
+
+    clock.now = REMIND_AT
+    assert scheduler.tick() == 1
+    assert sent == [(42, '⏰ Today is the last day for *Buy milk* from the list *Home*.')]
+    assert reminded(task_id) == 1
+
+    clock.now += 86400
+    assert scheduler.tick() == 0
+
+
+def test_closed_task_is_not_reminded(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock)
+    task_id = add_task(sheet_id)
+    scheduler.tick()
+
+    scheduler.task_closed(task_id)
+    clock.now = REMIND_AT
+    assert scheduler.tick() == 0
+    assert sent == []
+
+
+def test_changed_deadline_is_rescheduled(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock)
+    task_id = add_task(sheet_id)
+    scheduler.tick()
+
+    set_deadline(task_id, DEADLINE + 86400)
+    scheduler.task_changed(task_id, DEADLINE + 86400)
+
+    clock.now = REMIND_AT
+    assert scheduler.tick() == 0
+
+    clock.now = REMIND_AT + 86400
+    assert scheduler.tick() == 1
+    assert len(sent) == 1
+
+
+# the handler calls task_changed() before its write is committed (e.g. by write_behind.py)
+def test_uncommitted_deadline_is_checked_again(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock)
+    task_id = add_task(sheet_id)
+    scheduler.tick()
+
+    scheduler.task_changed(task_id, DEADLINE - 3600)
+    clock.now = REMIND_AT - 3600
+    assert scheduler.tick() == 0
+
+    set_deadline(task_id, DEADLINE - 3600)
+    clock.now += reminders.RECHECK_DELAY
+    assert scheduler.tick() == 1
+
+    # the old deadline isn`t scheduled again
+    clock.now = REMIND_AT
+    assert scheduler.tick() == 0
+    assert len(sent) == 1
+
+
+def test_deadline_changed_by_another_process_is_used(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock)
+    task_id = add_task(sheet_id)
+    scheduler.tick()
+
+    set_deadline(task_id, DEADLINE + 86400)
+    clock.now = REMIND_AT
+    assert scheduler.tick() == 0
+    clock.now += reminders.RECHECK_DELAY
+    assert scheduler.tick() == 0
+
+    clock.now = REMIND_AT + 86400
+    assert scheduler.tick() == 1
+
+
+def test_failed_reminder_is_retried(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock, fail=1)
+    task_id = add_task(sheet_id)
+
+    clock.now = REMIND_AT
+    assert scheduler.tick() == 0
+    assert reminded(task_id) == 0
+
+    clock.now += reminders.RETRY_DELAY
+    assert scheduler.tick() == 1
+    assert reminded(task_id) == 1
+    assert scheduler.stats['failed'] == 1
+
+
+def test_reminder_is_given_up_after_attempts(sheet_id):
+    clock = Clock()
+    scheduler, sent = make_scheduler(clock, fail=reminders.MAX_ATTEMPTS)
+    task_id = add_task(sheet_id)
+
+    clock.now = REMIND_AT
+    for attempt in range(reminders.MAX_ATTEMPTS):
+        assert scheduler.tick() == 0
+        clock.now += reminders.RETRY_DELAY
+
+    assert reminded(task_id) == 1
+    assert scheduler.tick() == 0
+    assert len(sent) == reminders.MAX_ATTEMPTS
+
+
+def test_markdown_of_names_is_escaped(sheet_id):
+    clock = Clock(REMIND_AT)
+    scheduler, sent = make_scheduler(clock)
+    add_task(sheet_id, 'snake_case *stars*')
+
+    assert scheduler.tick() == 1
+    assert sent[0][1] == '⏰ Today is the last day for *snake*\\_*case *\\**stars*\\*** from the list *Home*.'
@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+import database
+import migrations
+import search
+
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = str(tmp_path / 'search.sqlite')
+    database.configure(filename)
+
+    with database.session() as cursor:
+        migrations.migrate(cursor)
+        cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)', (0, 42, 'Home'))
+        cursor.execute('INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)', (0, 43, 'Home'))
+
+    database.close_all()
+    yield filename
+    search.clear()
+
+
+def find(filename, user_id, query):
+    database.configure(filename)
+
+    try:
+        with database.session() as cursor:
+            return [row[0] for row in search.search(cursor, user_id, search.normalize(query))]
+    finally:
+        database.close_all()
+        search.clear()
+
+
+# the index is kept by the triggers alone, a connection without the functions of the bot can write tasks
+def test_other_writers_are_indexed(filename):
+    connection = sqlite3.connect(filename)
+    with connection:
+        connection.execute('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) '
+                           "VALUES('Buy MILK, bread', 0, 0, 0, 1), ('Café latte', 0, 0, 0, 1), ('milk', 0, 0, 0, 2)")
+    connection.close()
+
+    assert find(filename, 42, 'mil') == ['Buy MILK, bread']
+    assert find(filename, 42, 'bread buy') == ['Buy MILK, bread']
+    assert find(filename, 42, 'cafe') == ['Café latte']
+    assert find(filename, 43, 'milk') == ['milk']
+
+
+def test_renamed_and_moved_tasks(filename):
+    connection = sqlite3.connect(filename)
+    with connection:
+        connection.execute("INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES('milk', 0, 0, 0, 1)")
+        connection.execute("UPDATE Tasks SET task = 'bread' WHERE id = 1")
+    connection.close()
+
+    assert find(filename, 42, 'milk') == []
+    assert find(filename, 42, 'bread') == ['bread']
+
+    connection = sqlite3.connect(filename)
+    with connection:
+        connection.execute('UPDATE Tasks SET sheet_id = 2 WHERE id = 1')
+        assert connection.execute('SELECT COUNT(*) FROM Tasks_words_instance').fetchone() == (0,)
+    connection.close()
+
+    assert find(filename, 42, 'bread') == []
+    assert find(filename, 43, 'bread') == ['bread']
+
+
+# the index made by the triggers has the same words as search.terms()
+def test_terms_match_the_tokenizer(filename):
+    name = 'Call mom_and dad: 10:30, über-important!'
+
+    connection = sqlite3.connect(filename)
+    with connection:
+        connection.execute('INSERT INTO Tasks(task, deadline, status, importance, sheet_id) VALUES(?, 0, 0, 0, 1)',
+                           (name,))
+        indexed = connection.execute('SELECT terms FROM Tasks_search').fetchone()[0]
+    connection.close()
+
+    assert sorted(indexed.split()) == sorted(search.terms(42, name).replace('ü', 'u').split())
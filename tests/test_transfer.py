@@ -0,0 +1,109 @@
+import io
+
+import pytest
+
+import transfer
+
+DEADLINE = transfer.parse_deadline('2030-10-22')
+
+
+def parse(file_format, text):
+    return list(transfer.parse(file_format, io.BytesIO(text.encode())))
+
+
+def ics(*lines):
+    return '\r\n'.join(('BEGIN:VCALENDAR', *lines, 'END:VCALENDAR', ''))
+
+
+def test_ics_values():
+    assert transfer._ics_values('a\\, b,c') == ['a, b', 'c']
+    assert transfer._ics_values('a\\\\,b\\;c\\nd\\Ne') == ['a\\', 'b;c\nd\ne']
+    assert transfer._ics_unescape('a\\,b,c') == 'a,b,c'
+
+
+def test_ics_folded_and_escaped_lines():
+    records = parse('ics', ics('BEGIN:VTODO',
+                               'SUMMARY:Buy milk\\, bre',
+                               ' ad\\; eggs',
+                               '\tand tea',
+                               'CATEGORIES:Home\\, garden,Work',
+                               'DUE;VALUE=DATE:20301022',
+                               'PRIORITY:1',
+                               'STATUS:COMPLETED',
+                               'END:VTODO'))
+
+    assert records == [(2, 'Home, garden', ('Buy milk, bread; eggsand tea', DEADLINE, 1, 3))]
+
+
+def test_ics_round_trip():
+    name = 'Задача, ' * 20 + 'a\\b; c\nd'
+    rows = [(1, 'Home', 1, name, DEADLINE, 0, 2)]
+    text = ''.join(transfer._ics(iter(rows)))
+
+    assert max(len(line.encode()) for line in text.split('\r\n')) <= 75
+    assert [task for line, sheet_name, task in parse('ics', text)] == [(name, DEADLINE, 0, 2)]
+
+
+def test_ics_event_without_category():
+    records = parse('ics', ics('BEGIN:VEVENT', 'SUMMARY:Meeting', 'DTSTART:20301022T090000Z', 'END:VEVENT'))
+
+    assert records == [(2, transfer.DEFAULT_LIST, ('Meeting', DEADLINE, 0, 0))]
+
+
+def test_csv_quoting():
+    text = ('list,task,deadline,status,priority\r\n'
+            'Home,"Buy milk, bread",2030-10-22,0,3\r\n'
+            '"Work ""A""","two\r\nlines",2030-10-22,1,0\r\n'
+            'Empty,,,,\r\n')
+
+    assert parse('csv', text) == [
+        (2, 'Home', ('Buy milk, bread', DEADLINE, 0, 3)),
+        (4, 'Work "A"', ('two\r\nlines', DEADLINE, 1, 0)),
+        (5, 'Empty', None),
+    ]
+
+
+def test_csv_round_trip():
+    rows = [(1, 'Home, "sweet"', 1, 'a,b\n"c"', DEADLINE, 1, 2), (2, 'Empty', None, None, None, None, None)]
+    text = ''.join(transfer._csv(iter(rows)))
+
+    assert [(sheet_name, task) for line, sheet_name, task in parse('csv', text)] == [
+        ('Home, "sweet"', ('a,b\n"c"', DEADLINE, 1, 2)),
+        ('Empty', None),
+    ]
+
+
+@pytest.mark.parametrize('text, line, reason', [
+    ('task,deadline\r\n', 1, 'format'),
+    ('list,task,deadline\r\nHome,Buy milk,22.10.2030\r\n', 2, 'value'),
+    ('list,task,deadline,status\r\nHome,Buy milk,2030-10-22,7\r\n', 2, 'value'),
+    ('list,task,deadline\r\nHome,Buy milk,2030-10-22\r\nHome,' + 'x' * 1001 + ',2030-10-22\r\n', 3, 'name'),
+    # longer than csv.field_size_limit()
+    ('list,task,deadline\r\nHome,Buy milk,2030-10-22\r\nHome,"' + 'x' * 200000 + '",2030-10-22\r\n', 3, 'format'),
+], ids=['header', 'date', 'status', 'name', 'field size'])
+def test_csv_bad_lines(text, line, reason):
+    with pytest.raises(transfer.FormatError) as error:
+        parse('csv', text)
+
+    assert (error.value.line, error.value.reason) == (line, reason)
+
+
+def test_csv_nul_byte():
+    text = 'list,task,deadline\r\nHome,a\0b,2030-10-22\r\n'
+
+    try:
+        records = parse('csv', text)
+    except transfer.FormatError as e:
+        # older versions of the csv module don`t read NUL
+        assert (e.line, e.reason) == (2, 'format')
+    else:
+        assert records == [(2, 'Home', ('a\0b', DEADLINE, 0, 0))]
+
+
+@pytest.mark.parametrize('record', ['{"task": "no list"}', '{"list": ["a"]}', '{"list": null}', '["a"]'],
+                         ids=['no list', 'array', 'null', 'not an object'])
+def test_jsonl_bad_line(record):
+    with pytest.raises(transfer.FormatError) as error:
+        parse('jsonl', f'{{"list": "Home"}}\n\n{record}\n')
+
+    assert (error.value.line, error.value.reason) == (3, 'format')
@@ -0,0 +1,110 @@
+import threading
+import time
+
+from telebot import types
+
+import workers
+
+
+def make_update(update_id, user_id):
+    return types.Update.de_json({
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': 0, 'text': str(update_id),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': user_id, 'is_bot': False, 'first_name': 'user'}},
+    })
+
+
+def test_pool_counts_updates_waiting_for_their_user():
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handle(update):
+        started.set()
+        release.wait(5)
+        handled.append(update.update_id)
+
+    pool = workers.WorkerPool(handle, workers=2, queue_size=10)
+    pool.start()
+
+    try:
+        assert pool.submit([make_update(0, 1)])
+        assert started.wait(5)
+
+        # the other worker parks them, they still take the space of the queue
+        assert all(pool.submit([make_update(update_id, 1)]) for update_id in range(1, 11))
+        deadline = time.monotonic() + 5
+        while pool.metrics()['waiting_for_user'] < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert not pool.submit([make_update(11, 1)])
+        assert not pool.submit([make_update(12, 2)])
+    finally:
+        release.set()
+        pool.stop()
+
+    metrics = pool.metrics()
+    assert handled == list(range(11))
+    assert metrics['rejected'] == 2
+    assert metrics['max_queue_depth'] == 10
+    assert metrics['queue_depth'] == 0 and metrics['waiting_for_user'] == 0
+
+
+def test_lanes_keep_order_of_every_user():
+    handled = {}
+    lock = threading.Lock()
+
+    def handle(update):
+        # gives the other lanes a chance to run in between
+        time.sleep(0.0005)
+        with lock:
+            handled.setdefault(update.message.from_user.id, []).append(update.update_id)
+
+    executor = workers.ShardedExecutor(handle, lanes=4, queue_size=1000)
+    executor.start()
+
+    updates = [make_update(update_id, update_id % 10 + 1) for update_id in range(500)]
+    try:
+        for start in range(0, len(updates), 50):
+            assert executor.submit(updates[start:start + 50], block=True)
+    finally:
+        executor.stop()
+
+    assert handled == {user_id: [update.update_id for update in updates if update.message.from_user.id == user_id]
+                       for user_id in range(1, 11)}
+    assert executor.metrics()['processed'] == 500
+
+
+def test_lane_of_user_is_stable():
+    executor = workers.ShardedExecutor(lambda update: None, lanes=4)
+
+    assert {executor.lane(make_update(update_id, 7)) for update_id in range(20)} == {7 % 4}
+
+
+_initialized = []
+
+
+def initialize():
+    _initialized.append(True)
+
+
+# runs in the lane processes, updates fail there if the initializer wasn`t called
+def handle_initialized(update):
+    if not _initialized:
+        raise RuntimeError('the lane isn`t initialized')
+
+
+def test_lane_processes_are_initialized():
+    executor = workers.ShardedExecutor(handle_initialized, lanes=2, processes=True, initializer=initialize)
+    executor.start()
+
+    try:
+        assert executor.submit([make_update(update_id, user_id) for update_id, user_id in enumerate(range(1, 11))])
+    finally:
+        executor.stop()
+
+    metrics = executor.metrics()
+    assert (metrics['processed'], metrics['failed']) == (10, 0)
+    # lanes of processes don`t call it in the parent
+    assert not _initialized
@@ -0,0 +1,368 @@
+# export and import of all lists of a user: JSON Lines, CSV or an iCalendar file of deadlines (VTODO),
+# rows are read from the cursor and written to the file batch by batch, so memory doesn`t depend on
+# the number of tasks
+import csv
+import io
+import json
+
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import functions
+
+FORMATS = ('jsonl', 'csv', 'ics')
+
+# rows fetched / inserted at once
+BATCH = 1000
+
+# Telegram doesn`t give bots bigger files
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+
+# deadlines are midnights after the last day, files have the last day
+DATE_FORMAT = '%Y-%m-%d'
+
+CSV_FIELDS = ('list', 'task', 'deadline', 'status', 'priority')
+
+# tasks of the list the tasks without a list (e.g. events of a calendar) are imported to
+DEFAULT_LIST = 'Imported'
+
+# priorities of iCalendar - 1 is the highest, 9 is the lowest, 0 is undefined
+ICS_PRIORITY = {0: 0, 1: 9, 2: 5, 3: 1}
+
+# lists without tasks are exported too (Tasks columns are NULL)
+EXPORT_SQL = ('SELECT Sheets.id, Sheets.name, Tasks.id, Tasks.task, Tasks.deadline, Tasks.status, Tasks.importance '
+              'FROM Sheets LEFT JOIN Tasks ON Tasks.sheet_id = Sheets.id WHERE Sheets.user_id = ? '
+              'ORDER BY Sheets.id, Tasks.status, Tasks.id')
+
+SHEETS_SQL = 'SELECT id, name FROM Sheets WHERE user_id = ?'
+
+INSERT_SHEET_SQL = 'INSERT INTO Sheets(time, user_id, name) VALUES(?, ?, ?)'
+
+# a batch of tasks is inserted by one statement (passed as a JSON array of rows), executemany would flush
+# the full-text index (see migration 7) after every task, tasks the list already has are skipped
+INSERT_TASKS_SQL = ("INSERT OR IGNORE INTO Tasks(task, deadline, status, importance, sheet_id) "
+                    "SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]'), "
+                    "json_extract(value, '$[3]'), json_extract(value, '$[4]') FROM json_each(?)")
+
+
+# a line of the imported file is incorrect, nothing is imported
+class FormatError(ValueError):
+
+    def __init__(self, line, reason):
+        super().__init__(f'line {line}: {reason}')
+        self.line = line
+        self.reason = reason
+
+
+def deadline_date(deadline):
+    return datetime.fromtimestamp(deadline) - timedelta(days=1)
+
+
+def parse_deadline(text, date_format=DATE_FORMAT):
+    return datetime.timestamp(datetime.strptime(text, date_format) + timedelta(days=1))
+
+
+# yields rows of EXPORT_SQL fetched in batches
+def _rows(cursor, user_id):
+    cursor.execute(EXPORT_SQL, (user_id,))
+
+    while True:
+        rows = cursor.fetchmany(BATCH)
+        if not rows:
+            break
+        yield from rows
+
+
+def _jsonl(rows):
+    last_sheet = None
+
+    for sheet_id, sheet_name, task_id, name, deadline, status, importance in rows:
+        # every list is written before its tasks, so empty lists are kept too
+        if sheet_id != last_sheet:
+            last_sheet = sheet_id
+            yield json.dumps({'list': sheet_name}, ensure_ascii=False) + '\n'
+
+        if task_id is not None:
+            yield json.dumps({'list': sheet_name, 'task': name, 'deadline': deadline_date(deadline).strftime(DATE_FORMAT),
+                              'status': status, 'priority': importance}, ensure_ascii=False) + '\n'
+
+
+def _csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+
+    for sheet_id, sheet_name, task_id, name, deadline, status, importance in rows:
+        # an empty list is a row without a task
+        if task_id is None:
+            writer.writerow((sheet_name, '', '', '', ''))
+        else:
+            writer.writerow((sheet_name, name, deadline_date(deadline).strftime(DATE_FORMAT), status, importance))
+
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def _ics_text(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+# lines longer than 75 octets are folded, the next line starts with a space
+def _ics_line(line):
+    data = line.encode()
+    if len(data) <= 75:
+        return line + '\r\n'
+
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        # not in the middle of a UTF-8 character
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1
+        parts.append(data[:size].decode())
+        data = data[size:]
+
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _ics(rows):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    yield _ics_line('BEGIN:VCALENDAR')
+    yield _ics_line('VERSION:2.0')
+    yield _ics_line('PRODID:-//TodoBot//EN')
+
+    for sheet_id, sheet_name, task_id, name, deadline, status, importance in rows:
+        # only tasks have deadlines
+        if task_id is None:
+            continue
+
+        yield ''.join(_ics_line(line) for line in (
+            'BEGIN:VTODO',
+            f'UID:task-{task_id}@todobot',
+            f'DTSTAMP:{stamp}',
+            f'SUMMARY:{_ics_text(name)}',
+            f'CATEGORIES:{_ics_text(sheet_name)}',
+            f'DUE;VALUE=DATE:{deadline_date(deadline).strftime("%Y%m%d")}',
+            f'STATUS:{"COMPLETED" if status == 1 else "NEEDS-ACTION"}',
+            f'PRIORITY:{ICS_PRIORITY.get(importance, 0)}',
+            'END:VTODO'))
+
+    yield _ics_line('END:VCALENDAR')
+
+
+SERIALIZERS = {'jsonl': _jsonl, 'csv': _csv, 'ics': _ics}
+
+
+# writes all lists of the user (Sheets.user_id) to the binary file, returns the number of tasks
+def export(cursor, user_id, file_format, file):
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            if row[2] is not None:
+                count += 1
+            yield row
+
+    for chunk in SERIALIZERS[file_format](counted(_rows(cursor, user_id))):
+        file.write(chunk.encode())
+
+    return count
+
+
+def _task(line, sheet_name, name, deadline, status, priority, date_format=DATE_FORMAT):
+    if not isinstance(name, str) or not name or len(name) > functions.MAX_TASK_LENGTH:
+        raise FormatError(line, 'name')
+
+    try:
+        deadline = parse_deadline(deadline, date_format)
+        status = int(status)
+        priority = int(priority)
+    except (TypeError, ValueError):
+        raise FormatError(line, 'value')
+
+    if status not in functions.STATUS_EMOJI or priority not in functions.PRIORITY_EMOJI:
+        raise FormatError(line, 'value')
+
+    return line, sheet_name, (name, deadline, status, priority)
+
+
+# records of the file: (line number, list name, (name, deadline, status, importance) or None for a list)
+def _parse_jsonl(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+            sheet_name = record['list']
+        except (ValueError, KeyError, TypeError):
+            raise FormatError(number, 'format')
+
+        # names of the lists are looked up in a dict, e.g. {"list": ["a"]} isn`t hashable
+        if not isinstance(sheet_name, str):
+            raise FormatError(number, 'format')
+
+        if 'task' in record:
+            yield _task(number, sheet_name, record['task'], record.get('deadline'), record.get('status', 0),
+                        record.get('priority', 0))
+        else:
+            yield number, sheet_name, None
+
+
+def _parse_csv(lines):
+    reader = csv.DictReader(lines)
+
+    try:
+        if reader.fieldnames is None or not set(CSV_FIELDS[:3]) <= set(reader.fieldnames):
+            raise FormatError(1, 'format')
+
+        for record in reader:
+            number = reader.line_num
+
+            if record['task']:
+                yield _task(number, record['list'], record['task'], record['deadline'], record.get('status') or 0,
+                            record.get('priority') or 0)
+            else:
+                yield number, record['list'], None
+    except csv.Error:
+        # e.g. a field is longer than csv.field_size_limit(), DictReader.line_num is updated only after
+        # a record is read, the line of the error is counted by its reader
+        raise FormatError(reader.reader.line_num, 'format')
+
+
+# returns the unescaped values of a list ('a\\, b,c' -> ['a, b', 'c'])
+def _ics_values(text):
+    values = []
+    result = []
+    characters = iter(text)
+
+    for character in characters:
+        if character == '\\':
+            character = next(characters, '')
+            character = '\n' if character and character in 'nN' else character
+        elif character == ',':
+            values.append(''.join(result))
+            result.clear()
+            continue
+        result.append(character)
+
+    values.append(''.join(result))
+    return values
+
+
+def _ics_unescape(text):
+    return ','.join(_ics_values(text))
+
+
+# folded lines are joined, yields (number of the first line, name, parameters, value)
+def _ics_lines(lines):
+    current = None
+    start = 0
+
+    for number, line in enumerate(lines, start=1):
+        line = line.rstrip('\r\n')
+
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+
+        if current:
+            yield (start, *_ics_split(current))
+        current, start = line, number
+
+    if current:
+        yield (start, *_ics_split(current))
+
+
+def _ics_split(line):
+    head, _, value = line.partition(':')
+    name, *parameters = head.split(';')
+    return name.upper(), parameters, value
+
+
+def _ics_task(line, component):
+    # the date of a date-time (20301022T090000Z) is taken
+    due = (component.get('DUE') or component.get('DTSTART') or '')[:8]
+
+    # 1-4 - high, 5 - medium, 6-9 - low
+    priority = component.get('PRIORITY', '0')
+    priority = int(priority) if priority.isdigit() else 0
+    importance = 0 if not priority else 3 if priority < 5 else 2 if priority == 5 else 1
+
+    categories = component.get('CATEGORIES')
+    sheet_name = _ics_values(categories)[0] if categories else DEFAULT_LIST
+
+    status = 1 if component.get('STATUS', '').upper() == 'COMPLETED' else 0
+
+    return _task(line, sheet_name, _ics_unescape(component.get('SUMMARY', '')), due, status, importance, '%Y%m%d')
+
+
+# tasks are VTODO (or VEVENT) components, the first category is the list
+def _parse_ics(lines):
+    component = None
+
+    for number, name, parameters, value in _ics_lines(lines):
+        if name == 'BEGIN' and value.upper() in ('VTODO', 'VEVENT'):
+            component = {'line': number}
+        elif name == 'END' and value.upper() in ('VTODO', 'VEVENT') and component is not None:
+            yield _ics_task(component['line'], component)
+            component = None
+        elif component is not None and name not in component:
+            component[name] = value
+
+
+PARSERS = {'jsonl': _parse_jsonl, 'csv': _parse_csv, 'ics': _parse_ics}
+
+
+def parse(file_format, file):
+    return PARSERS[file_format](io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+
+
+# adds the records (see parse) to the lists of the user (Sheets.user_id), lists are found by name and created
+# if the user doesn`t have them, tasks the list already has are skipped,
+# returns (ids of the changed lists, lists created, tasks added, tasks skipped)
+def load(cursor, user_id, records):
+    cursor.execute(SHEETS_SQL, (user_id,))
+    sheets = {name: sheet_id for sheet_id, name in cursor.fetchall()}
+
+    changed = set()
+    created = added = skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal added, skipped
+        cursor.execute(INSERT_TASKS_SQL, (json.dumps(batch),))
+        added += cursor.rowcount
+        skipped += len(batch) - cursor.rowcount
+        batch.clear()
+
+    for line, sheet_name, task in records:
+        sheet_id = sheets.get(sheet_name)
+
+        if sheet_id is None:
+            # the same rules as for the lists created by the user
+            if not isinstance(sheet_name, str) or not sheet_name or len(sheet_name) > 1000 or '_' in sheet_name:
+                raise FormatError(line, 'list')
+
+            cursor.execute(INSERT_SHEET_SQL, (datetime.now().timestamp(), user_id, sheet_name))
+            sheet_id = sheets[sheet_name] = cursor.lastrowid
+            created += 1
+
+        if task is not None:
+            batch.append((*task, sheet_id))
+            changed.add(sheet_id)
+
+            if len(batch) >= BATCH:
+                flush()
+
+    if batch:
+        flush()
+
+    return changed, created, added, skipped
@@ -0,0 +1,145 @@
+import conversations
+import database
+import threading
+import time
+
+from collections import OrderedDict
+
+# how many users are kept in memory, 0 disables the cache
+# (should be disabled if several processes write to the same DB)
+CACHE_SIZE = 10000
+
+# tele_id -> (id, language, conversation)
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+stats = {'hits': 0, 'misses': 0}
+
+# tele_ids written by the current thread in a not yet committed session
+_pending = threading.local()
+
+
+def _cache_get(tele_id):
+    with _lock:
+        row = _cache.get(tele_id)
+        if row is not None:
+            _cache.move_to_end(tele_id)
+            stats['hits'] += 1
+        else:
+            stats['misses'] += 1
+        return row
+
+
+def _cache_put(tele_id, row):
+    if not CACHE_SIZE:
+        return
+
+    with _lock:
+        _cache[tele_id] = row
+        _cache.move_to_end(tele_id)
+
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def invalidate(tele_id):
+    with _lock:
+        _cache.pop(tele_id, None)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
+
+
+# everything the handlers need to know about the user, loaded once per update
+class UserContext:
+
+    def __init__(self, cursor, tele_id, row):
+        self.cursor = cursor
+        self.tele_id = tele_id
+        self.id, self.language, self._conversation = row
+
+    @property
+    def registered(self):
+        return self.id is not None
+
+    # (step, data) of the unfinished dialog or None
+    @property
+    def conversation(self):
+        if self._conversation is None or self._conversation[2] <= time.time():
+            return None
+
+        return self._conversation[:2]
+
+    def _row(self):
+        return self.id, self.language, self._conversation
+
+    # every setter writes to the DB and refreshes the cached row (write-through)
+    def _save(self):
+        if self.registered:
+            _cache_put(self.tele_id, self._row())
+            _pending_ids().add(self.tele_id)
+
+    def register(self, language):
+        self.cursor.execute('INSERT INTO Users(tele_id, language) VALUES(?, ?)', (self.tele_id, language))
+        self.id = self.cursor.lastrowid
+        self.language = language
+        self._save()
+
+    def set_language(self, language):
+        self.cursor.execute('UPDATE Users SET language = ? WHERE tele_id = ?', (language, self.tele_id))
+        self.language = language
+        self._save()
+
+    # starts a dialog or moves it to the next step, data - everything the step needs (JSON serializable)
+    def set_conversation(self, step, data=None):
+        data = data or {}
+        expires = time.time() + conversations.TTL
+
+        conversations.store.put(self.cursor, self.tele_id, step, data, expires)
+        self._conversation = (step, data, expires)
+        self._save()
+
+    def end_conversation(self):
+        if self._conversation is not None:
+            conversations.store.delete(self.cursor, self.tele_id)
+            self._conversation = None
+            self._save()
+
+
+def _pending_ids():
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    return _pending.ids
+
+
+def _on_commit():
+    _pending_ids().clear()
+
+
+# the cached rows were written through, but the transaction was rolled back
+def _on_rollback():
+    ids = _pending_ids()
+    for tele_id in ids:
+        invalidate(tele_id)
+    ids.clear()
+
+
+database.add_commit_hook(_on_commit)
+database.add_rollback_hook(_on_rollback)
+
+
+def load(cursor, tele_id):
+    row = _cache_get(tele_id)
+
+    if row is None:
+        cursor.execute('SELECT id, language FROM Users WHERE tele_id = ?', (tele_id,))
+        user = cursor.fetchone() or (None, None)
+        row = (*user, conversations.store.get(cursor, tele_id, time.time()))
+
+        # unregistered users are not cached, they are going to register soon
+        if row[0] is not None:
+            _cache_put(tele_id, row)
+
+    return UserContext(cursor, tele_id, row)
@@ -0,0 +1,194 @@
+# webhook entry point: Telegram POSTs updates to an HTTP server, they are put to a bounded queue
+# and handled by a pool of workers (see workers.WorkerPool)
+# usage: python webhook.py                           - serve (WEBHOOK_URL registers the webhook at Telegram)
+#        python webhook.py replay updates.jsonl [url] - POST recorded updates (one per line) to a running server
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from telebot import types
+
+import api_client
+import database
+import logs
+import main
+import metrics
+import overdue
+import reminders
+import workers
+import write_behind
+
+HOST = os.environ.get('WEBHOOK_HOST', '127.0.0.1')
+PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+
+# public address of PATH, the webhook is registered at Telegram only if it is set
+URL = os.environ.get('WEBHOOK_URL')
+
+# Telegram sends it in X-Telegram-Bot-Api-Secret-Token, requests without it are refused
+SECRET = os.environ.get('WEBHOOK_SECRET')
+
+WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+
+# if set, updates are handled by workers.ShardedExecutor with this many lanes instead of the worker pool
+LANES = int(os.environ.get('WEBHOOK_LANES', '0'))
+LANE_PROCESSES = bool(os.environ.get('WEBHOOK_LANE_PROCESSES'))
+
+# seconds, sent with 503 when the queue is full (Telegram redelivers refused updates)
+RETRY_AFTER = 1
+
+logger = logging.getLogger('main.webhook')
+
+
+# accepts one update or a list of updates as JSON
+def parse_updates(body):
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = [data]
+
+    return [types.Update.de_json(update) for update in data]
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+
+    # set by make_server()
+    pool = None
+
+    def do_POST(self):
+        if self.path != PATH:
+            return self._answer(404, {'ok': False})
+
+        if SECRET and self.headers.get('X-Telegram-Bot-Api-Secret-Token') != SECRET:
+            return self._answer(403, {'ok': False})
+
+        try:
+            updates = parse_updates(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        except (ValueError, TypeError, AttributeError, KeyError) as e:
+            return self._answer(400, {'ok': False, 'error': repr(e)})
+
+        if not self.pool.submit(updates):
+            return self._answer(503, {'ok': False, 'error': 'queue is full'}, {'Retry-After': str(RETRY_AFTER)})
+
+        self._answer(200, {'ok': True, 'queued': len(updates)})
+
+    # backpressure metrics
+    def do_GET(self):
+        if self.path != '/metrics':
+            return self._answer(404, {'ok': False})
+
+        self._answer(200, self.pool.metrics())
+
+    def _answer(self, code, data, headers=None):
+        body = json.dumps(data).encode()
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(pool, host=HOST, port=PORT):
+    handler = type('Handler', (WebhookHandler,), {'pool': pool})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve():
+    # handlers are executed by the pool, not by telebot`s thread pool
+    main.bot.threaded = False
+
+    # lane processes have their own API clients, the global limit is shared (see api_client.install_shared)
+    if LANES and LANE_PROCESSES:
+        client = api_client.install_shared(LANES + 1)
+        initializer = functools.partial(api_client.install_shared, LANES + 1)
+    else:
+        client = api_client.install()
+        initializer = None
+
+    if LANES:
+        pool = workers.ShardedExecutor(main.handle_update, LANES, QUEUE_SIZE, LANE_PROCESSES, initializer)
+    else:
+        pool = workers.WorkerPool(main.handle_update, WORKERS, QUEUE_SIZE)
+    pool.start()
+
+    metrics.add_gauges('pool', pool.metrics)
+    metrics.add_gauges('api', client.metrics)
+    metrics.add_gauges('logs', lambda: logs.stats)
+    metrics.start()
+
+    sweeper = overdue.Sweeper()
+    sweeper.start()
+    reminders.start(main.send_reminder)
+
+    if write_behind.ENABLED:
+        write_behind.start()
+        metrics.add_gauges('write_behind', write_behind.writer.metrics)
+
+    if URL:
+        main.bot.remove_webhook()
+        main.bot.set_webhook(URL, secret_token=SECRET, max_connections=WORKERS)
+
+    server = make_server(pool)
+    logger.info('Webhook is listening on %s:%s%s', HOST, PORT, PATH)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        reminders.stop()
+        sweeper.stop()
+        pool.stop()
+        write_behind.stop()
+        main.tracker.flush()
+        metrics.stop()
+        database.close_all()
+
+
+# POSTs recorded updates one by one, waits and repeats when the server is overloaded
+def replay(filename, url=f'http://{HOST}:{PORT}{PATH}'):
+    headers = {'Content-Type': 'application/json'}
+    if SECRET:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = SECRET
+
+    sent = 0
+    with open(filename, encoding='utf-8') as file:
+        for line in file:
+            if not line.strip():
+                continue
+
+            while True:
+                request = urllib.request.Request(url, line.encode(), headers)
+                try:
+                    urllib.request.urlopen(request).close()
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code != 503:
+                        raise
+                    time.sleep(float(e.headers.get('Retry-After', RETRY_AFTER)))
+
+            sent += 1
+
+    print(f'{sent} updates sent.')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['replay']:
+        replay(*sys.argv[2:4])
+    else:
+        serve()
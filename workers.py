@@ -0,0 +1,273 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from collections import deque
+
+# indexes in the stats array of a lane
+PROCESSED, FAILED, WAIT_TIME, HANDLE_TIME = range(4)
+
+
+# returns an id of the user who sent the update (None for updates without a user)
+def get_user_id(update):
+    for event in (update.message, update.callback_query, update.inline_query, update.edited_message):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+
+    return None
+
+
+# runs updates on a fixed number of threads, keeps the order of updates of every user
+# (next step handlers like name_step -> deadline_step -> priority_step depend on it)
+class WorkerPool:
+
+    def __init__(self, handle, workers=8, queue_size=1000):
+        # handle(update) processes one update
+        self.handle = handle
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+        # user id -> updates waiting for the update of the same user that is being handled now,
+        # they count against queue_size like the queued ones
+        self._busy = {}
+        self._waiting = 0
+
+        self.stats = {
+            'received': 0,
+            'rejected': 0,
+            'processed': 0,
+            'failed': 0,
+            'max_queue_depth': 0,
+            'wait_time': 0.0,
+            'handle_time': 0.0,
+        }
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # lets the workers finish everything that was queued
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    # puts all updates to the queue or none of them if there is not enough space, returns False in the last case
+    def submit(self, updates):
+        now = time.monotonic()
+
+        with self._condition:
+            self.stats['received'] += len(updates)
+
+            if self._depth() + len(updates) > self.queue_size:
+                self.stats['rejected'] += len(updates)
+                return False
+
+            for update in updates:
+                self._queue.append((now, update))
+
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self._depth())
+            self._condition.notify(len(updates))
+
+        return True
+
+    def metrics(self):
+        with self._condition:
+            metrics = dict(self.stats)
+            metrics['queue_depth'] = self._depth()
+            metrics['queue_size'] = self.queue_size
+            metrics['waiting_for_user'] = self._waiting
+            metrics['workers'] = self.workers
+
+        return metrics
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+
+                if not self._queue:
+                    return
+
+                queued_at, update = self._queue.popleft()
+                user_id = get_user_id(update)
+
+                # another worker handles this user now, it will take the update after the current one
+                if user_id is not None:
+                    if user_id in self._busy:
+                        self._busy[user_id].append((queued_at, update))
+                        self._waiting += 1
+                        continue
+                    self._busy[user_id] = deque()
+
+            while update is not None:
+                self._run(queued_at, update)
+
+                if user_id is None:
+                    break
+
+                with self._condition:
+                    waiting = self._busy[user_id]
+                    if waiting:
+                        queued_at, update = waiting.popleft()
+                        self._waiting -= 1
+                    else:
+                        del self._busy[user_id]
+                        update = None
+
+    # updates that are queued or wait for their user
+    def _depth(self):
+        return len(self._queue) + self._waiting
+
+    def _run(self, queued_at, update):
+        start = time.monotonic()
+
+        try:
+            self.handle(update)
+            failed = False
+        except Exception:
+            failed = True
+
+        end = time.monotonic()
+
+        with self._condition:
+            self.stats['failed' if failed else 'processed'] += 1
+            self.stats['wait_time'] += start - queued_at
+            self.stats['handle_time'] += end - start
+
+
+# puts every user to one of lanes, each lane handles its updates one by one in its own thread
+# (or process), so updates of one user are ordered and different users run in parallel
+class ShardedExecutor:
+
+    def __init__(self, handle, lanes=8, queue_size=1000, processes=False, initializer=None):
+        # handle(update) processes one update, it has to be a module level function for processes
+        self.handle = handle
+        self.lanes = lanes
+        # updates waiting in one lane
+        self.queue_size = queue_size
+        self.processes = processes
+        # initializer() is called by every lane process before its first update (spawned processes don`t
+        # have what the parent set up at runtime, e.g. api_client.install()), lanes of threads don`t call it
+        self.initializer = initializer
+
+        # processes are spawned, a forked child would share sqlite connections of the parent
+        context = multiprocessing.get_context('spawn')
+        self._queues = [context.Queue() if processes else queue.Queue() for _ in range(lanes)]
+        self._stats = [context.Array('d', 4) for _ in range(lanes)]
+        self._submitted = [0] * lanes
+        self._workers = []
+
+        self._lock = threading.Lock()
+        self.stats = {'received': 0, 'rejected': 0}
+
+    def start(self):
+        for lane in range(self.lanes):
+            args = (self.handle, self._queues[lane], self._stats[lane])
+
+            if self.processes:
+                context = multiprocessing.get_context('spawn')
+                worker = context.Process(target=_run_lane, args=(*args, self.initializer), name=f'lane-{lane}',
+                                         daemon=True)
+            else:
+                worker = threading.Thread(target=_run_lane, args=args, name=f'lane-{lane}', daemon=True)
+
+            worker.start()
+            self._workers.append(worker)
+
+    # lets the lanes finish everything that was queued
+    def stop(self):
+        for tasks in self._queues:
+            tasks.put(None)
+
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def lane(self, update):
+        user_id = get_user_id(update)
+        return (update.update_id if user_id is None else user_id) % self.lanes
+
+    # puts all updates to their lanes or none of them if some lane is full, returns False in the last case,
+    # with block=True waits until there is enough space
+    def submit(self, updates, block=False):
+        counts = [0] * self.lanes
+        for update in updates:
+            counts[self.lane(update)] += 1
+
+        with self._lock:
+            self.stats['received'] += len(updates)
+
+            while any(count and self._depth(lane) + count > self.queue_size for lane, count in enumerate(counts)):
+                if not block:
+                    self.stats['rejected'] += len(updates)
+                    return False
+                time.sleep(0.01)
+
+            now = time.time()
+            for update in updates:
+                lane = self.lane(update)
+                self._submitted[lane] += 1
+                self._queues[lane].put((now, update))
+
+        return True
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.stats)
+            depths = [self._depth(lane) for lane in range(self.lanes)]
+
+        for key, index in (('processed', PROCESSED), ('failed', FAILED),
+                           ('wait_time', WAIT_TIME), ('handle_time', HANDLE_TIME)):
+            metrics[key] = sum(stats[index] for stats in self._stats)
+
+        metrics['queue_depth'] = sum(depths)
+        metrics['max_lane_depth'] = max(depths)
+        metrics['lane_depths'] = depths
+        metrics['queue_size'] = self.queue_size
+        metrics['lanes'] = self.lanes
+        return metrics
+
+    # updates of the lane that are queued or being handled
+    def _depth(self, lane):
+        stats = self._stats[lane]
+        return self._submitted[lane] - int(stats[PROCESSED] + stats[FAILED])
+
+
+def _run_lane(handle, tasks, stats, initializer=None):
+    if initializer is not None:
+        initializer()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+
+        queued_at, update = task
+        start = time.time()
+
+        try:
+            handle(update)
+            result = PROCESSED
+        except Exception:
+            result = FAILED
+
+        end = time.time()
+
+        with stats.get_lock():
+            stats[result] += 1
+            stats[WAIT_TIME] += start - queued_at
+            stats[HANDLE_TIME] += end - start
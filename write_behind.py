@@ -0,0 +1,262 @@
+# small frequent writes (dialog steps, task status and deadline changes) can be queued and committed by one
+# background thread in batches, so many handlers share one transaction instead of committing one by one,
+# repeated writes of the same row are coalesced, only the last one is executed
+#
+# durability is chosen for every class of writes (see CLASSES):
+# sync  - written by the transaction of the handler, as if there were no write-behind
+# group - queued, the handler waits until the batch with its write is committed
+# lazy  - queued, the handler doesn`t wait, writes of the last FLUSH_INTERVAL can be lost on a crash and other
+#         connections may read the old row until the flush, so it`s only for rows that are read through
+#         a write-through cache (Conversations, see user_context.py)
+import database
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+SYNC = 'sync'
+GROUP = 'group'
+LAZY = 'lazy'
+
+# the bot starts the writer only if it`s enabled, otherwise every write is sync
+ENABLED = bool(os.environ.get('WRITE_BEHIND'))
+
+# seconds the writer collects a batch of lazy writes after the first one, group writes are committed as soon
+# as the previous batch is, the writes made meanwhile are the next batch
+FLUSH_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', '0.005'))
+
+# a batch is committed at once when it has that many writes
+MAX_BATCH = int(os.environ.get('WRITE_BEHIND_BATCH', '500'))
+
+# class of the write -> durability, e.g. WRITE_BEHIND_CLASSES='conversation=group,deadline=sync',
+# unknown classes are sync
+CLASSES = {'conversation': LAZY, 'status': GROUP, 'deadline': GROUP}
+
+logger = logging.getLogger('main.write_behind')
+
+# the writer of the running bot (see start()), without it every write is sync
+writer = None
+
+# writes of the current thread in a not yet committed session:
+# (shard, key) -> (durability, shard, sql, parameters, on_flush)
+_pending = threading.local()
+
+
+def parse_classes(text):
+    classes = {}
+
+    for item in text.split(','):
+        if item.strip():
+            name, _, durability = item.partition('=')
+            if durability.strip() not in (SYNC, GROUP, LAZY):
+                raise ValueError(f'unknown durability of {name.strip()}: {durability.strip()}')
+            classes[name.strip()] = durability.strip()
+
+    return classes
+
+
+CLASSES.update(parse_classes(os.environ.get('WRITE_BEHIND_CLASSES', '')))
+
+
+class Writer:
+
+    def __init__(self, interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.interval = interval
+        self.max_batch = max_batch
+
+        # (shard, key) -> (shard, sql, parameters, on_flush), in the order of the last writes
+        self._queue = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        # a handler waits for the queued writes
+        self._waited = False
+
+        # numbers of the last queued write and of the last committed one
+        self._queued = 0
+        self._flushed = 0
+
+        self.stats = {'queued': 0, 'coalesced': 0, 'written': 0, 'batches': 0, 'failed': 0, 'wait_time': 0.0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    # commits everything that was queued
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # queues the writes (see _queue), returns the number to wait for (see wait())
+    # or None if the writer is stopped, then the writes are committed by the calling thread
+    def submit(self, writes, wait=False):
+        with self._condition:
+            if not self._stopping:
+                for key, write in writes.items():
+                    if self._queue.pop(key, None) is not None:
+                        self.stats['coalesced'] += 1
+                    self._queue[key] = write
+
+                self._waited = self._waited or wait
+                self._queued += 1
+                self.stats['queued'] += len(writes)
+                self._condition.notify_all()
+                return self._queued
+
+        self._commit(list(writes.values()))
+        return None
+
+    # waits until the write with the number is committed
+    def wait(self, number):
+        start = time.perf_counter()
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._flushed >= number)
+            self.stats['wait_time'] += time.perf_counter() - start
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._stopping)
+
+                # lazy writes are collected for the interval unless the batch is full
+                self._condition.wait_for(lambda: len(self._queue) >= self.max_batch or self._waited or self._stopping,
+                                         self.interval)
+
+                writes = list(self._queue.values())
+                self._queue.clear()
+                self._waited = False
+                number = self._queued
+
+                if not writes and self._stopping:
+                    break
+
+            self._commit(writes)
+
+            with self._condition:
+                self._flushed = number
+                self._condition.notify_all()
+
+        database.close()
+
+    def _commit(self, writes):
+        self.stats['failed'] += commit(writes)
+        self.stats['written'] += len(writes)
+        self.stats['batches'] += 1
+
+    def metrics(self):
+        with self._condition:
+            return {**self.stats, 'queue_depth': len(self._queue)}
+
+
+def _execute(cursor, writes):
+    for shard, sql, parameters, on_flush in writes:
+        cursor.execute(sql, parameters)
+
+        # caches are invalidated in the session, so they are dropped once more after the commit
+        if on_flush is not None:
+            on_flush()
+
+
+# commits the writes ((shard, sql, parameters, on_flush)) in one transaction for every shard, if any of them
+# fails, the writes of the shard are committed one by one, returns how many of them failed
+def commit(writes):
+    return sum(_commit_shard(shard, [write for write in writes if write[0] == shard])
+               for shard in sorted({write[0] for write in writes}))
+
+
+def _commit_shard(shard, writes):
+    try:
+        with database.session(shard) as cursor:
+            _execute(cursor, writes)
+        return 0
+    except Exception as e:
+        logger.info('Batch of %s writes failed, writing them one by one: %r', len(writes), e)
+
+    failed = 0
+    for write in writes:
+        try:
+            with database.session(shard) as cursor:
+                _execute(cursor, [write])
+        except Exception as e:
+            failed += 1
+            logger.info('Write failed: %r', e)
+
+    return failed
+
+
+def start():
+    global writer
+
+    writer = Writer()
+    writer.start()
+
+
+def stop():
+    global writer
+
+    if writer is not None:
+        writer.stop()
+        writer = None
+
+
+# executes the write in the session or queues it until the session is committed, depending on the class
+# of the write, key - the row and the columns that are written (a write replaces the queued one with the
+# same key), on_flush() - called after the queued write (e.g. invalidates caches that could be filled
+# from the old row meanwhile), the write goes to the current shard (see database.use_shard())
+def execute(cursor, write_class, key, sql, parameters=(), on_flush=None):
+    durability = CLASSES.get(write_class, SYNC)
+
+    if writer is None or durability == SYNC:
+        cursor.execute(sql, parameters)
+        return
+
+    shard = database.current_shard()
+    writes = _pending_writes()
+    writes.pop((shard, key), None)
+    writes[(shard, key)] = (durability, shard, sql, parameters, on_flush)
+
+
+def _pending_writes():
+    if not hasattr(_pending, 'writes'):
+        _pending.writes = OrderedDict()
+    return _pending.writes
+
+
+# writes are queued only if the session is committed, the handler waits for the group ones
+def _on_commit():
+    pending = _pending_writes()
+    if not pending:
+        return
+
+    # cleared first, the writes can be committed by a nested session of this thread
+    wait = any(durability == GROUP for durability, *_ in pending.values())
+    writes = OrderedDict((key, write[1:]) for key, write in pending.items())
+    pending.clear()
+
+    current = writer
+
+    # the writer was stopped after the writes were made
+    if current is None:
+        commit(list(writes.values()))
+        return
+
+    number = current.submit(writes, wait)
+    if wait and number is not None:
+        current.wait(number)
+
+
+def _on_rollback():
+    _pending_writes().clear()
+
+
+database.add_commit_hook(_on_commit)
+database.add_rollback_hook(_on_rollback)